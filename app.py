@@ -13,7 +13,6 @@ import cv2
 import numpy as np
 from PIL import Image
 from io import BytesIO
-import pandas as pd
 import logging
 
 # Add DeepFace to sys.path
@@ -71,13 +70,17 @@ def init_deepface():
         return False
 
 # Create database tables
-with app.app_context():
+from models.migrations import migration_lock, run_migrations
+with app.app_context(), migration_lock(db):
     # Import database models
     from models.models import User, Student, Faculty, Admin, Course, Attendance, TimeTable
     
     # Create the tables
     db.create_all()
     
+    # Add columns and convert data for databases created by older versions
+    run_migrations(db)
+    
     # Create admin user if it doesn't exist
     admin = Admin.query.filter_by(email='admin@example.com').first()
     if not admin:
@@ -110,6 +113,16 @@ with app.app_context():
     # Register blueprints
     register_blueprints()
     
+    # Count in-flight requests and time every endpoint for /metrics
+    from utils.metrics import init_request_metrics
+    init_request_metrics(app)
+    
+    # Optionally build the recognition models now, so that with `gunicorn --preload`
+    # they are loaded once in the master and shared copy-on-write by the workers
+    from utils.model_warmup import PRELOAD_MODELS, load_models
+    if PRELOAD_MODELS:
+        load_models()
+    
     # Import necessary modules for login_manager
     from models.models import Student, Faculty, Admin
     
@@ -0,0 +1,174 @@
+"""
+Latency of the hot attendance queries with and without the attendance indexes
+
+    python -m benchmarks.attendance_queries [--faculty 100] [--history-days 90]
+                                            [--db benchmarks/results/attendance.db] [--reseed]
+                                            [--repeats 50] [--output results.json]
+
+A SQLite database is seeded like the load test's, by default with 200 courses of 60
+students and 91 sessions each (about 1.1 million attendance rows). The indexes of
+the attendance table are dropped, the lookups of the faculty and student routes are
+timed, the migration that creates the indexes is run and timed, and the lookups are
+timed again.
+"""
+import os
+import sys
+import time
+import random
+import logging
+import argparse
+from datetime import date, timedelta
+from itertools import cycle
+
+from benchmarks.harness import (
+    RESULTS_DIR, compare_results, environment, max_rss_mb, measure, print_comparison, print_results,
+    save_results
+)
+from benchmarks.load_test import seed
+
+DEFAULT_DB = os.path.join(RESULTS_DIR, 'attendance.db')
+
+# Distinct keys each case cycles through, so that calls do not repeat one lookup
+SAMPLES = 200
+
+def _samples(db, history_days, count=SAMPLES):
+    """(student, course, timetable, date) keys of random enrolled students and sessions"""
+    from models.models import TimeTable, student_course
+
+    rng = random.Random(0)
+    enrollments = db.session.query(
+        student_course.c.student_id, student_course.c.course_id, TimeTable.id
+    ).join(TimeTable, TimeTable.course_id == student_course.c.course_id).all()
+    today = date.today()
+    return [
+        (*rng.choice(enrollments), today - timedelta(days=rng.randint(0, history_days)))
+        for _ in range(count)
+    ]
+
+def _time_queries(db, samples, repeats):
+    """Time each hot query on the current schema"""
+    from models.models import Attendance
+    from utils.attendance_reports import course_attendance_summary
+
+    def cycled(query):
+        keys = cycle(samples)
+        return lambda: query(*next(keys))
+
+    queries = {
+        # start_session, take_attendance and snapshot attendance, once per student
+        'session_lookup': lambda student_id, course_id, timetable_id, day: Attendance.query.filter_by(
+            student_id=student_id, course_id=course_id, timetable_id=timetable_id, date=day
+        ).first(),
+        # get_attendance_students
+        'session_roster': lambda student_id, course_id, timetable_id, day: Attendance.query.filter_by(
+            course_id=course_id, timetable_id=timetable_id, date=day
+        ).all(),
+        # student dashboard and a student's course history
+        'student_course_history': lambda student_id, course_id, timetable_id, day: Attendance.query.filter_by(
+            student_id=student_id, course_id=course_id
+        ).order_by(Attendance.date.desc()).all(),
+        # faculty and admin attendance reports
+        'course_summary': lambda student_id, course_id, timetable_id, day: course_attendance_summary(course_id),
+    }
+
+    cases = {}
+    for name, query in queries.items():
+        cases[name] = measure(cycled(query), repeats=repeats, trace_memory=False)
+        # Release the loaded objects between cases
+        db.session.remove()
+    return cases
+
+def _drop_attendance_indexes(db):
+    from sqlalchemy import inspect
+    from models.models import Attendance
+
+    existing = {index['name'] for index in inspect(db.engine).get_indexes(Attendance.__tablename__)}
+    for index in Attendance.__table__.indexes:
+        if index.name in existing:
+            index.drop(db.engine)
+
+def run(app, db, history_days, repeats=50):
+    """
+    Time the queries without indexes, run the migration, and time them again
+
+    Returns:
+        Result dictionary with the cases of both runs (suffixed [before] and [after])
+    """
+    from models.migrations import run_migrations
+    from models.models import Attendance
+
+    with app.app_context():
+        rows = db.session.query(Attendance.id).count()
+        database = db.engine.url.render_as_string(hide_password=True)
+        samples = _samples(db, history_days)
+
+        _drop_attendance_indexes(db)
+        before = _time_queries(db, samples, repeats)
+
+        start = time.perf_counter()
+        run_migrations(db)
+        migration_s = round(time.perf_counter() - start, 2)
+
+        after = _time_queries(db, samples, repeats)
+
+    cases = {f'{name}[before]': result for name, result in before.items()}
+    cases.update({f'{name}[after]': result for name, result in after.items()})
+    return {
+        'name': 'attendance_queries',
+        'environment': environment(),
+        'config': {
+            'database': database,
+            'attendance_rows': rows,
+            'repeats': repeats
+        },
+        'migration_s': migration_s,
+        'cases': cases,
+        'max_rss_mb': max_rss_mb()
+    }
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.attendance_queries',
+                                     description=__doc__.split('\n\n')[0])
+    parser.add_argument('--db', default=DEFAULT_DB, help='SQLite database to seed and use (default: %(default)s)')
+    parser.add_argument('--reseed', action='store_true', help='delete and seed the database again')
+    parser.add_argument('--faculty', type=int, default=100, help='faculty to seed (default: %(default)s)')
+    parser.add_argument('--courses-per-faculty', type=int, default=2)
+    parser.add_argument('--students-per-course', type=int, default=60)
+    parser.add_argument('--history-days', type=int, default=90, help='past sessions per course to seed')
+    parser.add_argument('--repeats', type=int, default=50, help='timed calls per case (default: %(default)s)')
+    parser.add_argument('--output', help='result file (default: benchmarks/results/attendance_queries-<time>.json)')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+
+    db_path = os.path.abspath(args.db)
+    if args.reseed and os.path.exists(db_path):
+        os.remove(db_path)
+    fresh = not os.path.exists(db_path)
+    os.makedirs(os.path.dirname(db_path), exist_ok=True)
+
+    # The app reads its database URI on import
+    os.environ['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
+    from app import app, db
+
+    if fresh:
+        seed(app, db, faculty_count=args.faculty, courses_per_faculty=args.courses_per_faculty,
+             students_per_course=args.students_per_course, history_days=args.history_days)
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    results = run(app, db, args.history_days, repeats=args.repeats)
+    print(f"{results['config']['attendance_rows']} attendance rows\n")
+    print_results(results)
+    print(f"\nMigration (deduplication and indexes) took {results['migration_s']} s")
+    runs = {
+        stage: {'cases': {case[:-len(f'[{stage}]')]: result for case, result in results['cases'].items()
+                          if case.endswith(f'[{stage}]')}}
+        for stage in ('before', 'after')
+    }
+    print_comparison(compare_results(runs['before'], runs['after']), threshold=0.15)
+    print(f"\nSaved to {save_results(results, args.output)}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,137 @@
+import os
+import sys
+import json
+import time
+import platform
+import resource
+import subprocess
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+def _percentile(samples, q):
+    return round(float(np.percentile(samples, q)), 3)
+
+def measure(fn, repeats=20, warmup=2, trace_memory=True):
+    """
+    Time repeated calls of fn
+
+    Memory is measured on one extra traced call, so tracing does not slow down the
+    timed ones. tracemalloc sees Python and NumPy allocations but not the native
+    buffers of TensorFlow, ONNX Runtime or MediaPipe.
+
+    Returns:
+        Dictionary with the median, p95, mean and minimum latency in milliseconds,
+        the number of timed calls and the peak traced memory of a call in MB
+    """
+    for _ in range(warmup):
+        fn()
+
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+
+    result = {
+        'median_ms': _percentile(samples, 50),
+        'p95_ms': _percentile(samples, 95),
+        'mean_ms': round(float(np.mean(samples)), 3),
+        'min_ms': round(float(np.min(samples)), 3),
+        'repeats': repeats
+    }
+
+    if trace_memory:
+        tracemalloc.start()
+        try:
+            fn()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        result['peak_mb'] = round(peak / 2 ** 20, 3)
+
+    return result
+
+def max_rss_mb():
+    """Peak resident memory of this process so far"""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return round(rss / (2 ** 20 if sys.platform == 'darwin' else 2 ** 10), 1)
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, timeout=5,
+            cwd=os.path.dirname(RESULTS_DIR)
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def environment():
+    """Machine and library versions, stored with every result file"""
+    import cv2
+
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'opencv': cv2.__version__,
+        'commit': _git_commit()
+    }
+
+def save_results(results, path=None):
+    """Write results as JSON, by default to benchmarks/results/<name>-<timestamp>.json"""
+    if path is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+        path = os.path.join(RESULTS_DIR, f"{results['name']}-{stamp}.json")
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
+    return path
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
+
+def compare_results(baseline, current, threshold=0.15, min_delta_ms=0.1):
+    """
+    Compare the median latency of every case present in both runs
+
+    Returns:
+        List of (case, baseline ms, current ms, relative change, regressed) tuples;
+        a case regressed when its median grew by more than threshold and by more
+        than min_delta_ms, so timer noise on sub-millisecond cases is not flagged
+    """
+    rows = []
+    for case, result in current['cases'].items():
+        before = baseline['cases'].get(case)
+        if not before or 'median_ms' not in before or 'median_ms' not in result:
+            continue
+        change = (result['median_ms'] - before['median_ms']) / max(before['median_ms'], 1e-9)
+        regressed = change > threshold and result['median_ms'] - before['median_ms'] > min_delta_ms
+        rows.append((case, before['median_ms'], result['median_ms'], change, regressed))
+    return rows
+
+def print_results(results):
+    print(f"{'case':<44} {'median ms':>10} {'p95 ms':>10} {'peak MB':>9}")
+    for case, result in results['cases'].items():
+        if 'skipped' in result:
+            print(f"{case:<44} skipped: {result['skipped']}")
+            continue
+        peak = result.get('peak_mb')
+        # Quality figures reported next to the timings, e.g. recall@1 of an ANN index
+        quality = ''.join(f"  {key} {value}" for key, value in result.items() if key.startswith('recall@'))
+        print(f"{case:<44} {result['median_ms']:>10.2f} {result['p95_ms']:>10.2f} "
+              f"{'' if peak is None else f'{peak:.2f}':>9}{quality}")
+
+def print_comparison(rows, threshold):
+    print(f"\n{'case':<44} {'before':>10} {'after':>10} {'change':>8}")
+    for case, before, after, change, regressed in rows:
+        flag = '  REGRESSION' if regressed else ''
+        print(f"{case:<44} {before:>10.2f} {after:>10.2f} {change:>+8.1%}{flag}")
+    regressions = sum(row[4] for row in rows)
+    print(f"\n{regressions} of {len(rows)} cases slower by more than {threshold:.0%}")
@@ -0,0 +1,414 @@
+"""
+Load test of the attendance and dashboard endpoints against a seeded SQLite database
+
+    python -m benchmarks.load_test [--users 40] [--duration 60] [--mix attendance=1,toggle=4,...]
+                                   [--db benchmarks/results/loadtest.db] [--reseed]
+                                   [--url http://127.0.0.1:8000] [--output results.json]
+
+Virtual users replay a weighted mix of snapshot uploads (faculty.auto_attendance),
+roster fetches (faculty.get_attendance_students), attendance toggles
+(faculty.mark_attendance) and faculty and student dashboards, as many faculty and
+students at once. Without --url the app runs in this process behind Flask test
+clients; with --url requests go to a running server, e.g. gunicorn started with
+
+    SQLALCHEMY_DATABASE_URI=sqlite:///$PWD/benchmarks/results/loadtest.db \\
+        gunicorn -c gunicorn.conf.py app:app
+
+and the same SECRET_KEY, since users are logged in with signed session cookies.
+Throughput, latency percentiles and error rates are reported per endpoint.
+"""
+import os
+import sys
+import time
+import random
+import logging
+import argparse
+import threading
+from datetime import date, datetime, timedelta, time as clock
+
+import cv2
+import numpy as np
+
+from benchmarks.harness import RESULTS_DIR, environment, save_results
+
+DEFAULT_DB = os.path.join(RESULTS_DIR, 'loadtest.db')
+
+# Relative weight of every scenario in the request mix
+DEFAULT_MIX = {
+    'attendance': 1,
+    'roster': 2,
+    'toggle': 4,
+    'faculty_dashboard': 1,
+    'student_dashboard': 8,
+}
+
+DEPARTMENT = 'CSE'
+YEAR = 2
+
+# Attendance rows bulk-inserted at a time while seeding
+SEED_CHUNK_SIZE = 50000
+
+def seed(app, db, faculty_count=40, courses_per_faculty=2, students_per_course=60, history_days=30):
+    """
+    Fill an empty database with faculty, courses, enrolled students (with random
+    embeddings of the canonical model), today's timetable and attendance history
+
+    Rows are bulk-inserted, so thousands of students take seconds.
+    """
+    from models.models import Attendance, Course, Faculty, Student, TimeTable, student_course
+    from utils.embedding_models import get_embedding_model_spec
+    from utils.embedding_store import encode_embedding
+
+    spec = get_embedding_model_spec()
+    rng = np.random.default_rng(0)
+    today = date.today()
+    weekday = today.strftime('%A')
+
+    with app.app_context():
+        db.session.execute(Faculty.__table__.insert(), [
+            {'name': f'Faculty {i}', 'email': f'faculty{i}@load.test', 'department': DEPARTMENT,
+             'is_approved': True, 'created_at': datetime.utcnow()}
+            for i in range(faculty_count)
+        ])
+        course_count = faculty_count * courses_per_faculty
+        db.session.execute(Course.__table__.insert(), [
+            {'course_code': f'LT{i:04d}', 'name': f'Load Test Course {i}', 'credits': 3,
+             'department': DEPARTMENT, 'year': YEAR}
+            for i in range(course_count)
+        ])
+        db.session.execute(Student.__table__.insert(), [
+            {'name': f'Student {i}', 'email': f'student{i}@load.test', 'roll_number': f'LT{i:06d}',
+             'department': DEPARTMENT, 'year': YEAR, 'is_approved': True, 'created_at': datetime.utcnow(),
+             'face_embedding': encode_embedding(rng.standard_normal(spec.dim).astype(np.float32)),
+             'face_embedding_model': spec.tag, 'face_embedding_dim': spec.dim}
+            for i in range(course_count * students_per_course)
+        ])
+        db.session.commit()
+
+        faculty_ids = [row[0] for row in db.session.query(Faculty.id).order_by(Faculty.id)]
+        course_ids = [row[0] for row in db.session.query(Course.id).order_by(Course.id)]
+        student_ids = [row[0] for row in db.session.query(Student.id).order_by(Student.id)]
+
+        # Every course meets today, one hour per course of its faculty
+        timetables = []
+        for i, course_id in enumerate(course_ids):
+            hour = 9 + i % courses_per_faculty
+            timetables.append({
+                'day': weekday, 'start_time': clock(hour), 'end_time': clock(hour + 1),
+                'room': f'R{i}', 'year': YEAR, 'course_id': course_id,
+                'faculty_id': faculty_ids[i // courses_per_faculty]
+            })
+        db.session.execute(TimeTable.__table__.insert(), timetables)
+        timetable_ids = [row[0] for row in db.session.query(TimeTable.id).order_by(TimeTable.id)]
+
+        enrollments = []
+        attendance = []
+        attendance_count = 0
+        for i, (course_id, timetable_id) in enumerate(zip(course_ids, timetable_ids)):
+            roster = student_ids[i * students_per_course:(i + 1) * students_per_course]
+            enrollments.extend({'student_id': s, 'course_id': course_id} for s in roster)
+            # Past sessions (marked) and today's session (not marked yet)
+            for days_ago in range(history_days, -1, -1):
+                day = today - timedelta(days=days_ago)
+                present = rng.random(len(roster)) < 0.8
+                attendance.extend({
+                    'student_id': s, 'course_id': course_id, 'timetable_id': timetable_id, 'date': day,
+                    'is_present': bool(p) and days_ago > 0, 'marked_by': 'auto',
+                    'phone_usage_count': 0
+                } for s, p in zip(roster, present))
+            # Insert in chunks, so that millions of rows do not sit in memory
+            if len(attendance) >= SEED_CHUNK_SIZE or i == len(course_ids) - 1:
+                db.session.execute(Attendance.__table__.insert(), attendance)
+                attendance_count += len(attendance)
+                attendance = []
+        db.session.execute(student_course.insert(), enrollments)
+        db.session.commit()
+
+        logging.getLogger(__name__).info(
+            f"Seeded {faculty_count} faculty, {course_count} courses, {len(student_ids)} students "
+            f"and {attendance_count} attendance rows"
+        )
+
+def load_fixtures(app, db):
+    """
+    The identities and records the scenarios pick from
+
+    Returns:
+        Dictionary with faculty ids, each faculty's timetable ids and today's
+        attendance ids, and student ids
+    """
+    from models.models import Attendance, Faculty, Student, TimeTable
+
+    with app.app_context():
+        timetables = {}
+        for timetable_id, faculty_id in db.session.query(TimeTable.id, TimeTable.faculty_id):
+            timetables.setdefault(faculty_id, []).append(timetable_id)
+
+        today_records = {}
+        for attendance_id, faculty_id in db.session.query(Attendance.id, TimeTable.faculty_id).join(
+            TimeTable, TimeTable.id == Attendance.timetable_id
+        ).filter(Attendance.date == date.today()):
+            today_records.setdefault(faculty_id, []).append(attendance_id)
+
+        return {
+            'faculty': [row[0] for row in db.session.query(Faculty.id) if row[0] in timetables],
+            'timetables': timetables,
+            'attendance': today_records,
+            'students': [row[0] for row in db.session.query(Student.id)]
+        }
+
+def snapshot_bytes():
+    """A JPEG classroom snapshot, as uploaded by the attendance page"""
+    from benchmarks.recognition import synthetic_classroom
+
+    img, _ = synthetic_classroom()
+    return cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, 85])[1].tobytes()
+
+class FlaskClientTransport:
+    """Requests served by the app in this process, one Flask test client per virtual user"""
+
+    def __init__(self, app):
+        self.app = app
+
+    def session(self, user_id):
+        client = self.app.test_client()
+        with client.session_transaction() as sess:
+            sess['_user_id'] = user_id
+            sess['_fresh'] = True
+        return client
+
+    def request(self, client, method, path, **kwargs):
+        response = client.open(path, method=method, data=kwargs.get('data'),
+                               content_type=kwargs.get('content_type'))
+        payload = response.get_json(silent=True) if response.is_json else None
+        return response.status_code, payload
+
+class HttpTransport:
+    """Requests sent to a running server, logged in with session cookies signed by the app's key"""
+
+    def __init__(self, app, base_url):
+        import requests
+
+        self.requests = requests
+        self.base_url = base_url.rstrip('/')
+        self.serializer = app.session_interface.get_signing_serializer(app)
+        self.cookie_name = app.config.get('SESSION_COOKIE_NAME', 'session')
+
+    def session(self, user_id):
+        http = self.requests.Session()
+        http.cookies.set(self.cookie_name, self.serializer.dumps({'_user_id': user_id, '_fresh': True}))
+        return http
+
+    def request(self, http, method, path, **kwargs):
+        headers = {'Content-Type': kwargs['content_type']} if kwargs.get('content_type') else {}
+        response = http.request(method, self.base_url + path, data=kwargs.get('data'), headers=headers,
+                                allow_redirects=False, timeout=300)
+        try:
+            payload = response.json()
+        except ValueError:
+            payload = None
+        return response.status_code, payload
+
+class LoadTest:
+    """Virtual users picking weighted scenarios until the deadline"""
+
+    def __init__(self, transport, fixtures, mix, image_bytes):
+        self.transport = transport
+        self.fixtures = fixtures
+        self.scenarios = [name for name, weight in mix.items() if weight > 0]
+        self.weights = [mix[name] for name in self.scenarios]
+        self.image_bytes = image_bytes
+        self.samples = {name: [] for name in self.scenarios}
+        self.errors = {name: 0 for name in self.scenarios}
+        self.error_messages = {}
+        self._lock = threading.Lock()
+        self._sessions = threading.local()
+
+    def _session(self, user_id):
+        sessions = getattr(self._sessions, 'by_user', None)
+        if sessions is None:
+            sessions = self._sessions.by_user = {}
+        if user_id not in sessions:
+            sessions[user_id] = self.transport.session(user_id)
+        return sessions[user_id]
+
+    def _request(self, rng, scenario):
+        """Build and send one request of a scenario; returns (status, JSON payload)"""
+        fixtures = self.fixtures
+        if scenario == 'student_dashboard':
+            session = self._session(f"student_{rng.choice(fixtures['students'])}")
+            return self.transport.request(session, 'GET', '/student/dashboard')
+
+        faculty_id = rng.choice(fixtures['faculty'])
+        session = self._session(f"faculty_{faculty_id}")
+        timetable_id = rng.choice(fixtures['timetables'][faculty_id])
+
+        if scenario == 'faculty_dashboard':
+            return self.transport.request(session, 'GET', '/faculty/dashboard')
+        if scenario == 'roster':
+            return self.transport.request(session, 'GET', f'/faculty/attendance/get_students/{timetable_id}')
+        if scenario == 'toggle':
+            attendance_id = rng.choice(fixtures['attendance'][faculty_id])
+            return self.transport.request(session, 'POST',
+                                          f'/faculty/mark_attendance/{attendance_id}/{rng.randint(0, 1)}')
+        if scenario == 'attendance':
+            return self.transport.request(session, 'POST', f'/faculty/auto_attendance/{timetable_id}',
+                                          data=self.image_bytes, content_type='image/jpeg')
+        raise ValueError(f"Unknown scenario {scenario}")
+
+    def _user(self, seed, deadline, max_requests):
+        rng = random.Random(seed)
+        while time.perf_counter() < deadline:
+            with self._lock:
+                if max_requests is not None and sum(map(len, self.samples.values())) >= max_requests:
+                    return
+            scenario = rng.choices(self.scenarios, self.weights)[0]
+            start = time.perf_counter()
+            try:
+                status, payload = self._request(rng, scenario)
+                # Redirects mean the session was not accepted; JSON APIs report failures in the body
+                error = f"HTTP {status}" if status >= 300 else None
+                if error is None and isinstance(payload, dict) and payload.get('success') is False:
+                    error = payload.get('message') or 'success: false'
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+            ms = (time.perf_counter() - start) * 1000
+
+            with self._lock:
+                self.samples[scenario].append(ms)
+                if error:
+                    self.errors[scenario] += 1
+                    self.error_messages.setdefault(scenario, {}).setdefault(error[:200], 0)
+                    self.error_messages[scenario][error[:200]] += 1
+
+    def run(self, users, duration, max_requests=None):
+        deadline = time.perf_counter() + duration
+        start = time.perf_counter()
+        threads = [
+            threading.Thread(target=self._user, args=(seed, deadline, max_requests), name=f'load-user-{seed}')
+            for seed in range(users)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - start
+
+    def summary(self, elapsed):
+        """Per-scenario and overall throughput, latency percentiles and error rate"""
+        def stats(samples, errors):
+            if not samples:
+                return {'requests': 0, 'errors': 0}
+            samples = np.asarray(samples)
+            return {
+                'requests': len(samples),
+                'errors': errors,
+                'error_rate': round(errors / len(samples), 4),
+                'throughput_rps': round(len(samples) / elapsed, 2),
+                'p50_ms': round(float(np.percentile(samples, 50)), 1),
+                'p90_ms': round(float(np.percentile(samples, 90)), 1),
+                'p95_ms': round(float(np.percentile(samples, 95)), 1),
+                'p99_ms': round(float(np.percentile(samples, 99)), 1),
+                'max_ms': round(float(samples.max()), 1)
+            }
+
+        endpoints = {name: stats(self.samples[name], self.errors[name]) for name in self.scenarios}
+        endpoints['all'] = stats([ms for name in self.scenarios for ms in self.samples[name]],
+                                 sum(self.errors.values()))
+        return endpoints
+
+def print_summary(endpoints, error_messages):
+    print(f"{'endpoint':<20} {'requests':>9} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} "
+          f"{'max ms':>9} {'errors':>8}")
+    for name, result in endpoints.items():
+        if not result['requests']:
+            print(f"{name:<20} {0:>9}")
+            continue
+        print(f"{name:<20} {result['requests']:>9} {result['throughput_rps']:>8.1f} {result['p50_ms']:>9.1f} "
+              f"{result['p95_ms']:>9.1f} {result['p99_ms']:>9.1f} {result['max_ms']:>9.1f} "
+              f"{result['error_rate']:>8.1%}")
+    for name, messages in error_messages.items():
+        for message, count in sorted(messages.items(), key=lambda item: -item[1])[:3]:
+            print(f"  {name}: {count} x {message}")
+
+def parse_mix(text):
+    mix = dict(DEFAULT_MIX)
+    for part in filter(None, (text or '').split(',')):
+        name, _, weight = part.partition('=')
+        if name not in DEFAULT_MIX:
+            raise ValueError(f"Unknown scenario {name}; expected one of {', '.join(DEFAULT_MIX)}")
+        mix[name] = float(weight)
+    return mix
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.load_test',
+                                     description=__doc__.split('\n\n')[0])
+    parser.add_argument('--url', help='base URL of a running server (default: serve in-process)')
+    parser.add_argument('--db', default=DEFAULT_DB, help='SQLite database to seed and use (default: %(default)s)')
+    parser.add_argument('--reseed', action='store_true', help='delete and seed the database again')
+    parser.add_argument('--seed-only', action='store_true', help='seed the database and exit')
+    parser.add_argument('--faculty', type=int, default=40, help='faculty to seed (default: %(default)s)')
+    parser.add_argument('--courses-per-faculty', type=int, default=2)
+    parser.add_argument('--students-per-course', type=int, default=60)
+    parser.add_argument('--history-days', type=int, default=30, help='past sessions per course to seed')
+    parser.add_argument('--users', type=int, default=40, help='concurrent virtual users (default: %(default)s)')
+    parser.add_argument('--duration', type=float, default=60, help='seconds to run (default: %(default)s)')
+    parser.add_argument('--requests', type=int, help='stop after this many requests')
+    parser.add_argument('--mix', help='scenario weights, e.g. attendance=1,toggle=4 (others keep their defaults)')
+    parser.add_argument('--output', help='result file (default: benchmarks/results/load-<time>.json)')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    mix = parse_mix(args.mix)
+
+    db_path = os.path.abspath(args.db)
+    if args.reseed and os.path.exists(db_path):
+        os.remove(db_path)
+    fresh = not os.path.exists(db_path)
+    os.makedirs(os.path.dirname(db_path), exist_ok=True)
+
+    # The app reads its database URI on import
+    os.environ['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
+    from app import app, db
+
+    if fresh:
+        seed(app, db, faculty_count=args.faculty, courses_per_faculty=args.courses_per_faculty,
+             students_per_course=args.students_per_course, history_days=args.history_days)
+    if args.seed_only:
+        print(db_path)
+        return 0
+
+    # Only the load test's own output from here on
+    logging.getLogger().setLevel(logging.WARNING)
+
+    fixtures = load_fixtures(app, db)
+    if not fixtures['faculty']:
+        print(f"{db_path} has no seeded timetables; run with --reseed")
+        return 1
+
+    transport = HttpTransport(app, args.url) if args.url else FlaskClientTransport(app)
+    test = LoadTest(transport, fixtures, mix, snapshot_bytes())
+    elapsed = test.run(args.users, args.duration, args.requests)
+    endpoints = test.summary(elapsed)
+    print_summary(endpoints, test.error_messages)
+
+    results = {
+        'name': 'load',
+        'environment': environment(),
+        'config': {
+            'target': args.url or 'in-process',
+            'database': db_path,
+            'users': args.users,
+            'duration_s': round(elapsed, 1),
+            'mix': mix,
+            'faculty': len(fixtures['faculty']),
+            'students': len(fixtures['students'])
+        },
+        'endpoints': endpoints,
+        'errors': test.error_messages
+    }
+    print(f"\nSaved to {save_results(results, args.output)}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
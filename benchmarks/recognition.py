@@ -0,0 +1,244 @@
+"""
+Micro-benchmarks of the recognition pipeline, offline on CPU
+
+    python -m benchmarks.recognition [--sizes 50,500,5000] [--repeats 20]
+                                     [--output results.json] [--compare baseline.json]
+
+Every stage (decode, detection, quality gating, alignment, embedding, matching,
+campus index search with its recall) and the end-to-end process_attendance_image are timed on a synthetic classroom snapshot
+built from the sample faces in face_data, against synthetic galleries of random
+embeddings. Results are written as JSON; with --compare the medians are checked
+against an earlier result file and the exit status is 1 if any case regressed.
+"""
+import os
+import sys
+import logging
+import argparse
+
+import cv2
+import numpy as np
+
+from benchmarks.harness import (
+    compare_results, environment, load_results, max_rss_mb, measure, print_comparison,
+    print_results, save_results
+)
+
+GALLERY_SIZES = (50, 500, 5000)
+
+# Templates per student in the synthetic galleries (FACE_TEMPLATES_PER_STUDENT is the cap)
+TEMPLATES_PER_STUDENT = 3
+
+SNAPSHOT_SIZE = (1920, 1080)
+FACE_DATA_DIR = 'face_data'
+
+def synthetic_classroom(width=SNAPSHOT_SIZE[0], height=SNAPSHOT_SIZE[1], rows=4, columns=8,
+                        face_data_dir=FACE_DATA_DIR):
+    """
+    A classroom-like snapshot: the sample faces pasted in rows that shrink towards the
+    back of the room, or drawn faces when face_data holds no images
+
+    Returns:
+        (BGR image, list of the pasted (x, y, w, h) boxes)
+    """
+    samples = []
+    if os.path.isdir(face_data_dir):
+        for filename in sorted(os.listdir(face_data_dir)):
+            img = cv2.imread(os.path.join(face_data_dir, filename)) if filename.endswith('.jpg') else None
+            if img is not None:
+                samples.append(img)
+
+    rng = np.random.default_rng(0)
+    canvas = np.full((height, width, 3), 110, dtype=np.uint8)
+    canvas += rng.integers(0, 20, canvas.shape, dtype=np.uint8)
+
+    boxes = []
+    row_height = height // rows
+    cell_width = width // columns
+    for row in range(rows):
+        # The back row is at the top and half the size of the front one
+        size = int(min(row_height, cell_width) * (0.45 + 0.45 * row / max(rows - 1, 1)))
+        y = row * row_height + (row_height - size) // 2
+        for column in range(columns):
+            x = column * cell_width + (cell_width - size) // 2
+            if samples:
+                face = cv2.resize(samples[(row * columns + column) % len(samples)], (size, size))
+                canvas[y:y + size, x:x + size] = face
+            else:
+                center = (x + size // 2, y + size // 2)
+                cv2.ellipse(canvas, center, (size // 3, size // 2 - 2), 0, 0, 360, (150, 180, 220), -1)
+                for dx in (-size // 7, size // 7):
+                    cv2.circle(canvas, (center[0] + dx, center[1] - size // 8), max(2, size // 20), (40, 40, 40), -1)
+                cv2.ellipse(canvas, (center[0], center[1] + size // 5), (size // 8, size // 20), 0, 0, 180,
+                            (60, 60, 160), 2)
+            boxes.append((x, y, size, size))
+    return canvas, boxes
+
+def synthetic_gallery(size, dim, templates_per_student=TEMPLATES_PER_STUDENT, planted=None, seed=0):
+    """
+    A gallery of size students with random templates
+
+    planted, if given, replaces the first templates of the first students with real
+    embeddings, so that recognition finds matches and runs the assignment step
+    """
+    from utils.gallery import Gallery
+
+    rng = np.random.default_rng(seed)
+    ids = [f"bench{i:06d}" for i in range(size)]
+    template_ids = [identity for identity in ids for _ in range(templates_per_student)]
+    embeddings = rng.standard_normal((len(template_ids), dim)).astype(np.float32)
+    if planted is not None and len(planted):
+        count = min(len(planted), size)
+        embeddings[::templates_per_student][:count] = planted[:count]
+    return Gallery.from_templates(template_ids, embeddings,
+                                  student_ids={identity: i for i, identity in enumerate(ids)})
+
+def returning_faces(embeddings, count=200, seed=0):
+    """
+    Queries for recall: embeddings of up to count identities with noise added, at a
+    cosine similarity of about 0.7 to the original like a new photo of an enrolled face
+    """
+    rng = np.random.default_rng(seed)
+    embeddings = embeddings[rng.choice(len(embeddings), size=min(count, len(embeddings)), replace=False)]
+    embeddings = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+    noise = rng.standard_normal(embeddings.shape) / np.sqrt(embeddings.shape[1])
+    return (embeddings + noise).astype(np.float32)
+
+def _embedding_backend_error():
+    """None if the embedding model can run here, else the reason it cannot"""
+    from utils.advanced_face_recognition import get_embedding_backend
+
+    try:
+        get_embedding_backend()
+        return None
+    except Exception as e:
+        return str(e) or type(e).__name__
+
+def run(sizes=GALLERY_SIZES, repeats=20, tiled=True):
+    """
+    Benchmark every stage once per configuration
+
+    Returns:
+        Result dictionary (name, environment, config, cases) ready to be saved
+    """
+    from utils import advanced_face_recognition as afr
+    from utils.ann_index import IVFIndex
+    from utils.course_gallery import CAMPUS_INDEX_N_PROBE
+    from utils.face_quality import assess_faces
+
+    img, pasted = synthetic_classroom()
+    _, encoded = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, 90])
+    image_bytes = encoded.tobytes()
+
+    cases = {}
+
+    def case(name, fn, count=None, **kwargs):
+        cases[name] = measure(fn, repeats=repeats, **kwargs)
+        if count is not None:
+            cases[name]['items'] = count
+            cases[name]['median_ms_per_item'] = round(cases[name]['median_ms'] / max(count, 1), 3)
+
+    case('decode_image_for_detection', lambda: afr.decode_image_for_detection(image_bytes))
+
+    faces, keypoints = afr.detect_faces_with_keypoints(img, tiled=False)
+    case('detect_faces', lambda: afr.detect_faces_with_keypoints(img, tiled=False), count=len(faces))
+    if tiled:
+        tiled_faces, _ = afr.detect_faces_with_keypoints(img, tiled=True)
+        case('detect_faces_tiled', lambda: afr.detect_faces_with_keypoints(img, tiled=True),
+             count=len(tiled_faces))
+
+    # Later stages need faces; fall back to the pasted boxes if the detector found none
+    if not faces:
+        faces, keypoints = pasted, [None] * len(pasted)
+
+    case('assess_faces', lambda: assess_faces(img, faces, keypoints), count=len(faces))
+    case('align_face', lambda: afr.align_face(img, faces[0], keypoints[0]))
+    case('align_faces', lambda: afr.align_faces(img, faces, keypoints=keypoints), count=len(faces))
+
+    aligned = afr.align_faces(img, faces, keypoints=keypoints)
+    embed_error = _embedding_backend_error()
+    if embed_error is None:
+        case('extract_embeddings', lambda: afr.extract_embeddings(aligned[0]))
+        case('extract_embeddings_batch', lambda: afr.extract_embeddings_batch(aligned), count=len(aligned))
+        embeddings = [e for e in afr.extract_embeddings_batch(aligned) if e is not None]
+    else:
+        for name in ('extract_embeddings', 'extract_embeddings_batch'):
+            cases[name] = {'skipped': embed_error}
+        embeddings = []
+
+    # Random stand-ins for the faces of a frame where real embeddings are not needed
+    dim = afr.EMBEDDING_MODEL.dim
+    rng = np.random.default_rng(1)
+    queries = np.asarray(embeddings, dtype=np.float32) if embeddings else \
+        rng.standard_normal((len(faces), dim)).astype(np.float32)
+
+    for size in sizes:
+        gallery = synthetic_gallery(size, dim, planted=queries)
+        case(f'gallery_build[{size}]', lambda: synthetic_gallery(size, dim, planted=queries))
+        cases[f'gallery_build[{size}]']['gallery_mb'] = round(gallery.embeddings.nbytes / 2 ** 20, 3)
+
+        case(f'match_face_with_database[{size}]', lambda: afr.match_face_with_database(queries[0], gallery))
+        case(f'identify_embeddings[{size}]', lambda: afr.identify_embeddings(queries, gallery),
+             count=len(queries))
+
+        # The campus index as course_gallery builds it, with its recall against exact search
+        ids, centroids = gallery.centroids()
+        index = IVFIndex.build(list(ids), centroids, n_probe=CAMPUS_INDEX_N_PROBE)
+        name = f'campus_index_search[{size}]'
+        case(name, lambda: index.search(queries, k=1), count=len(queries))
+        returning = returning_faces(centroids)
+        for k in (1, 5):
+            cases[name][f'recall@{k}'] = round(index.recall(returning, centroids, ids, k=k)['recall'], 3)
+        cases[name]['n_probe'] = CAMPUS_INDEX_N_PROBE
+        cases[name]['n_lists'] = len(index.centroids)
+
+        name = f'process_attendance_image[{size}]'
+        if embed_error is None:
+            case(name, lambda: afr.process_attendance_image(image_bytes, gallery), count=len(faces))
+        else:
+            cases[name] = {'skipped': embed_error}
+
+    return {
+        'name': 'recognition',
+        'environment': environment(),
+        'config': {
+            'snapshot': list(img.shape[1::-1]),
+            'faces_detected': len(faces),
+            'embedding_model': afr.EMBEDDING_MODEL_TAG,
+            'inference_backend': os.environ.get('FACE_INFERENCE_BACKEND', 'tensorflow'),
+            'detection_max_side': afr.DETECTION_MAX_SIDE,
+            'detection_tiling': afr.FACE_DETECTION_TILING,
+            'inference_workers': int(os.environ.get('INFERENCE_WORKERS', 0)),
+            'templates_per_student': TEMPLATES_PER_STUDENT,
+            'repeats': repeats
+        },
+        'cases': cases,
+        'max_rss_mb': max_rss_mb()
+    }
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.recognition', description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', default=','.join(str(size) for size in GALLERY_SIZES),
+                        help='comma-separated gallery sizes (default: %(default)s)')
+    parser.add_argument('--repeats', type=int, default=20, help='timed calls per case (default: %(default)s)')
+    parser.add_argument('--no-tiled', action='store_true', help='skip the tiled detection case')
+    parser.add_argument('--output', help='result file (default: benchmarks/results/recognition-<time>.json)')
+    parser.add_argument('--compare', help='earlier result file to compare the medians with')
+    parser.add_argument('--threshold', type=float, default=0.15,
+                        help='relative median increase counted as a regression (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    sizes = [int(size) for size in args.sizes.split(',') if size]
+
+    results = run(sizes=sizes, repeats=args.repeats, tiled=not args.no_tiled)
+    print_results(results)
+    print(f"\nSaved to {save_results(results, args.output)}")
+
+    if args.compare:
+        rows = compare_results(load_results(args.compare), results, args.threshold)
+        print_comparison(rows, args.threshold)
+        return 1 if any(row[4] for row in rows) else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
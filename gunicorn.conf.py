@@ -0,0 +1,27 @@
+import os
+
+# Gunicorn settings; start with `gunicorn -c gunicorn.conf.py app:app`
+
+# Import the app (and, with PRELOAD_MODELS, build the recognition models) once in
+# the master so workers share the weights copy-on-write after fork
+preload_app = os.environ.get('PRELOAD_MODELS', 'False').lower() == 'true'
+
+# Model construction and warm-up can take well over the default 30 seconds
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+
+def post_fork(server, worker):
+    # Warm the models in the background; /healthz/ready answers 503 until they are warm
+    from utils.model_warmup import WARM_UP_MODELS, start_warm_up
+    if WARM_UP_MODELS:
+        start_warm_up()
+
+    from app import app
+
+    # Run the attendance jobs left queued by a worker that stopped or died
+    from utils.attendance_jobs import resume_attendance_jobs
+    resume_attendance_jobs(app)
+
+    # One worker brings stored embeddings up to the canonical model in the background
+    from utils.reembedding import REEMBED_ON_START, resume_or_start_reembedding
+    if REEMBED_ON_START and worker.age == 1:
+        resume_or_start_reembedding(app)
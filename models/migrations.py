@@ -0,0 +1,193 @@
+import os
+import json
+import fcntl
+import logging
+import tempfile
+import numpy as np
+from contextlib import contextmanager
+from sqlalchemy import func, inspect, text
+from sqlalchemy.exc import OperationalError, ProgrammingError
+from sqlalchemy.schema import CreateIndex
+
+# Configure logger
+logger = logging.getLogger(__name__)
+
+# Tag for embeddings migrated from the JSON column; they were produced by the
+# VGG-based registration/update paths, not by the recognition model
+LEGACY_EMBEDDING_TAG = 'VGG-Face@legacy'
+
+# File locked while a worker migrates, so that workers starting together on one host
+# migrate one after another (PostgreSQL uses an advisory lock instead)
+MIGRATION_LOCK_FILE = os.environ.get(
+    'MIGRATION_LOCK_FILE', os.path.join(tempfile.gettempdir(), 'attendance-migrations.lock')
+)
+
+# Key of the PostgreSQL advisory lock taken while migrating
+MIGRATION_LOCK_ID = 720417
+
+# Columns added after the first release: table -> [(column, DDL type)]
+ADDED_COLUMNS = {
+    'student': [
+        ('face_embedding', 'BLOB'),
+        ('face_embedding_model', 'VARCHAR(50)'),
+        ('face_embedding_dim', 'INTEGER'),
+    ],
+    'attendance_job': [
+        ('image', 'BLOB'),
+        ('annotate', 'BOOLEAN'),
+        ('include_timings', 'BOOLEAN'),
+        ('runner', 'VARCHAR(100)'),
+    ],
+}
+
+@contextmanager
+def migration_lock(db):
+    """
+    Hold an exclusive lock while the schema is created and migrated
+
+    Every worker migrates on start; with the lock the first one does the work and
+    the others wait and then find nothing left to do.
+    """
+    if db.engine.dialect.name == 'postgresql':
+        with db.engine.connect() as connection:
+            connection.execute(text('SELECT pg_advisory_lock(:key)'), {'key': MIGRATION_LOCK_ID})
+            try:
+                yield
+            finally:
+                connection.execute(text('SELECT pg_advisory_unlock(:key)'), {'key': MIGRATION_LOCK_ID})
+    else:
+        with open(MIGRATION_LOCK_FILE, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def _add_missing_columns(db):
+    inspector = inspect(db.engine)
+    blob_type = 'BYTEA' if db.engine.dialect.name == 'postgresql' else 'BLOB'
+
+    for table, columns in ADDED_COLUMNS.items():
+        if not inspector.has_table(table):
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table)}
+        for name, ddl_type in columns:
+            if name not in existing:
+                ddl_type = blob_type if ddl_type == 'BLOB' else ddl_type
+                try:
+                    with db.engine.begin() as connection:
+                        connection.execute(text(f'ALTER TABLE {table} ADD COLUMN {name} {ddl_type}'))
+                except (OperationalError, ProgrammingError):
+                    # Added by a process that did not take the lock
+                    if name not in {column['name'] for column in inspect(db.engine).get_columns(table)}:
+                        raise
+                    continue
+                logger.info(f"Added column {table}.{name}")
+
+def _migrate_json_embeddings(db, batch_size=500):
+    """Convert JSON face_encoding values into binary face_embedding rows"""
+    from models.models import Student
+
+    migrated = 0
+    # Students whose JSON could not be converted keep it, and are skipped by the next batches
+    failed = []
+    while True:
+        students = Student.query.filter(
+            Student.face_encoding != None,
+            Student.face_embedding == None,
+            Student.id.notin_(failed)
+        ).limit(batch_size).all()
+        if not students:
+            break
+
+        for student in students:
+            try:
+                encoding = np.asarray(json.loads(student.face_encoding), dtype=np.float32)
+                if encoding.ndim == 0 or not encoding.size:
+                    raise ValueError(f"expected a vector, got {student.face_encoding[:40]!r}")
+                student.set_face_encoding(encoding, LEGACY_EMBEDDING_TAG)
+            except (ValueError, TypeError) as e:
+                logger.error(f"Could not migrate face encoding of student {student.id}: {str(e)}")
+                failed.append(student.id)
+                continue
+            # The JSON copy is no longer read; free its space
+            student.face_encoding = None
+            migrated += 1
+        db.session.commit()
+
+    if migrated:
+        logger.info(f"Migrated {migrated} JSON face encodings to binary embeddings")
+    if failed:
+        logger.warning(f"Kept the JSON face encodings of {len(failed)} students that could not be migrated")
+
+def _deduplicate_attendance(db):
+    """
+    Merge attendance records of the same student and class session into the oldest one
+
+    The merged record is present if any of them was, and keeps the earliest time in,
+    the latest time out and all phone usage and engagement logs.
+    """
+    from models.models import Attendance, EngagementLog, PhoneUsageLog
+
+    duplicates = db.session.query(
+        Attendance.student_id, Attendance.timetable_id, Attendance.date
+    ).group_by(
+        Attendance.student_id, Attendance.timetable_id, Attendance.date
+    ).having(func.count(Attendance.id) > 1).all()
+
+    removed = 0
+    for student_id, timetable_id, day in duplicates:
+        records = Attendance.query.filter_by(
+            student_id=student_id,
+            timetable_id=timetable_id,
+            date=day
+        ).order_by(Attendance.id).all()
+        kept, extra_ids = records[0], [record.id for record in records[1:]]
+
+        times_in = [record.time_in for record in records if record.time_in]
+        times_out = [record.time_out for record in records if record.time_out]
+        kept.is_present = any(record.is_present for record in records)
+        kept.time_in = min(times_in) if times_in else None
+        kept.time_out = max(times_out) if times_out else None
+        kept.phone_usage_count = sum(record.phone_usage_count or 0 for record in records)
+
+        for log in (PhoneUsageLog, EngagementLog):
+            log.query.filter(log.attendance_id.in_(extra_ids)).update(
+                {'attendance_id': kept.id}, synchronize_session=False
+            )
+        Attendance.query.filter(Attendance.id.in_(extra_ids)).delete(synchronize_session=False)
+        removed += len(extra_ids)
+
+    db.session.commit()
+    if removed:
+        logger.info(f"Merged {removed} duplicate attendance records")
+
+def _add_attendance_indexes(db):
+    """Create the indexes of the attendance table that an older database lacks"""
+    from models.models import Attendance
+
+    inspector = inspect(db.engine)
+    if not inspector.has_table(Attendance.__tablename__):
+        return
+    existing = {index['name'] for index in inspector.get_indexes(Attendance.__tablename__)}
+    missing = [index for index in Attendance.__table__.indexes if index.name not in existing]
+
+    # Rows that would violate the unique index have to go before it can be built
+    if any(index.unique for index in missing):
+        _deduplicate_attendance(db)
+
+    for index in missing:
+        # IF NOT EXISTS: a process that did not take the lock may have created it
+        with db.engine.begin() as connection:
+            connection.execute(CreateIndex(index, if_not_exists=True))
+        logger.info(f"Created index {index.name}")
+
+def run_migrations(db):
+    """
+    Bring an existing database up to the current models; safe to run on every start
+    (new tables are created by db.create_all beforehand). Call it under
+    migration_lock when several processes may start at once.
+    """
+    _add_missing_columns(db)
+    _migrate_json_embeddings(db)
+    _add_attendance_indexes(db)
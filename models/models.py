@@ -1,6 +1,8 @@
 from flask_login import UserMixin
 from datetime import datetime
 import json
+import numpy as np
+from sqlalchemy.exc import IntegrityError
 from app import db
 
 # Association table for many-to-many relationships
@@ -33,24 +35,57 @@ class Student(User):
     roll_number = db.Column(db.String(20), unique=True, nullable=False)
     department = db.Column(db.String(50), nullable=False)
     year = db.Column(db.Integer, nullable=False)
-    face_encoding = db.Column(db.Text, nullable=True)  # Stored as JSON string
+    face_encoding = db.Column(db.Text, nullable=True)  # Legacy JSON string, moved to face_embedding by models.migrations
+    face_embedding = db.Column(db.LargeBinary, nullable=True)  # Raw float32 or float16 vector
+    face_embedding_model = db.Column(db.String(50), nullable=True)  # Model name/version tag, e.g. "Facenet@2"
+    face_embedding_dim = db.Column(db.Integer, nullable=True)
     is_approved = db.Column(db.Boolean, default=False)
     
     # Relationships
     courses = db.relationship('Course', secondary=student_course, backref=db.backref('students', lazy='dynamic'))
     attendances = db.relationship('Attendance', backref='student', lazy=True)
+    face_templates = db.relationship('FaceTemplate', backref='student', lazy='dynamic', cascade='all, delete-orphan')
     
     def get_id(self):
         return f"student_{self.id}"
     
-    def set_face_encoding(self, encoding):
+    def set_face_encoding(self, encoding, model_tag):
+        """Store an embedding as a binary vector tagged with the model that produced it"""
+        from utils.embedding_store import encode_embedding
         if encoding is not None:
-            self.face_encoding = json.dumps(encoding.tolist())
+            encoding = np.asarray(encoding).ravel()
+            self.face_embedding = encode_embedding(encoding)
+            self.face_embedding_model = model_tag
+            self.face_embedding_dim = len(encoding)
     
     def get_face_encoding(self):
-        if self.face_encoding:
-            return json.loads(self.face_encoding)
+        """Return the stored embedding as a float32 array"""
+        from utils.embedding_store import decode_embedding
+        if self.face_embedding:
+            return decode_embedding(self.face_embedding, self.face_embedding_dim)
         return None
+    
+    @property
+    def has_face_encoding(self):
+        return self.face_embedding is not None
+
+class FaceTemplate(db.Model):
+    """
+    An additional reference embedding of a student, used next to Student.face_embedding
+    (e.g. the embedding of a replaced photo, or of a confident recognition)
+    """
+    __tablename__ = 'face_template'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    embedding = db.Column(db.LargeBinary, nullable=False)  # Raw float32 or float16 vector
+    model_tag = db.Column(db.String(50), nullable=False)
+    dim = db.Column(db.Integer, nullable=False)
+    source = db.Column(db.String(20), nullable=False)  # update, recognition
+    confidence = db.Column(db.Float, nullable=True)  # Match score of recognition templates
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # Foreign Keys
+    student_id = db.Column(db.Integer, db.ForeignKey('student.id'), nullable=False, index=True)
 
 class Faculty(User):
     __tablename__ = 'faculty'
@@ -123,6 +158,41 @@ class Attendance(db.Model):
     course_id = db.Column(db.Integer, db.ForeignKey('course.id'), nullable=False)
     timetable_id = db.Column(db.Integer, db.ForeignKey('time_table.id'), nullable=False)  # Fixed reference to time_table
 
+    # One record per student and class session, plus indexes for the lookups of a
+    # session (timetable and date), of a student in a course and of a whole course.
+    # Uniqueness is a unique index rather than a constraint so that the migration
+    # can add it to existing SQLite tables.
+    __table_args__ = (
+        db.Index('uq_attendance_student_session', 'student_id', 'timetable_id', 'date', unique=True),
+        db.Index('ix_attendance_session', 'timetable_id', 'date'),
+        db.Index('ix_attendance_student_course', 'student_id', 'course_id', 'date'),
+        db.Index('ix_attendance_course_date', 'course_id', 'date'),
+    )
+
+    @classmethod
+    def get_or_create(cls, student_id, course_id, timetable_id, day, **defaults):
+        """
+        The student's record of a class session, inserted with defaults if missing
+
+        The insert runs in a savepoint, so when a concurrent request inserts the same
+        record first, this one re-reads it instead of failing on the unique index.
+
+        Returns:
+            (attendance, created)
+        """
+        key = {'student_id': student_id, 'timetable_id': timetable_id, 'date': day}
+        attendance = cls.query.filter_by(**key).first()
+        if attendance:
+            return attendance, False
+
+        attendance = cls(course_id=course_id, **key, **defaults)
+        try:
+            with db.session.begin_nested():
+                db.session.add(attendance)
+        except IntegrityError:
+            return cls.query.filter_by(**key).one(), False
+        return attendance, True
+
 class PhoneUsageLog(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
@@ -164,4 +234,76 @@ class AdminLog(db.Model):
     ip_address = db.Column(db.String(50), nullable=True)
     
     # Relationship
-    admin = db.relationship('Admin', backref='logs')
\ No newline at end of file
+    admin = db.relationship('Admin', backref='logs')
+
+class AttendanceJob(db.Model):
+    """An automatic-attendance recognition run, processed in the background"""
+    __tablename__ = 'attendance_job'
+    
+    id = db.Column(db.String(36), primary_key=True)  # uuid4 hex
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, done, failed
+    result = db.Column(db.Text, nullable=True)  # Response payload, stored as JSON string
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    
+    # The snapshot and its options, kept until the job finishes so that it survives a restart
+    image = db.Column(db.LargeBinary, nullable=True)
+    annotate = db.Column(db.Boolean, default=False)
+    include_timings = db.Column(db.Boolean, default=False)
+    runner = db.Column(db.String(100), nullable=True)  # host:pid of the process running the job
+    
+    # Foreign Keys
+    timetable_id = db.Column(db.Integer, db.ForeignKey('time_table.id'), nullable=False)
+    faculty_id = db.Column(db.Integer, db.ForeignKey('faculty.id'), nullable=False)
+    
+    def set_result(self, result):
+        self.result = json.dumps(result)
+    
+    def get_result(self):
+        if self.result:
+            return json.loads(self.result)
+        return None
+
+class AttendanceStream(db.Model):
+    """Tracking state of a live attendance stream, shared by the worker processes"""
+    __tablename__ = 'attendance_stream'
+    
+    id = db.Column(db.String(32), primary_key=True)  # uuid4 hex, the client's stream_id
+    state = db.Column(db.Text, nullable=False)  # Tracks, votes and marked students, stored as JSON string
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_seen = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # Foreign Keys
+    timetable_id = db.Column(db.Integer, db.ForeignKey('time_table.id'), nullable=False)
+    faculty_id = db.Column(db.Integer, db.ForeignKey('faculty.id'), nullable=False)
+
+class EmbeddingJob(db.Model):
+    """A background run that re-embeds stored student faces with the canonical model"""
+    __tablename__ = 'embedding_job'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    model_tag = db.Column(db.String(50), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='running')  # running, done, failed
+    total = db.Column(db.Integer, default=0)
+    processed = db.Column(db.Integer, default=0)
+    failed = db.Column(db.Integer, default=0)
+    error = db.Column(db.Text, nullable=True)
+    started_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)  # Heartbeat of the running job
+    finished_at = db.Column(db.DateTime, nullable=True)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'model_tag': self.model_tag,
+            'status': self.status,
+            'total': self.total,
+            'processed': self.processed,
+            'failed': self.failed,
+            'error': self.error,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
@@ -1,4 +1,4 @@
-from flask import Blueprint, render_template, url_for, flash, redirect, request, jsonify
+from flask import Blueprint, render_template, url_for, flash, redirect, request, jsonify, current_app, Response, stream_with_context
 from flask_login import login_required, current_user
 from app import db, bcrypt
 from models.models import (
@@ -6,10 +6,14 @@ from models.models import (
     Attendance, student_course, faculty_course, AdminLog
 )
 from utils.forms import CourseForm, TimeTableForm, ChangePasswordForm, AdminAddStudentForm, AdminAddFacultyForm, ResetPasswordForm
+from utils.course_gallery import invalidate_course_galleries
+from utils.reembedding import get_reembed_status, start_reembedding
+from utils.attendance_reports import course_attendance_summary
+from utils.attendance_exports import EXPORT_FORMATS, iter_attendance_export
+from werkzeug.utils import secure_filename
 import random
 import string
 from datetime import datetime
-import pandas as pd
 import logging
 import json
 from sqlalchemy import and_, exc
@@ -64,7 +68,7 @@ def dashboard():
     pending_approvals = Student.query.filter_by(is_approved=False).count() + Faculty.query.filter_by(is_approved=False).count()
     
     # Get students with updated face biometrics needing approval
-    biometric_updates = Student.query.filter_by(is_approved=False).filter(Student.face_encoding != None).all()
+    biometric_updates = Student.query.filter_by(is_approved=False).filter(Student.face_embedding != None).all()
     
     # Recent registrations
     recent_students = Student.query.order_by(Student.created_at.desc()).limit(5).all()
@@ -185,6 +189,7 @@ def courses():
                 
                 try:
                     db.session.commit()
+                    invalidate_course_galleries([course.id])
                     flash(f'Course {form.name.data} ({form.course_code.data}) has been updated!', 'success')
                     
                     # If department or year changed, reassign students
@@ -204,6 +209,7 @@ def courses():
                             student.courses.append(course)
                             
                         db.session.commit()
+                        invalidate_course_galleries([course.id])
                         flash(f'Students have been reassigned to the updated course.', 'info')
                 except Exception as e:
                     db.session.rollback()
@@ -252,6 +258,7 @@ def courses():
                 
                 try:
                     db.session.commit()
+                    invalidate_course_galleries([course.id])
                     flash(f'Course {form.name.data} ({form.course_code.data}) has been added to the {form.department.data} department for year {form.year.data}!', 'success')
                 except Exception as e:
                     db.session.rollback()
@@ -396,6 +403,8 @@ def approve_user(user_type, user_id):
         
         try:
             db.session.commit()
+            # Approval changes enrollment and activates the student's face data
+            invalidate_course_galleries()
             # Log this admin action
             create_admin_log(
                 current_user,
@@ -444,6 +453,7 @@ def delete_user(user_type, user_id):
             # Delete the student
             db.session.delete(user)
             db.session.commit()
+            invalidate_course_galleries()
             
             flash(f'Student {user.name} has been deleted!', 'success')
             return redirect(url_for('admin.students'))
@@ -514,6 +524,7 @@ def delete_course(course_id):
         # Now delete the course
         db.session.delete(course)
         db.session.commit()
+        invalidate_course_galleries([course_id])
         
         flash(f'Course {course.name} has been deleted!', 'success')
     except Exception as e:
@@ -560,7 +571,6 @@ def attendance_report():
         course_id = courses[0].id
     
     attendance_data = []
-    students = []
     course_name = ""
     
     if course_id:
@@ -568,24 +578,8 @@ def attendance_report():
         if course:
             course_name = f"{course.course_code} - {course.name} ({course.department})"
             
-            # Get all students enrolled in this course
-            students = Student.query.join(student_course).filter(student_course.c.course_id == course_id).all()
-            
-            # Get attendance data for each student
-            for student in students:
-                attendances = Attendance.query.filter_by(student_id=student.id, course_id=course_id).all()
-                present_count = sum(1 for a in attendances if a.is_present)
-                total_count = len(attendances)
-                attendance_percentage = (present_count / total_count * 100) if total_count > 0 else 0
-                
-                attendance_data.append({
-                    'student_id': student.id,
-                    'student_name': student.name,
-                    'roll_number': student.roll_number,
-                    'present_count': present_count,
-                    'total_classes': total_count,
-                    'attendance_percentage': attendance_percentage
-                })
+            # Present/total counts of every enrolled student
+            attendance_data = course_attendance_summary(course_id)
     
     return render_template('admin/attendance_report.html',
                           title='Attendance Report',
@@ -594,41 +588,56 @@ def attendance_report():
                           course_name=course_name,
                           attendance_data=attendance_data)
 
+@admin.route('/export/attendance')
 @admin.route('/export/attendance/<int:course_id>')
 @login_required
 @admin_required
-def export_attendance(course_id):
-    course = Course.query.get_or_404(course_id)
-    
-    # Get all students enrolled in this course
-    students = Student.query.join(student_course).filter(student_course.c.course_id == course_id).all()
-    
-    # Prepare data for export
-    data = []
-    for student in students:
-        attendances = Attendance.query.filter_by(student_id=student.id, course_id=course_id).all()
-        present_count = sum(1 for a in attendances if a.is_present)
-        total_count = len(attendances)
-        attendance_percentage = (present_count / total_count * 100) if total_count > 0 else 0
-        
-        data.append({
-            'Student ID': student.id,
-            'Name': student.name,
-            'Roll Number': student.roll_number,
-            'Present': present_count,
-            'Total Classes': total_count,
-            'Attendance Percentage': f"{attendance_percentage:.2f}%"
-        })
-    
-    # Create DataFrame and export to CSV
-    df = pd.DataFrame(data)
-    csv_data = df.to_csv(index=False)
-    
-    return jsonify({
-        'success': True,
-        'data': csv_data,
-        'filename': f"attendance_report_{course.course_code}.csv"
-    })
+def export_attendance(course_id=None):
+    """
+    Download attendance as CSV or XLSX (?format=), for one course, one department
+    (?department=) or the whole campus
+
+    The file is streamed while rows are read from the database in batches, so the
+    size of the export does not bound the memory of the worker.
+    """
+    export_format = request.args.get('format', 'csv').lower()
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'success': False, 'message': f'Unsupported export format: {export_format}'}), 400
+
+    department = request.args.get('department') or None
+    if course_id is not None:
+        course = Course.query.get_or_404(course_id)
+        scope = course.course_code
+    else:
+        scope = department or 'all_courses'
+
+    filename = secure_filename(f"attendance_report_{scope}.{export_format}")
+    return Response(
+        stream_with_context(iter_attendance_export(export_format, course_id=course_id, department=department)),
+        mimetype=EXPORT_FORMATS[export_format],
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
+
+@admin.route('/embeddings/reembed', methods=['GET', 'POST'])
+@login_required
+@admin_required
+def reembed_faces():
+    """Report re-embedding progress (GET) or start re-embedding with the canonical model (POST)"""
+    try:
+        if request.method == 'POST':
+            job, started = start_reembedding(current_app._get_current_object())
+            if started:
+                create_admin_log(current_user, 'Started face re-embedding', f"{job.total} students, model {job.model_tag}")
+            return jsonify({
+                'success': True,
+                'message': 'Re-embedding started' if started else 'Re-embedding is already running',
+                'job': job.to_dict()
+            }), 202 if started else 200
+
+        return jsonify(dict(get_reembed_status(), success=True))
+    except Exception as e:
+        logger.error(f"Error in face re-embedding: {str(e)}")
+        return jsonify({'success': False, 'message': f'Error: {str(e)}'}), 500
 
 @admin.route('/profile')
 @login_required
@@ -733,6 +742,7 @@ def add_student():
             
             try:
                 db.session.commit()
+                invalidate_course_galleries([course.id for course in courses])
                 flash(f'Account created for {form.name.data}! Temporary password: {temp_password}', 'success')
             except Exception as e:
                 db.session.rollback()
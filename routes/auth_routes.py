@@ -3,7 +3,8 @@ from flask_login import login_user, current_user, logout_user, login_required
 from app import db, bcrypt, mail
 from models.models import Student, Faculty, Admin, Course
 from utils.forms import LoginForm, StudentRegistrationForm, AdminLoginForm, FacultyRegistrationForm, ForgotPasswordForm
-from utils.face_utils import base64_to_image, generate_face_embedding, extract_faces_from_image
+from utils.face_utils import base64_to_image, extract_faces_from_image
+from utils.advanced_face_recognition import EMBEDDING_MODEL_TAG, embed_face_image
 from flask_mail import Message
 import os
 import sys
@@ -115,10 +116,10 @@ def register():
                     image = base64_to_image(form.face_data.data, face_data_path)
                     
                     if image and DEEPFACE_AVAILABLE:
-                        # Generate face embedding using DeepFace
-                        embedding = generate_face_embedding(face_data_path)
+                        # Generate the face embedding with the canonical recognition model
+                        embedding = embed_face_image(face_data_path, enforce_detection=True)
                         if embedding is not None:
-                            student.set_face_encoding(np.array(embedding))
+                            student.set_face_encoding(np.array(embedding), EMBEDDING_MODEL_TAG)
                             logger.info(f"Face encoding generated for student {form.roll_number.data}")
                         else:
                             flash('No face detected in the image. Please try again.', 'danger')
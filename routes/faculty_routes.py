@@ -1,9 +1,12 @@
-from flask import Blueprint, render_template, url_for, flash, redirect, request, jsonify
+from flask import Blueprint, render_template, url_for, flash, redirect, request, jsonify, current_app, Response
 from flask_login import login_required, current_user
 from app import db, bcrypt
-from models.models import Student, Faculty, Course, TimeTable, Attendance, student_course
+from models.models import Student, Faculty, Course, TimeTable, Attendance, AttendanceJob, student_course
 from utils.forms import ManualAttendanceForm
-from utils.advanced_face_recognition import process_attendance_image, load_student_embeddings
+from utils.attendance_jobs import run_auto_attendance, run_stream_frame, submit_attendance_job, get_job_status
+from utils.face_tracking import StreamSessionError, get_stream_session, end_stream_session
+from utils.annotated_images import load_annotated_image
+from utils.attendance_reports import course_attendance_summary
 from datetime import datetime, date, time
 import os
 import sys
@@ -43,6 +46,58 @@ def faculty_required(f):
     decorated_function.__name__ = f.__name__
     return decorated_function
 
+# Largest attendance snapshot accepted, checked before the body is read
+MAX_SNAPSHOT_BYTES = int(os.environ.get('MAX_SNAPSHOT_MB', 10)) * 1024 * 1024
+
+def _is_true(value):
+    return value in (True, 1, '1', 'true', 'True', 'on')
+
+def _read_snapshot():
+    """
+    Read an attendance snapshot from a multipart upload (field "image"), a raw
+    image/* body or the legacy JSON body with a base64 "image_data"
+    Returns (image bytes or None, request options, (error message, status) or None)
+    """
+    if request.content_length is not None and request.content_length > MAX_SNAPSHOT_BYTES:
+        return None, {}, ('Image is too large', 413)
+    
+    options = request.args.to_dict()
+    
+    if request.mimetype == 'multipart/form-data':
+        if request.content_length is None:
+            return None, options, ('Content-Length is required', 411)
+        options.update(request.form.to_dict())
+        upload = request.files.get('image')
+        return (upload.read() if upload else None), options, None
+    
+    # Read at most one byte past the limit so chunked bodies are bounded too
+    body = request.stream.read(MAX_SNAPSHOT_BYTES + 1)
+    if len(body) > MAX_SNAPSHOT_BYTES:
+        return None, options, ('Image is too large', 413)
+    
+    if request.mimetype.startswith('image/') or request.mimetype == 'application/octet-stream':
+        return body, options, None
+    
+    try:
+        data = json.loads(body) if body else {}
+    except ValueError:
+        data = {}
+    if not isinstance(data, dict):
+        data = {}
+    options.update({key: value for key, value in data.items() if key != 'image_data'})
+    image_data = data.get('image_data')
+    if not image_data:
+        return None, options, None
+    if ',' in image_data:
+        image_data = image_data.split(',')[1]
+    return base64.b64decode(image_data), options, None
+
+def _with_annotated_image_url(payload):
+    """Replace the stored annotated image token of a result with its URL"""
+    token = payload.pop('annotated_image_token', None)
+    payload['annotated_image_url'] = url_for('faculty.annotated_image', token=token) if token else None
+    return payload
+
 @faculty.route('/dashboard')
 @login_required
 @faculty_required
@@ -156,24 +211,12 @@ def start_session(timetable_id):
     # Check if attendance has already been marked for today
     today = date.today()
     for student in students:
-        existing_attendance = Attendance.query.filter_by(
-            student_id=student.id,
-            course_id=course.id,
-            timetable_id=timetable.id,
-            date=today
-        ).first()
-        
-        if not existing_attendance:
-            # Create new attendance record (marked as absent by default)
-            attendance = Attendance(
-                student_id=student.id,
-                course_id=course.id,
-                timetable_id=timetable.id,
-                date=today,
-                is_present=False,
-                marked_by=current_user.email
-            )
-            db.session.add(attendance)
+        # Create the attendance record if missing (marked as absent by default)
+        Attendance.get_or_create(
+            student.id, course.id, timetable.id, today,
+            is_present=False,
+            marked_by=current_user.email
+        )
     
     db.session.commit()
     
@@ -277,19 +320,12 @@ def manual_attendance(timetable_id):
         attendance = attendance_records[student_id]['record']
         if not attendance:
             # Create new attendance record if it doesn't exist
-            attendance = Attendance(
-                student_id=student_id,
-                course_id=course.id,
-                timetable_id=timetable.id,
-                date=today,
-                is_present=is_present,
+            attendance, _ = Attendance.get_or_create(
+                student_id, course.id, timetable.id, today,
                 marked_by=current_user.email
             )
-            db.session.add(attendance)
-        else:
-            # Update existing record
-            attendance.is_present = is_present
-            attendance.marked_by = current_user.email
+        attendance.is_present = is_present
+        attendance.marked_by = current_user.email
             
         if is_present and not attendance.time_in:
             attendance.time_in = datetime.now()
@@ -323,101 +359,34 @@ def auto_attendance(timetable_id):
     
     if request.method == 'POST':
         try:
-            # Get the image data from the request
-            image_data = request.json.get('image_data')
+            # Get the image from the request
+            image_bytes, options, error = _read_snapshot()
+            if error:
+                return jsonify({'success': False, 'message': error[0]}), error[1]
             
-            if not image_data:
+            if not image_bytes:
                 return jsonify({'success': False, 'message': 'No image data received'})
             
-            # Load student embeddings database - using students from the correct department and year
-            students = Student.query.filter_by(
-                department=course.department,
-                year=timetable.year
-            ).join(
-                student_course, Student.id == student_course.c.student_id
-            ).filter(
-                student_course.c.course_id == course.id
-            ).all()
-            
-            # Create a temporary database mapping with student IDs
-            student_db = {}
-            face_data_dir = 'face_data'  # Directory where face images are stored
+            annotate = _is_true(options.get('annotate'))
+            include_timings = _is_true(options.get('timings'))
             
-            # First load all student embeddings from the face_data directory
-            raw_embeddings = load_student_embeddings(face_data_dir)
-            
-            # Filter to only include students in this course/department/year
-            for student in students:
-                roll_number = student.roll_number
-                if roll_number in raw_embeddings:
-                    student_db[roll_number] = raw_embeddings[roll_number]
-            
-            # Get today's date
-            today = date.today()
-            
-            # Process the image and recognize students
-            recognized_students, annotated_image = process_attendance_image(image_data, student_db)
-            
-            if not recognized_students:
+            # Job mode: return at once and let the client poll for the result
+            if _is_true(options.get('async')):
+                job = submit_attendance_job(
+                    current_app._get_current_object(), timetable, faculty_id, image_bytes, annotate=annotate,
+                    include_timings=include_timings
+                )
                 return jsonify({
                     'success': True,
-                    'message': 'No students recognized in the image.',
-                    'recognized_students': [],
-                    'annotated_image': annotated_image
-                })
+                    'job_id': job.id,
+                    'status': job.status,
+                    'status_url': url_for('faculty.attendance_job', job_id=job.id)
+                }), 202
             
-            # Mark attendance for recognized students
-            marked_students = []
-            for recognition in recognized_students:
-                roll_number = recognition['student_id']
-                confidence = recognition['confidence']
-                
-                # Find the student in the database
-                student = Student.query.filter_by(roll_number=roll_number).first()
-                
-                if student:
-                    # Check if attendance record exists
-                    attendance = Attendance.query.filter_by(
-                        student_id=student.id,
-                        course_id=course.id,
-                        timetable_id=timetable.id,
-                        date=today
-                    ).first()
-                    
-                    if attendance:
-                        attendance.is_present = True
-                        attendance.marked_by = 'auto'
-                        if not attendance.time_in:
-                            attendance.time_in = datetime.now()
-                    else:
-                        # Create new attendance record
-                        attendance = Attendance(
-                            student_id=student.id,
-                            course_id=course.id,
-                            timetable_id=timetable.id,
-                            date=today,
-                            is_present=True,
-                            marked_by='auto',
-                            time_in=datetime.now()
-                        )
-                        db.session.add(attendance)
-                    
-                    marked_students.append({
-                        'id': student.id,
-                        'name': student.name,
-                        'roll_number': student.roll_number,
-                        'confidence': f"{confidence:.2f}"
-                    })
-            
-            # Commit the database changes
-            db.session.commit()
-            
-            return jsonify({
-                'success': True,
-                'message': f'Successfully recognized {len(marked_students)} students',
-                'recognized_students': marked_students,
-                'annotated_image': annotated_image
-            })
+            return jsonify(_with_annotated_image_url(
+                run_auto_attendance(timetable, course, image_bytes, annotate=annotate,
+                                    include_timings=include_timings)
+            ))
                 
         except Exception as e:
             logger.error(f"Error in auto_attendance endpoint: {str(e)}")
@@ -430,6 +399,74 @@ def auto_attendance(timetable_id):
                           course=course,
                           current_datetime=datetime.now())
 
+@faculty.route('/auto_attendance/<int:timetable_id>/stream', methods=['POST'])
+@login_required
+@faculty_required
+def auto_attendance_stream(timetable_id):
+    timetable = TimeTable.query.get_or_404(timetable_id)
+    
+    # Verify this timetable belongs to the current faculty
+    faculty_id = int(current_user.get_id().split('_')[1])
+    if timetable.faculty_id != faculty_id:
+        return jsonify({'success': False, 'message': 'You do not have permission to manage this session.'}), 403
+    
+    course = Course.query.get(timetable.course_id)
+    
+    try:
+        image_bytes, options, error = _read_snapshot()
+        if error:
+            return jsonify({'success': False, 'message': error[0]}), error[1]
+        
+        stream_id = options.get('stream_id')
+        
+        # The browser ends the stream when live mode is stopped
+        if _is_true(options.get('end')):
+            end_stream_session(stream_id, faculty_id)
+            return jsonify({'success': True, 'stream_id': stream_id})
+        
+        if not image_bytes:
+            return jsonify({'success': False, 'message': 'No image data received'})
+        
+        session = get_stream_session(stream_id, timetable.id, faculty_id)
+        return jsonify(run_stream_frame(timetable, course, session, image_bytes))
+    
+    except StreamSessionError as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e), 'restart': True}), e.status
+    
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error in auto_attendance_stream endpoint: {str(e)}")
+        return jsonify({'success': False, 'message': f'Error: {str(e)}'})
+
+@faculty.route('/attendance_jobs/<job_id>')
+@login_required
+@faculty_required
+def attendance_job(job_id):
+    job = AttendanceJob.query.get(job_id)
+    
+    # Only the faculty who submitted a job can see its result
+    faculty_id = int(current_user.get_id().split('_')[1])
+    if job is None or job.faculty_id != faculty_id:
+        return jsonify({'success': False, 'message': 'Job not found'}), 404
+    
+    status = get_job_status(job)
+    if status.get('result'):
+        _with_annotated_image_url(status['result'])
+    return jsonify(dict(success=True, **status))
+
+@faculty.route('/annotated_images/<token>')
+@login_required
+@faculty_required
+def annotated_image(token):
+    image_bytes = load_annotated_image(token)
+    if image_bytes is None:
+        return jsonify({'success': False, 'message': 'Image not found'}), 404
+    
+    response = Response(image_bytes, mimetype='image/jpeg')
+    response.headers['Cache-Control'] = 'private, max-age=3600'
+    return response
+
 @faculty.route('/attendance/report')
 @login_required
 @faculty_required
@@ -462,35 +499,8 @@ def attendance_report():
         if course:
             course_name = f"{course.course_code} - {course.name} ({course.department})"
             
-            # Get all students enrolled in this course, filtered by department
-            students = Student.query.filter_by(department=course.department).join(
-                student_course, Student.id == student_course.c.student_id
-            ).filter(
-                student_course.c.course_id == course_id
-            ).all()
-            
-            # Get attendance data for each student
-            for student in students:
-                attendances = Attendance.query.filter_by(
-                    student_id=student.id, 
-                    course_id=course_id
-                ).all()
-                
-                present_count = sum(1 for a in attendances if a.is_present)
-                total_count = len(attendances)
-                attendance_percentage = (present_count / total_count * 100) if total_count > 0 else 0
-                
-                low_attendance = attendance_percentage < 75
-                
-                attendance_data.append({
-                    'student_id': student.id,
-                    'student_name': student.name,
-                    'roll_number': student.roll_number,
-                    'present_count': present_count,
-                    'total_classes': total_count,
-                    'attendance_percentage': attendance_percentage,
-                    'low_attendance': low_attendance
-                })
+            # Present/total counts of every enrolled student of the course's department
+            attendance_data = course_attendance_summary(course_id, department=course.department)
     
     return render_template('faculty/attendance_report.html',
                           title='Attendance Report',
@@ -651,24 +661,13 @@ def get_attendance_students(timetable_id):
         attendance_records = {}
         
         for student in students:
-            attendance = Attendance.query.filter_by(
-                student_id=student.id,
-                course_id=course.id,
-                timetable_id=timetable.id,
-                date=today
-            ).first()
-            
             # Create a record if it doesn't exist
-            if not attendance:
-                attendance = Attendance(
-                    student_id=student.id,
-                    course_id=course.id,
-                    timetable_id=timetable.id,
-                    date=today,
-                    is_present=False,
-                    marked_by=current_user.email
-                )
-                db.session.add(attendance)
+            attendance, created = Attendance.get_or_create(
+                student.id, course.id, timetable.id, today,
+                is_present=False,
+                marked_by=current_user.email
+            )
+            if created:
                 db.session.commit()
             
             attendance_records[student.id] = {
@@ -1,5 +1,8 @@
-from flask import Blueprint, render_template, redirect, url_for
+import os
+from flask import Blueprint, render_template, redirect, url_for, jsonify, request, Response
 from flask_login import current_user, login_required
+from utils.model_warmup import get_model_errors, get_model_status, is_ready
+from utils.metrics import METRICS_TOKEN, render_metrics
 
 main = Blueprint('main', __name__)
 
@@ -18,3 +21,22 @@ def home():
 @main.route('/about')
 def about():
     return render_template('about.html', title='About')
+
+
+@main.route('/healthz/ready')
+def readiness():
+    # Load balancer readiness probe: only route traffic to workers with warm models
+    ready = is_ready()
+    return jsonify({
+        'ready': ready,
+        'pid': os.getpid(),
+        'errors': get_model_errors(),
+        'models': get_model_status()
+    }), 200 if ready else 503
+
+@main.route('/metrics')
+def metrics():
+    # Prometheus scrape target; every gunicorn worker exposes its own counters
+    if METRICS_TOKEN and request.headers.get('Authorization') != f'Bearer {METRICS_TOKEN}':
+        return Response('Unauthorized\n', status=401, mimetype='text/plain')
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
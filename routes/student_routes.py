@@ -7,11 +7,14 @@ import calendar
 import logging
 import os
 import base64
+import tempfile
 from PIL import Image
 from io import BytesIO
 import numpy as np
 import cv2
-from utils.deepface import represent
+from utils.course_gallery import invalidate_course_galleries
+from utils.advanced_face_recognition import EMBEDDING_MODEL_TAG, embed_face_image
+from utils.embedding_store import add_face_template
 
 # Configure logger
 logger = logging.getLogger(__name__)
@@ -266,7 +269,7 @@ def profile():
     student = Student.query.get(student_id)
     
     # Check if face data exists
-    has_face_data = student.face_encoding is not None
+    has_face_data = student.has_face_encoding
     
     # Initialize forms
     from utils.forms import ChangePasswordForm, UpdateFaceForm
@@ -329,32 +332,45 @@ def update_face():
                 nparr = np.frombuffer(image_bytes, np.uint8)
                 image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
                 
-                # Save the image
+                if image is None:
+                    flash('Could not read the image. Please try again.', 'danger')
+                    return redirect(url_for('student.profile'))
+                
+                # Validate the new photo in a temporary file; the stored photo and
+                # embedding are only replaced once it is known to contain a face
                 face_data_path = os.path.join('face_data', f"student_{student.roll_number}.jpg")
                 if not os.path.exists('face_data'):
                     os.makedirs('face_data')
-                cv2.imwrite(face_data_path, image)
-                
-                # Generate face encoding using DeepFace
+                fd, candidate_path = tempfile.mkstemp(prefix=f".student_{student.roll_number}_", suffix='.jpg', dir='face_data')
+                os.close(fd)
                 try:
-                    from utils.deepface import represent
-                    face_objs = represent(image, model_name="VGG-Face", enforce_detection=True, detector_backend="opencv")
+                    cv2.imwrite(candidate_path, image)
                     
-                    if face_objs:
-                        face_encoding = face_objs[0]['embedding']
-                        student.set_face_encoding(face_encoding)
-                        
-                        # Set approval status to false, requiring admin to approve again
-                        student.is_approved = False
-                        db.session.commit()
-                        
-                        logger.info(f"Face encoding updated for student {student.roll_number}")
-                        flash('Your face biometric has been updated! Please wait for admin approval before it becomes active.', 'success')
-                    else:
+                    # Generate the face encoding with the canonical recognition model
+                    face_encoding = embed_face_image(candidate_path, enforce_detection=True)
+                    if face_encoding is None:
                         flash('No face detected in the image. Please try again.', 'danger')
-                except Exception as e:
-                    logger.error(f"Error processing face: {str(e)}")
-                    flash('Error processing face. Please try again with a clearer photo.', 'danger')
+                        return redirect(url_for('student.profile'))
+                    
+                    # The new photo and the replaced one wait for admin approval again
+                    student.is_approved = False
+                    
+                    # The replaced photo stays in the gallery as an extra template
+                    if student.face_embedding is not None and student.face_embedding_model == EMBEDDING_MODEL_TAG:
+                        add_face_template(student, student.get_face_encoding(), EMBEDDING_MODEL_TAG, 'update')
+                    student.set_face_encoding(face_encoding, EMBEDDING_MODEL_TAG)
+                    db.session.commit()
+                    
+                    os.replace(candidate_path, face_data_path)
+                finally:
+                    if os.path.exists(candidate_path):
+                        os.remove(candidate_path)
+                
+                # The stored face image feeds the recognition galleries
+                invalidate_course_galleries([course.id for course in student.courses])
+                
+                logger.info(f"Face encoding updated for student {student.roll_number}")
+                flash('Your face biometric has been updated! Please wait for admin approval before it becomes active.', 'success')
             else:
                 flash('No face data provided. Please try again.', 'danger')
         except Exception as e:
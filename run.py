@@ -1,4 +1,12 @@
 from app import app
+from utils.attendance_jobs import resume_attendance_jobs
+from utils.model_warmup import WARM_UP_MODELS, warm_up_models
+from utils.reembedding import REEMBED_ON_START, resume_or_start_reembedding
 
 if __name__ == '__main__':
+    if WARM_UP_MODELS:
+        warm_up_models()
+    resume_attendance_jobs(app)
+    if REEMBED_ON_START:
+        resume_or_start_reembedding(app)
     app.run(debug=True, host='0.0.0.0', port=5001)
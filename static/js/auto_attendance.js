@@ -5,19 +5,43 @@ let canvas = null;
 let captureBtn = null;
 let isCapturing = false;
 
+// Recognition runs as a background job on the server; poll for its result
+const JOB_POLL_INTERVAL_MS = 1000;
+const PENDING_JOB_KEY_PREFIX = 'autoAttendancePendingJob_';
+
+// Live mode sends downscaled frames at a low fixed rate; the server tracks faces
+// across frames and marks a student once they were recognized in several frames
+const STREAM_INTERVAL_MS = 1000;
+const STREAM_FRAME_WIDTH = 960;
+let liveBtn = null;
+let streamTimer = null;
+let streamId = null;
+let streamInFlight = false;
+
 function initAutoAttendance() {
     // Get DOM elements
     video = document.getElementById('video-attendance');
     canvas = document.getElementById('canvas-attendance');
     captureBtn = document.getElementById('capture-attendance-btn');
+    liveBtn = document.getElementById('live-attendance-btn');
     
     // Add event listeners
     if (captureBtn) {
         captureBtn.addEventListener('click', captureAttendance);
     }
+    if (liveBtn) {
+        liveBtn.addEventListener('click', toggleLiveAttendance);
+    }
     
     // Initialize camera
     initCamera();
+    
+    // Resume a job that was still running when the page was left
+    const pendingJob = sessionStorage.getItem(pendingJobKey());
+    if (pendingJob) {
+        setCapturing(true);
+        pollAttendanceJob(pendingJob);
+    }
 }
 
 function initCamera() {
@@ -72,6 +96,18 @@ function hideCameraError() {
     }
 }
 
+function pendingJobKey() {
+    return PENDING_JOB_KEY_PREFIX + document.getElementById('timetable-id').value;
+}
+
+function setCapturing(capturing) {
+    isCapturing = capturing;
+    captureBtn.disabled = capturing;
+    captureBtn.innerHTML = capturing
+        ? '<i class="fas fa-spinner fa-spin me-2"></i>Processing...'
+        : '<i class="fas fa-camera me-2"></i>Capture Attendance';
+}
+
 function captureAttendance() {
     // Prevent multiple captures
     if (isCapturing) {
@@ -79,58 +115,214 @@ function captureAttendance() {
     }
     
     // Update button state
-    isCapturing = true;
-    captureBtn.disabled = true;
-    captureBtn.innerHTML = '<i class="fas fa-spinner fa-spin me-2"></i>Processing...';
+    setCapturing(true);
     
     // Draw current video frame to canvas
     canvas.width = video.videoWidth;
     canvas.height = video.videoHeight;
     canvas.getContext('2d').drawImage(video, 0, 0, canvas.width, canvas.height);
     
-    // Get image data as base64
-    const imageData = canvas.toDataURL('image/jpeg');
-    
     // Get timetable ID
     const timetableId = document.getElementById('timetable-id').value;
     
-    // Send to server for processing
-    fetch(`/faculty/auto_attendance/${timetableId}`, {
-        method: 'POST',
-        headers: {
-            'Content-Type': 'application/json',
-        },
-        body: JSON.stringify({ image_data: imageData })
+    // Upload the JPEG as a binary multipart field and submit a recognition job
+    canvasToBlob(canvas, 0.9)
+    .then(blob => {
+        const formData = new FormData();
+        formData.append('image', blob, 'snapshot.jpg');
+        formData.append('async', '1');
+        formData.append('annotate', '1');
+        
+        return fetch(`/faculty/auto_attendance/${timetableId}`, {
+            method: 'POST',
+            body: formData
+        });
     })
     .then(response => response.json())
     .then(data => {
-        console.log("Attendance response:", data);
-        
-        if (data.success) {
-            // Show recognized students
-            showRecognitionResults(data);
-            
-            // If annotated image is available, show it
-            if (data.annotated_image) {
-                showAnnotatedImage(data.annotated_image);
-            }
+        if (data.success && data.status_url) {
+            sessionStorage.setItem(pendingJobKey(), data.status_url);
+            pollAttendanceJob(data.status_url);
         } else {
-            // Show error
             showRecognitionError(data.message || "Failed to process attendance");
+            setCapturing(false);
         }
     })
     .catch(error => {
         console.error("Error sending capture:", error);
         showRecognitionError("Network error occurred");
+        setCapturing(false);
+    });
+}
+
+function canvasToBlob(canvasEl, quality) {
+    return new Promise((resolve, reject) => {
+        canvasEl.toBlob(blob => blob ? resolve(blob) : reject(new Error("Could not encode frame")),
+                        'image/jpeg', quality);
+    });
+}
+
+function pollAttendanceJob(statusUrl) {
+    fetch(statusUrl)
+    .then(response => response.json())
+    .then(data => {
+        if (data.success && (data.status === 'queued' || data.status === 'running')) {
+            setTimeout(() => pollAttendanceJob(statusUrl), JOB_POLL_INTERVAL_MS);
+            return;
+        }
+        
+        sessionStorage.removeItem(pendingJobKey());
+        setCapturing(false);
+        handleAttendanceResult(data.status === 'done' ? data.result : {
+            success: false,
+            message: data.error || data.message
+        });
     })
+    .catch(error => {
+        // The job keeps running on the server, so try again
+        console.error("Error polling attendance job:", error);
+        setTimeout(() => pollAttendanceJob(statusUrl), JOB_POLL_INTERVAL_MS * 3);
+    });
+}
+
+function handleAttendanceResult(data) {
+    console.log("Attendance response:", data);
+    
+    if (data.success) {
+        // Show recognized students
+        showRecognitionResults(data);
+        
+        // The reduced-resolution annotated image is fetched separately
+        if (data.annotated_image_url) {
+            showAnnotatedImage(data.annotated_image_url);
+        }
+    } else {
+        // Show error
+        showRecognitionError(data.message || "Failed to process attendance");
+    }
+}
+
+function toggleLiveAttendance() {
+    if (streamTimer) {
+        stopLiveAttendance();
+    } else {
+        startLiveAttendance();
+    }
+}
+
+function startLiveAttendance() {
+    if (!videoStream || isCapturing) {
+        return;
+    }
+    
+    streamId = null;
+    captureBtn.disabled = true;
+    liveBtn.classList.replace('btn-outline-success', 'btn-danger');
+    liveBtn.innerHTML = '<i class="fas fa-stop me-2"></i>Stop Live Attendance';
+    streamTimer = setInterval(sendStreamFrame, STREAM_INTERVAL_MS);
+}
+
+function stopLiveAttendance() {
+    clearInterval(streamTimer);
+    streamTimer = null;
+    captureBtn.disabled = false;
+    liveBtn.classList.replace('btn-danger', 'btn-outline-success');
+    liveBtn.innerHTML = '<i class="fas fa-video me-2"></i>Start Live Attendance';
+    
+    // Let the server drop the tracking state of this stream
+    if (streamId) {
+        const timetableId = document.getElementById('timetable-id').value;
+        fetch(`/faculty/auto_attendance/${timetableId}/stream`, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify({ stream_id: streamId, end: true })
+        }).catch(error => console.error("Error ending stream:", error));
+        streamId = null;
+    }
+}
+
+function sendStreamFrame() {
+    // Skip this tick while the previous frame is still being processed
+    if (streamInFlight || !video.videoWidth) {
+        return;
+    }
+    streamInFlight = true;
+    
+    // Downscale the frame before sending it
+    const scale = Math.min(1, STREAM_FRAME_WIDTH / video.videoWidth);
+    canvas.width = Math.round(video.videoWidth * scale);
+    canvas.height = Math.round(video.videoHeight * scale);
+    canvas.getContext('2d').drawImage(video, 0, 0, canvas.width, canvas.height);
+    
+    // Send the JPEG as the raw request body
+    const timetableId = document.getElementById('timetable-id').value;
+    const query = streamId ? `?stream_id=${encodeURIComponent(streamId)}` : '';
+    canvasToBlob(canvas, 0.8)
+    .then(blob => fetch(`/faculty/auto_attendance/${timetableId}/stream${query}`, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'image/jpeg',
+        },
+        body: blob
+    }))
+    .then(response => response.json())
+    .then(data => {
+        if (!streamTimer) {
+            return;
+        }
+        if (data.success) {
+            streamId = data.stream_id;
+            showLiveResults(data);
+        } else {
+            // The server no longer knows this stream: the next frame starts a new one
+            if (data.restart) {
+                streamId = null;
+            }
+            console.error("Stream frame error:", data.message);
+        }
+    })
+    .catch(error => console.error("Error sending stream frame:", error))
     .finally(() => {
-        // Reset button state
-        isCapturing = false;
-        captureBtn.disabled = false;
-        captureBtn.innerHTML = '<i class="fas fa-camera me-2"></i>Capture Attendance';
+        streamInFlight = false;
     });
 }
 
+function showLiveResults(data) {
+    const resultsContainer = document.getElementById('recognition-results');
+    
+    if (!resultsContainer) {
+        return;
+    }
+    
+    let html = `
+        <div class="alert alert-info mb-3">
+            <i class="fas fa-circle text-danger me-2"></i>
+            Live: ${data.tracks.length} faces in view, ${data.message}
+        </div>
+    `;
+    
+    if (data.recognized_students.length > 0) {
+        html += '<ul class="list-group mb-3">';
+        data.recognized_students.forEach(student => {
+            html += `
+                <li class="list-group-item d-flex justify-content-between align-items-center">
+                    <div>
+                        <strong>${student.name}</strong>
+                        <div class="text-muted small">${student.roll_number}</div>
+                    </div>
+                    <span class="badge bg-success rounded-pill">${student.confidence}</span>
+                </li>
+            `;
+        });
+        html += '</ul>';
+    }
+    
+    html += otherSectionMarkup(data.other_section_students);
+    resultsContainer.innerHTML = html;
+}
+
 function showRecognitionResults(data) {
     const resultsContainer = document.getElementById('recognition-results');
     
@@ -167,6 +359,9 @@ function showRecognitionResults(data) {
         });
         html += '</ul>';
         
+        html += otherSectionMarkup(data.other_section_students);
+        html += rejectedFacesMarkup(data.rejected_faces);
+        
         // Include a reload button
         html += `
             <div class="text-center">
@@ -184,6 +379,8 @@ function showRecognitionResults(data) {
                 <i class="fas fa-exclamation-triangle me-2"></i>
                 ${data.message || "No students recognized in the image"}
             </div>
+            ${otherSectionMarkup(data.other_section_students)}
+            ${rejectedFacesMarkup(data.rejected_faces)}
             <div class="text-center">
                 <button type="button" class="btn btn-primary" onclick="captureAttendance()">
                     <i class="fas fa-redo me-2"></i>Try Again
@@ -193,7 +390,22 @@ function showRecognitionResults(data) {
     }
 }
 
-function showAnnotatedImage(imageData) {
+function otherSectionMarkup(students) {
+    // Students recognized campus-wide who are not on this class roster
+    if (!students || students.length === 0) {
+        return '';
+    }
+    
+    const rolls = students.map(student => `${student.roll_number} (${student.confidence})`).join(', ');
+    return `
+        <div class="alert alert-warning small mb-3">
+            <i class="fas fa-user-times me-2"></i>
+            Not enrolled in this section: ${rolls}
+        </div>
+    `;
+}
+
+function showAnnotatedImage(imageUrl) {
     // Create image preview container if not exists
     let previewContainer = document.getElementById('annotated-image-container');
     
@@ -224,7 +436,7 @@ function showAnnotatedImage(imageData) {
     // Update image source
     const img = document.getElementById('annotated-image');
     if (img) {
-        img.src = imageData;
+        img.src = imageUrl;
     }
 }
 
@@ -248,5 +460,27 @@ function showRecognitionError(message) {
 
 // Clean up resources when page is unloaded
 window.addEventListener('beforeunload', function() {
+    if (streamTimer) {
+        stopLiveAttendance();
+    }
     stopCamera();
 });
+
+function rejectedFacesMarkup(faces) {
+    // Faces skipped before recognition because they were too small, blurred or turned away
+    if (!faces || faces.length === 0) {
+        return '';
+    }
+    
+    const counts = {};
+    faces.forEach(face => face.reasons.forEach(reason => {
+        counts[reason] = (counts[reason] || 0) + 1;
+    }));
+    const reasons = Object.entries(counts).map(([reason, count]) => `${reason}: ${count}`).join(', ');
+    return `
+        <div class="alert alert-secondary small mb-3">
+            <i class="fas fa-eye-slash me-2"></i>
+            ${faces.length} face${faces.length === 1 ? '' : 's'} skipped for image quality (${reasons})
+        </div>
+    `;
+}
@@ -0,0 +1,44 @@
+import os
+import sys
+import tempfile
+from datetime import time
+
+import pytest
+
+# The app reads its database URI on import, so point it at a scratch database first
+_DB_DIR = tempfile.mkdtemp(prefix='attendance-tests-')
+os.environ['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(_DB_DIR, 'test.db')}"
+os.environ.setdefault('MIGRATION_LOCK_FILE', os.path.join(_DB_DIR, 'migrations.lock'))
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture(scope='session')
+def app():
+    from app import app
+    return app
+
+@pytest.fixture
+def db(app):
+    from app import db
+    with app.app_context():
+        yield db
+        db.session.remove()
+        # Leave empty tables for the next test
+        for table in reversed(db.metadata.sorted_tables):
+            db.session.execute(table.delete())
+        db.session.commit()
+
+@pytest.fixture
+def timetable(db):
+    """A course with one timetable slot; returns (timetable id, faculty id)"""
+    from models.models import Course, Faculty, TimeTable
+
+    faculty = Faculty(name='Faculty', email='faculty@test', department='CSE', is_approved=True)
+    course = Course(course_code='CS101', name='Course', credits=3, department='CSE', year=1)
+    db.session.add_all([faculty, course])
+    db.session.flush()
+    timetable = TimeTable(day='Monday', start_time=time(9), end_time=time(10), room='R1', year=1,
+                          course_id=course.id, faculty_id=faculty.id)
+    db.session.add(timetable)
+    db.session.commit()
+    return timetable.id, faculty.id
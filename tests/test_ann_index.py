@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+from utils.ann_index import IVFIndex, exact_search
+
+def _vectors(count, dim=32, seed=0):
+    return np.random.default_rng(seed).standard_normal((count, dim)).astype(np.float32)
+
+def test_search_finds_indexed_vectors():
+    vectors = _vectors(400)
+    ids = [f's{i}' for i in range(len(vectors))]
+    index = IVFIndex.build(ids, vectors, n_probe=4)
+
+    found, scores = index.search(vectors[:50], k=1)
+    assert list(found[:, 0]) == ids[:50]
+    np.testing.assert_allclose(scores[:, 0], 1, atol=1e-5)
+
+def test_search_probing_every_list_is_exact():
+    vectors = _vectors(400)
+    ids = [f's{i}' for i in range(len(vectors))]
+    index = IVFIndex.build(ids, vectors, n_lists=10)
+    queries = _vectors(20, seed=1)
+
+    found, _ = index.search(queries, k=5, n_probe=10)
+    expected, _ = exact_search(vectors, ids, queries, k=5)
+    assert (found == expected).all()
+    assert index.recall(queries, vectors, ids, k=5, n_probe=10)['recall'] == 1.0
+
+def test_add_after_build():
+    vectors = _vectors(300)
+    index = IVFIndex.build([f's{i}' for i in range(200)], vectors[:200])
+    index.add([f's{i}' for i in range(200, 300)], vectors[200:])
+
+    assert len(index) == 300 and 's250' in index
+    found, _ = index.search(vectors[250], k=1, n_probe=len(index.centroids))
+    assert found[0, 0] == 's250'
+
+    with pytest.raises(ValueError):
+        index.add(['s250'], vectors[:1])
+
+def test_empty_and_untrained_index():
+    index = IVFIndex()
+    with pytest.raises(ValueError):
+        index.add(['s0'], _vectors(1))
+
+    found, scores = IVFIndex.build([], np.zeros((0, 32))).search(_vectors(2), k=3)
+    assert found.shape == (2, 3) and (found == None).all()  # noqa: E711
+    assert np.isneginf(scores).all()
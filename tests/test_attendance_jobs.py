@@ -0,0 +1,69 @@
+import socket
+import subprocess
+from datetime import datetime, timedelta
+
+import pytest
+
+from utils import attendance_jobs
+
+class _InlineExecutor:
+    """Runs submitted jobs at once, like a worker picking them up"""
+
+    def submit(self, fn, *args):
+        fn(*args)
+
+@pytest.fixture
+def recognition(monkeypatch):
+    """Record the snapshots recognition is run on"""
+    calls = []
+
+    def run_auto_attendance(timetable, course, image_bytes, annotate=False, include_timings=False):
+        calls.append((image_bytes, annotate))
+        return {'success': True, 'recognized_students': []}
+
+    monkeypatch.setattr(attendance_jobs, 'run_auto_attendance', run_auto_attendance)
+    monkeypatch.setattr(attendance_jobs, '_get_executor', lambda: _InlineExecutor())
+    return calls
+
+def _job(db, timetable, **fields):
+    from models.models import AttendanceJob
+
+    timetable_id, faculty_id = timetable
+    job = AttendanceJob(id=fields.pop('id'), timetable_id=timetable_id, faculty_id=faculty_id, **fields)
+    db.session.add(job)
+    db.session.commit()
+    return job.id
+
+def _dead_pid():
+    process = subprocess.Popen(['true'])
+    process.wait()
+    return process.pid
+
+def test_stored_jobs_are_resumed_once(app, db, timetable, recognition):
+    from models.models import AttendanceJob
+
+    queued = _job(db, timetable, id='queued', status='queued', image=b'jpeg', annotate=True)
+    orphaned = _job(db, timetable, id='orphaned', status='running', image=b'orphan',
+                    runner=f"{socket.gethostname()}:{_dead_pid()}", started_at=datetime.utcnow())
+    expired = _job(db, timetable, id='expired', status='queued', image=b'old',
+                   created_at=datetime.utcnow() - timedelta(days=1))
+    lost = _job(db, timetable, id='lost', status='queued')
+
+    assert sorted(attendance_jobs.resume_attendance_jobs(app)) == [orphaned, queued]
+    # A second worker starting finds nothing left to run
+    assert attendance_jobs.resume_attendance_jobs(app) == []
+    assert sorted(recognition) == [(b'jpeg', True), (b'orphan', False)]
+
+    db.session.expire_all()
+    for job_id in (queued, orphaned):
+        job = db.session.get(AttendanceJob, job_id)
+        assert job.status == 'done' and job.image is None
+    for job_id in (expired, lost):
+        assert db.session.get(AttendanceJob, job_id).status == 'failed'
+
+def test_job_is_only_run_by_the_process_that_claims_it(app, db, timetable, recognition):
+    job_id = _job(db, timetable, id='job', status='queued', image=b'jpeg')
+
+    attendance_jobs._run_job(app, job_id)
+    attendance_jobs._run_job(app, job_id)
+    assert recognition == [(b'jpeg', False)]
@@ -0,0 +1,41 @@
+import os
+import glob
+import threading
+
+import numpy as np
+
+from utils.embedding_cache import EmbeddingCache
+
+def _entries(names):
+    return {name: {'sha1': name, 'mtime_ns': 0, 'size': 0} for name in names}
+
+def test_concurrent_writes_leave_a_loadable_index(tmp_path):
+    # One cache object per writer, as in separate worker processes
+    caches = [EmbeddingCache(str(tmp_path), model_name='Test') for _ in range(2)]
+    names = [f'student_{i}.jpg' for i in range(8)]
+    barrier = threading.Barrier(len(caches))
+    errors = []
+
+    def write(cache, seed):
+        rng = np.random.default_rng(seed)
+        barrier.wait()
+        try:
+            for _ in range(50):
+                cache._write(_entries(names), {name: rng.normal(size=16) for name in names})
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=write, args=(cache, seed)) for seed, cache in enumerate(caches)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+
+    reader = EmbeddingCache(str(tmp_path), model_name='Test')
+    reader._load_index()
+    assert sorted(reader._entries) == names
+    assert reader._matrix.shape == (len(names), 16)
+    # Only the matrix of the final index is left
+    matrices = glob.glob(os.path.join(reader.cache_dir, 'embeddings_Test_*.npy'))
+    assert len(matrices) == 1
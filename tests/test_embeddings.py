@@ -0,0 +1,46 @@
+import glob
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+FACE_DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'face_data')
+
+@pytest.fixture(scope='module')
+def afr():
+    from utils import advanced_face_recognition as afr
+
+    try:
+        afr.get_embedding_backend()
+    except Exception as e:
+        pytest.skip(f"Embedding model unavailable: {e}")
+    return afr
+
+@pytest.fixture(scope='module')
+def face_path():
+    paths = sorted(glob.glob(os.path.join(FACE_DATA_DIR, 'student_*.jpg')))
+    if not paths:
+        pytest.skip('No sample faces in face_data')
+    return paths[0]
+
+def _cosine(a, b):
+    a, b = np.asarray(a, dtype=np.float32), np.asarray(b, dtype=np.float32)
+    return float(a @ b / (np.linalg.norm(a) * np.linalg.norm(b)))
+
+def test_reference_embedding_matches_snapshot_embedding(afr, face_path):
+    reference = afr.embed_face_image(face_path, enforce_detection=True)
+    assert reference is not None
+
+    # The same face in the middle of a classroom snapshot, embedded as recognition does
+    face = cv2.imread(face_path)
+    h, w = face.shape[:2]
+    snapshot = np.full((h * 3, w * 3, 3), 110, dtype=np.uint8)
+    snapshot[h:2 * h, w:2 * w] = face
+
+    faces, keypoints = afr.detect_faces_with_keypoints(snapshot, tiled=False)
+    assert faces
+    largest = max(range(len(faces)), key=lambda i: faces[i][2] * faces[i][3])
+    query = afr.embed_faces(snapshot, [faces[largest]], keypoints=[keypoints[largest]])[0]
+
+    assert _cosine(reference, query) > 0.98
@@ -0,0 +1,34 @@
+import numpy as np
+
+from utils import inference_pool
+from utils.gallery import Gallery
+
+def _gallery(key):
+    gallery = Gallery(['A', 'B'], np.eye(2, dtype=np.float32))
+    gallery.cache_key = key
+    return gallery
+
+def test_worker_asks_for_a_gallery_it_does_not_hold(monkeypatch):
+    monkeypatch.setattr(inference_pool, '_worker_galleries', inference_pool.OrderedDict())
+
+    result = inference_pool._recognize_in_worker(
+        'unused', (1, 1, 3), '|u1', ('campus', None, 0), None, None, None, False, 0, None
+    )
+    assert result == inference_pool._CACHE_MISS
+
+def test_worker_keeps_sent_galleries(monkeypatch):
+    monkeypatch.setattr(inference_pool, '_worker_galleries', inference_pool.OrderedDict())
+    monkeypatch.setattr(inference_pool, 'INFERENCE_GALLERY_CACHE_SIZE', 2)
+    galleries = [_gallery(((course_id, 1), None, course_id)) for course_id in range(3)]
+
+    assert inference_pool._worker_gallery(galleries[0].cache_key, galleries[0]) is galleries[0]
+    assert inference_pool._worker_gallery(galleries[0].cache_key, None) is galleries[0]
+    # Uncached galleries are used as sent
+    assert inference_pool._worker_gallery(None, galleries[1]) is galleries[1]
+    assert inference_pool._worker_gallery(galleries[1].cache_key, None) is None
+
+    # The least recently used gallery is dropped
+    inference_pool._worker_gallery(galleries[1].cache_key, galleries[1])
+    inference_pool._worker_gallery(galleries[0].cache_key, None)
+    inference_pool._worker_gallery(galleries[2].cache_key, galleries[2])
+    assert list(inference_pool._worker_galleries) == [galleries[0].cache_key, galleries[2].cache_key]
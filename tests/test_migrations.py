@@ -0,0 +1,120 @@
+from datetime import date, datetime, time
+
+import pytest
+from sqlalchemy import inspect
+from sqlalchemy.exc import IntegrityError
+
+@pytest.fixture
+def session(db):
+    """A student enrolled in a course with one timetable slot"""
+    from models.models import Course, Faculty, Student, TimeTable
+
+    faculty = Faculty(name='Faculty', email='faculty@test', department='CSE', is_approved=True)
+    course = Course(course_code='CS101', name='Course', credits=3, department='CSE', year=1)
+    student = Student(name='Student', email='student@test', roll_number='R001', department='CSE', year=1)
+    db.session.add_all([faculty, course, student])
+    db.session.flush()
+    timetable = TimeTable(day='Monday', start_time=time(9), end_time=time(10), room='R1', year=1,
+                          course_id=course.id, faculty_id=faculty.id)
+    db.session.add(timetable)
+    db.session.commit()
+    return student.id, course.id, timetable.id
+
+def _drop_attendance_indexes(db):
+    """Bring the attendance table back to its state before the indexes were added"""
+    from models.models import Attendance
+
+    for index in Attendance.__table__.indexes:
+        index.drop(db.engine)
+
+def _attendance_indexes(db):
+    return {index['name']: index for index in inspect(db.engine).get_indexes('attendance')}
+
+def test_migration_merges_duplicates_and_builds_unique_index(db, session):
+    from models.migrations import run_migrations
+    from models.models import Attendance, PhoneUsageLog
+
+    student_id, course_id, timetable_id = session
+    _drop_attendance_indexes(db)
+
+    day = date(2025, 1, 6)
+    records = [
+        Attendance(student_id=student_id, course_id=course_id, timetable_id=timetable_id, date=day,
+                   is_present=False, marked_by='faculty@test', phone_usage_count=1),
+        Attendance(student_id=student_id, course_id=course_id, timetable_id=timetable_id, date=day,
+                   is_present=True, marked_by='auto', time_in=datetime(2025, 1, 6, 9, 5), phone_usage_count=2),
+        Attendance(student_id=student_id, course_id=course_id, timetable_id=timetable_id, date=day,
+                   is_present=False, marked_by='auto', time_in=datetime(2025, 1, 6, 9, 1)),
+        # Another session of the same student is not a duplicate
+        Attendance(student_id=student_id, course_id=course_id, timetable_id=timetable_id,
+                   date=date(2025, 1, 13), is_present=False, marked_by='auto'),
+    ]
+    db.session.add_all(records)
+    db.session.flush()
+    oldest_id = records[0].id
+    db.session.add(PhoneUsageLog(attendance_id=records[1].id, confidence=0.9))
+    db.session.commit()
+
+    run_migrations(db)
+    db.session.expire_all()
+
+    merged = Attendance.query.filter_by(student_id=student_id, timetable_id=timetable_id, date=day).all()
+    assert len(merged) == 1
+    record = merged[0]
+    assert record.id == oldest_id
+    assert record.is_present
+    assert record.time_in == datetime(2025, 1, 6, 9, 1)
+    assert record.phone_usage_count == 3
+    assert [log.attendance_id for log in PhoneUsageLog.query.all()] == [oldest_id]
+    assert Attendance.query.count() == 2
+
+    indexes = _attendance_indexes(db)
+    assert set(indexes) == {index.name for index in Attendance.__table__.indexes}
+    unique = indexes['uq_attendance_student_session']
+    assert unique['unique']
+    assert unique['column_names'] == ['student_id', 'timetable_id', 'date']
+
+    db.session.add(Attendance(student_id=student_id, course_id=course_id, timetable_id=timetable_id,
+                              date=day, marked_by='auto'))
+    with pytest.raises(IntegrityError):
+        db.session.commit()
+    db.session.rollback()
+
+def test_migrations_are_idempotent(db, session):
+    from models.migrations import migration_lock, run_migrations
+
+    with migration_lock(db):
+        run_migrations(db)
+        run_migrations(db)
+    assert {'uq_attendance_student_session', 'ix_attendance_session'} <= set(_attendance_indexes(db))
+
+def test_get_or_create_returns_existing_record(db, session):
+    from models.models import Attendance
+
+    student_id, course_id, timetable_id = session
+    day = date(2025, 1, 6)
+    first, created = Attendance.get_or_create(student_id, course_id, timetable_id, day, marked_by='auto')
+    db.session.commit()
+    second, created_again = Attendance.get_or_create(student_id, course_id, timetable_id, day, marked_by='x')
+    assert created and not created_again
+    assert second.id == first.id
+
+def test_malformed_json_encoding_is_kept(db):
+    import json
+    from models.migrations import run_migrations
+    from models.models import Student
+
+    good = Student(name='Good', email='good@test', roll_number='R002', department='CSE', year=1,
+                   face_encoding=json.dumps([0.5, 0.25, 0.125]))
+    bad = Student(name='Bad', email='bad@test', roll_number='R003', department='CSE', year=1,
+                  face_encoding='[0.5, 0.25,')
+    db.session.add_all([good, bad])
+    db.session.commit()
+
+    run_migrations(db)
+    db.session.expire_all()
+
+    assert good.face_encoding is None
+    assert list(good.get_face_encoding()) == [0.5, 0.25, 0.125]
+    assert bad.face_encoding == '[0.5, 0.25,'
+    assert bad.face_embedding is None
@@ -0,0 +1,26 @@
+import pytest
+
+from utils import model_warmup
+
+@pytest.fixture
+def warm_up_state(monkeypatch):
+    monkeypatch.setattr(model_warmup, 'WARM_UP_MODELS', True)
+    monkeypatch.setattr(model_warmup, '_status', {})
+    monkeypatch.setattr(model_warmup, '_expected', {'face_detection', 'embedding_model'})
+
+def test_ready_once_every_expected_model_is_warm(app, warm_up_state):
+    model_warmup._set_status('face_detection', loaded=True, warm=True)
+    assert app.test_client().get('/healthz/ready').status_code == 503
+
+    model_warmup._set_status('embedding_model', loaded=True, warm=True)
+    response = app.test_client().get('/healthz/ready')
+    assert response.status_code == 200
+    assert response.get_json()['errors'] == {}
+
+def test_a_model_that_failed_keeps_the_worker_unready(app, warm_up_state):
+    model_warmup._set_status('face_detection', loaded=True, warm=True)
+    model_warmup._set_status('embedding_model', error='weights not found')
+
+    response = app.test_client().get('/healthz/ready')
+    assert response.status_code == 503
+    assert response.get_json()['errors'] == {'embedding_model': 'weights not found'}
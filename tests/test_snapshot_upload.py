@@ -0,0 +1,39 @@
+import io
+import json
+import base64
+
+import pytest
+
+@pytest.fixture
+def faculty_routes(app, monkeypatch):
+    from routes import faculty_routes
+
+    monkeypatch.setattr(faculty_routes, 'MAX_SNAPSHOT_BYTES', 1024)
+    return faculty_routes
+
+def _chunked(app, body, content_type):
+    # No Content-Length, as with Transfer-Encoding: chunked behind gunicorn
+    return app.test_request_context(
+        '/faculty/auto_attendance/1', method='POST', input_stream=io.BytesIO(body),
+        headers={'Content-Type': content_type, 'Transfer-Encoding': 'chunked'},
+        environ_overrides={'wsgi.input_terminated': True}
+    )
+
+def test_chunked_json_snapshot_over_the_limit_is_rejected(app, faculty_routes, monkeypatch):
+    def decode(*args, **kwargs):
+        raise AssertionError('base64 decoded')
+    monkeypatch.setattr(faculty_routes.base64, 'b64decode', decode)
+
+    body = json.dumps({'image_data': base64.b64encode(b'\xff' * 2048).decode()}).encode()
+    with _chunked(app, body, 'application/json'):
+        assert faculty_routes._read_snapshot() == (None, {}, ('Image is too large', 413))
+
+def test_chunked_json_snapshot_within_the_limit_is_read(app, faculty_routes):
+    body = json.dumps({'image_data': 'data:image/jpeg;base64,' + base64.b64encode(b'jpeg').decode(),
+                       'annotate': '1'}).encode()
+    with _chunked(app, body, 'application/json'):
+        assert faculty_routes._read_snapshot() == (b'jpeg', {'annotate': '1'}, None)
+
+def test_chunked_image_snapshot_over_the_limit_is_rejected(app, faculty_routes):
+    with _chunked(app, b'\xff' * 2048, 'image/jpeg'):
+        assert faculty_routes._read_snapshot() == (None, {}, ('Image is too large', 413))
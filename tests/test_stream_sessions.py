@@ -0,0 +1,57 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from utils.face_tracking import StreamSessionError, end_stream_session, get_stream_session, save_stream_session
+
+def _start(db, timetable_id, faculty_id):
+    session = get_stream_session(None, timetable_id, faculty_id)
+    track, = session.tracker.update([(10, 20, 80, 80)])
+    track.set_embedding(np.arange(4, dtype=np.float32), {'student_id': 'R001', 'confidence': 0.8})
+    track.vote()
+    session.frames = 1
+    save_stream_session(session)
+    db.session.commit()
+    return session
+
+def test_stream_state_survives_between_frames(db, timetable):
+    timetable_id, faculty_id = timetable
+    started = _start(db, timetable_id, faculty_id)
+
+    # As if the next frame landed on another worker: only the database is shared
+    db.session.expunge_all()
+    session = get_stream_session(started.stream_id, timetable_id, faculty_id)
+    assert session.frames == 1
+    track, = session.tracker.update([(12, 20, 80, 80)])
+    assert track.track_id == started.tracker.tracks[0].track_id
+    assert track.votes == {'R001': 1}
+    np.testing.assert_array_equal(track.embedding, np.arange(4, dtype=np.float32))
+    assert not track.needs_embedding()
+
+def test_unknown_or_expired_stream_is_refused(db, timetable):
+    from models.models import AttendanceStream
+
+    timetable_id, faculty_id = timetable
+    with pytest.raises(StreamSessionError) as error:
+        get_stream_session('0' * 32, timetable_id, faculty_id)
+    assert error.value.status == 404
+
+    started = _start(db, timetable_id, faculty_id)
+    db.session.get(AttendanceStream, started.stream_id).last_seen = datetime.utcnow() - timedelta(days=1)
+    db.session.commit()
+    with pytest.raises(StreamSessionError) as error:
+        get_stream_session(started.stream_id, timetable_id, faculty_id)
+    assert error.value.status == 404
+
+def test_stream_of_another_session_is_refused(db, timetable):
+    timetable_id, faculty_id = timetable
+    started = _start(db, timetable_id, faculty_id)
+
+    with pytest.raises(StreamSessionError) as error:
+        get_stream_session(started.stream_id, timetable_id + 1, faculty_id)
+    assert error.value.status == 409
+
+    end_stream_session(started.stream_id, faculty_id)
+    with pytest.raises(StreamSessionError):
+        get_stream_session(started.stream_id, timetable_id, faculty_id)
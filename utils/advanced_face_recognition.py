@@ -4,11 +4,19 @@ import cv2
 import numpy as np
 import mediapipe as mp
 import logging
-from scipy.spatial.distance import cosine
 from PIL import Image
 from io import BytesIO
 import base64
 import time
+import threading
+from utils.embedding_cache import get_embedding_cache
+from utils.embedding_models import get_embedding_model_spec
+from utils.inference_backends import create_backend
+from utils.gallery import Gallery
+from utils.inference_pool import get_inference_pool
+from utils.tiled_detection import FACE_DETECTION_TILING, detect_tiled
+from utils.face_quality import assess_faces
+from utils.metrics import timed
 
 # Configure logger
 logger = logging.getLogger(__name__)
@@ -40,54 +48,292 @@ face_detection = mp_face_detection.FaceDetection(
 
 face_mesh = mp_face_mesh.FaceMesh(
     static_image_mode=True,
-    max_num_faces=10,  # Set to handle multiple faces
+    max_num_faces=1,  # Run on one face region at a time
     min_detection_confidence=0.5
 )
 
+# The canonical embedding model (see utils.embedding_models); its tag is stored with every embedding
+EMBEDDING_MODEL = get_embedding_model_spec()
+EMBEDDING_MODEL_TAG = EMBEDDING_MODEL.tag
+
+# Model input resolution and maximum number of faces per embedding forward pass
+EMBEDDING_INPUT_SIZE = EMBEDDING_MODEL.input_size
+EMBEDDING_BATCH_SIZE = int(os.environ.get('FACE_EMBEDDING_BATCH_SIZE', 32))
+
+# Aligned face crops: size, distance between the eyes and height of the eyes (fraction from the top)
+ALIGNED_FACE_SIZE = 160
+ALIGNED_EYE_DISTANCE = 70
+ALIGNED_EYE_HEIGHT = 0.4
+
+# Face regions are cropped this many times the box size, so the mesh sees the whole
+# head and rotated warps do not pull in pixels from outside the crop
+FACE_CROP_PADDING = 1.5
+
+# FaceMesh landmarks averaged into the image-left and image-right eye centres
+_MESH_LEFT_EYE = [33, 145, 159]
+_MESH_RIGHT_EYE = [263, 374, 386]
+
+# Longest side (pixels) of the downscaled copy face detection runs on; 0 detects at full resolution
+DETECTION_MAX_SIDE = int(os.environ.get('FACE_DETECTION_MAX_SIDE', 1280))
+
+# Embedding model backend (built on first use or by utils.model_warmup)
+_embedding_backend = None
+_embedding_backend_lock = threading.Lock()
+
+# The MediaPipe graphs above are not thread-safe; serialize calls from threaded workers
+# (the inference pool gives every process its own instances instead)
+_mediapipe_lock = threading.Lock()
+
+# Per-thread MediaPipe detectors used by tiled detection
+_tile_detectors = threading.local()
+
 # Load Haar Cascade as backup
 face_cascade = cv2.CascadeClassifier(
     cv2.data.haarcascades + "haarcascade_frontalface_default.xml"
 )
 
+def decode_image(image_bytes):
+    """Decode JPEG/PNG bytes (or any buffer) into an OpenCV image without extra copies"""
+    img_array = np.frombuffer(image_bytes, np.uint8)
+    if img_array.size == 0:
+        return None
+    return cv2.imdecode(img_array, cv2.IMREAD_COLOR)
+
+# imdecode flags that decode a JPEG at 1/2, 1/4 or 1/8 resolution straight from its DCT blocks
+REDUCED_DECODE_FLAGS = {
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+def jpeg_dimensions(image_bytes):
+    """
+    Read (width, height) from the SOF marker of a JPEG without decoding it
+    Returns None for anything that is not a readable JPEG
+    """
+    data = memoryview(image_bytes).cast('B')
+    if data[:2].tobytes() != b'\xff\xd8':
+        return None
+    
+    i = 2
+    while i + 9 < len(data):
+        if data[i] != 0xFF:
+            i += 1
+            continue
+        marker = data[i + 1]
+        # Fill bytes and markers without a payload
+        if marker == 0xFF:
+            i += 1
+            continue
+        if marker in (0x01, 0xD8) or 0xD0 <= marker <= 0xD7:
+            i += 2
+            continue
+        # Start-of-frame markers (DHT, JPG and DAC share the range)
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height = int.from_bytes(data[i + 5:i + 7], 'big')
+            width = int.from_bytes(data[i + 7:i + 9], 'big')
+            return width, height
+        i += 2 + int.from_bytes(data[i + 2:i + 4], 'big')
+    
+    return None
+
+class FullResolutionSource:
+    """
+    Full-resolution pixels of an image that was decoded at 1/factor resolution
+    The full image is only decoded when a face crop is requested, and only the crops are kept
+    """
+    
+    def __init__(self, image_bytes, factor):
+        self.image_bytes = image_bytes
+        self.factor = factor
+    
+    def crops(self, faces):
+        """Return a full-resolution crop (or None) for every box given in reduced coordinates"""
+        full = decode_image(self.image_bytes)
+        if full is None:
+            return [None] * len(faces)
+        
+        fh, fw = full.shape[:2]
+        crops = []
+        for (x, y, w, h) in faces:
+            x0 = min(fw - 1, max(0, int(x * self.factor)))
+            y0 = min(fh - 1, max(0, int(y * self.factor)))
+            x1 = min(fw, int(round((x + w) * self.factor)))
+            y1 = min(fh, int(round((y + h) * self.factor)))
+            crops.append(full[y0:y1, x0:x1].copy() if x1 > x0 and y1 > y0 else None)
+        return crops
+
+def decode_image_for_detection(image_bytes, max_side=None):
+    """
+    Decode an uploaded image at the lowest resolution detection can use
+    JPEGs are decoded with IMREAD_REDUCED_COLOR_2/4/8, picking the largest reduction
+    that keeps the longest side at least max_side (DETECTION_MAX_SIDE by default)
+    Returns (image, FullResolutionSource), the source being None at full resolution
+    """
+    max_side = DETECTION_MAX_SIDE if max_side is None else max_side
+    
+    factor = 1
+    size = jpeg_dimensions(image_bytes) if max_side else None
+    if size:
+        factor = next((f for f in (8, 4, 2) if max(size) / f >= max_side), 1)
+    
+    if factor == 1:
+        return decode_image(image_bytes), None
+    
+    img = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), REDUCED_DECODE_FLAGS[factor])
+    if img is None:
+        return None, None
+    return img, FullResolutionSource(image_bytes, factor)
+
 def base64_to_cv2_image(base64_string):
     """Convert base64 string to OpenCV image"""
     if ',' in base64_string:
         base64_string = base64_string.split(',')[1]
     
-    img_data = base64.b64decode(base64_string)
-    img_array = np.frombuffer(img_data, np.uint8)
-    img = cv2.imdecode(img_array, cv2.IMREAD_COLOR)
-    return img
+    return decode_image(base64.b64decode(base64_string))
 
-def detect_faces(img):
+def _detection_copy(img, max_side=None):
+    """
+    Return (working image, scale) where the working image's longest side is at most
+    max_side (DETECTION_MAX_SIDE by default); scale maps original to working coordinates
+    """
+    max_side = DETECTION_MAX_SIDE if max_side is None else max_side
+    ih, iw = img.shape[:2]
+    longest = max(ih, iw)
+    
+    if not max_side or longest <= max_side:
+        return img, 1.0
+    
+    scale = max_side / longest
+    small = cv2.resize(img, (max(1, round(iw * scale)), max(1, round(ih * scale))), interpolation=cv2.INTER_AREA)
+    return small, scale
+
+def detect_faces(img, max_side=None):
     """
     Enhanced face detection using MediaPipe first, then falling back to Haar Cascade
-    Returns a list of face bounding boxes as (x, y, w, h)
+    Large images are searched on a downscaled copy of at most max_side pixels
+    (DETECTION_MAX_SIDE by default) and the boxes mapped back, so alignment and
+    embedding still crop the faces from the full-resolution image
+    Returns a list of face bounding boxes as (x, y, w, h) in original coordinates
+    """
+    return detect_faces_with_keypoints(img, max_side)[0]
+
+def detect_faces_with_keypoints(img, max_side=None, tiled=None):
+    """
+    Detect faces like detect_faces, also returning the six MediaPipe keypoints of each
+    face (eye image-left, eye image-right, nose tip, mouth, ear image-left, ear image-right)
+    as a (6, 2) float32 array in original coordinates; faces found by the fallback
+    detectors have None instead
+    With tiled (FACE_DETECTION_TILING by default) overlapping tiles of the image are
+    searched in parallel as well, to find small faces in large rooms
+    Returns (boxes, keypoints)
     """
     if img is None:
         logger.error("Input image is None")
-        return []
-        
+        return [], []
+    
+    if tiled is None:
+        tiled = FACE_DETECTION_TILING
+    if tiled:
+        return _detect_faces_tiled(img, max_side)
+    
+    work_img, scale = _detection_copy(img, max_side)
+    faces, keypoints = _detect_faces_at(work_img)
+    return _map_faces(img, scale, faces, keypoints)
+
+def _map_faces(img, scale, faces, keypoints):
+    """Map boxes and keypoints found on a copy scaled by scale back to img coordinates"""
+    if scale == 1.0:
+        return faces, keypoints
+    
+    ih, iw = img.shape[:2]
+    mapped = []
+    for (x, y, w, h) in faces:
+        x = min(iw - 1, max(0, int(round(x / scale))))
+        y = min(ih - 1, max(0, int(round(y / scale))))
+        mapped.append((x, y, min(int(round(w / scale)), iw - x), min(int(round(h / scale)), ih - y)))
+    return mapped, [points / scale if points is not None else None for points in keypoints]
+
+def _mediapipe_faces(img, detector):
+    """Run a MediaPipe detector on img; returns (boxes, scores, keypoints)"""
     # Convert to RGB for MediaPipe
     rgb_img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    detection_result = detector.process(rgb_img)
+    
+    boxes = []
+    scores = []
+    keypoints = []
+    for detection in detection_result.detections or []:
+        # Get bounding box from detection
+        bboxC = detection.location_data.relative_bounding_box
+        ih, iw, _ = img.shape
+        x = max(0, int(bboxC.xmin * iw))
+        y = max(0, int(bboxC.ymin * ih))
+        w = min(int(bboxC.width * iw), iw - x)
+        h = min(int(bboxC.height * ih), ih - y)
+        if w <= 0 or h <= 0:
+            continue
+        boxes.append((x, y, w, h))
+        scores.append(float(detection.score[0]) if detection.score else 0.0)
+        
+        points = detection.location_data.relative_keypoints
+        keypoints.append(
+            np.array([(p.x * iw, p.y * ih) for p in points], dtype=np.float32) if len(points) >= 2 else None
+        )
+    return boxes, scores, keypoints
+
+def _tile_detector():
+    """MediaPipe detector of the calling thread, for detecting tiles in parallel"""
+    detector = getattr(_tile_detectors, 'detector', None)
+    if detector is None:
+        detector = _tile_detectors.detector = mp_face_detection.FaceDetection(
+            model_selection=1,
+            min_detection_confidence=0.5
+        )
+    return detector
+
+def _detect_faces_tiled(img, max_side=None):
+    """
+    Detect faces on overlapping tiles of img in parallel, together with a whole-image
+    pass on the usual downscaled copy for faces larger than the tile overlap
+    Returns (boxes, keypoints) in img coordinates, falling back to the regular cascade
+    when no tile has a face
+    """
+    def full_image():
+        work_img, scale = _detection_copy(img, max_side)
+        boxes, scores, keypoints = _mediapipe_faces(work_img, _tile_detector())
+        return (
+            [tuple(v / scale for v in box) for box in boxes],
+            scores,
+            [points / scale if points is not None else None for points in keypoints]
+        )
+    
+    boxes, keypoints, report = detect_tiled(
+        img, lambda tile: _mediapipe_faces(tile, _tile_detector()), full_image_fn=full_image
+    )
+    tile_ms = ', '.join(f"{tile['ms']:.0f}" for tile in report['tiles'])
+    logger.info(
+        f"Tiled detection of {report['image'][0]}x{report['image'][1]} image: {len(report['tiles'])} tiles "
+        f"({tile_ms} ms), whole image {report['full_image']['ms']:.0f} ms, "
+        f"{report['faces']} faces after NMS in {report['ms']:.0f} ms"
+    )
+    
+    if boxes:
+        return boxes, keypoints
     
+    work_img, scale = _detection_copy(img, max_side)
+    faces, keypoints = _detect_faces_at(work_img)
+    return _map_faces(img, scale, faces, keypoints)
+
+def _detect_faces_at(img):
+    """Run the detector cascade on img as given; returns (boxes, keypoints)"""
     # Try MediaPipe face detection first (more accurate)
-    detection_result = face_detection.process(rgb_img)
-    faces = []
+    with _mediapipe_lock:
+        faces, _, keypoints = _mediapipe_faces(img, face_detection)
     
-    if detection_result.detections:
-        for detection in detection_result.detections:
-            # Get bounding box from detection
-            bboxC = detection.location_data.relative_bounding_box
-            ih, iw, _ = img.shape
-            x = max(0, int(bboxC.xmin * iw))
-            y = max(0, int(bboxC.ymin * ih))
-            w = min(int(bboxC.width * iw), iw - x)
-            h = min(int(bboxC.height * ih), ih - y)
-            faces.append((x, y, w, h))
-        
-        if faces:
-            return faces
+    if faces:
+        return faces, keypoints
+    faces = []
     
     # If MediaPipe fails or doesn't find any faces, try Haar cascade
     gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
@@ -96,7 +342,7 @@ def detect_faces(img):
     )
     
     if len(haar_faces) > 0:
-        return [(x, y, w, h) for (x, y, w, h) in haar_faces]
+        return [(x, y, w, h) for (x, y, w, h) in haar_faces], [None] * len(haar_faces)
     
     # As a last resort, try DeepFace's built-in detector
     if DEEPFACE_AVAILABLE:
@@ -114,12 +360,103 @@ def detect_faces(img):
         except Exception as e:
             logger.error(f"DeepFace extraction error: {str(e)}")
     
-    return faces
+    return faces, [None] * len(faces)
+
+def _padded_box(face, shape, padding=FACE_CROP_PADDING):
+    """A face box grown padding times around its centre, clipped to an image of shape, as (x, y, w, h)"""
+    x, y, w, h = face
+    cx, cy = x + w / 2, y + h / 2
+    x0 = max(0, int(cx - w * padding / 2))
+    y0 = max(0, int(cy - h * padding / 2))
+    x1 = min(shape[1], int(np.ceil(cx + w * padding / 2)))
+    y1 = min(shape[0], int(np.ceil(cy + h * padding / 2)))
+    return x0, y0, max(0, x1 - x0), max(0, y1 - y0)
+
+def _mesh_eyes(img, faces):
+    """
+    Locate the eye centres of faces without detector keypoints with FaceMesh, run on
+    a padded region around every box, so no face is left out however many there are
+    Returns a (2, 2) array of image-left and image-right eye centre (or None) per box
+    """
+    eyes = [None] * len(faces)
+    
+    for i, (x, y, w, h) in enumerate(faces):
+        x0, y0, rw, rh = _padded_box((x, y, w, h), img.shape)
+        if rw == 0 or rh == 0:
+            continue
+        rgb_roi = cv2.cvtColor(img[y0:y0 + rh, x0:x0 + rw], cv2.COLOR_BGR2RGB)
+        with _mediapipe_lock:
+            result = face_mesh.process(rgb_roi)
+        if not result.multi_face_landmarks:
+            continue
+        
+        landmarks = result.multi_face_landmarks[0].landmark
+        pair = np.array([
+            np.mean([(landmarks[j].x * rw + x0, landmarks[j].y * rh + y0) for j in _MESH_LEFT_EYE], axis=0),
+            np.mean([(landmarks[j].x * rw + x0, landmarks[j].y * rh + y0) for j in _MESH_RIGHT_EYE], axis=0)
+        ], dtype=np.float32)
+        
+        # Only accept a mesh of this box's face, not of a neighbour in the padding
+        mx, my = pair.mean(axis=0)
+        if x <= mx < x + w and y <= my < y + h:
+            eyes[i] = pair
+    return eyes
 
-def align_face(img, face):
+def _alignment_matrices(eyes):
     """
-    Align face for better recognition accuracy
+    Affine matrices that rotate and scale every face so its eyes are level,
+    ALIGNED_EYE_DISTANCE apart and centred ALIGNED_EYE_HEIGHT from the top
+    eyes: (N, 2, 2) image-left and image-right eye centres
+    Returns (N, 2, 3) matrices, the same as cv2.getRotationMatrix2D plus translation
+    """
+    left, right = eyes[:, 0], eyes[:, 1]
+    delta = right - left
+    angle = np.arctan2(delta[:, 1], delta[:, 0])
+    scale = ALIGNED_EYE_DISTANCE / np.maximum(1.0, np.hypot(delta[:, 0], delta[:, 1]))
+    centre = (left + right) / 2
+    
+    alpha = scale * np.cos(angle)
+    beta = scale * np.sin(angle)
+    matrices = np.empty((len(eyes), 2, 3), dtype=np.float64)
+    matrices[:, 0, 0] = alpha
+    matrices[:, 0, 1] = beta
+    matrices[:, 0, 2] = ALIGNED_FACE_SIZE / 2 - alpha * centre[:, 0] - beta * centre[:, 1]
+    matrices[:, 1, 0] = -beta
+    matrices[:, 1, 1] = alpha
+    matrices[:, 1, 2] = ALIGNED_FACE_SIZE * ALIGNED_EYE_HEIGHT + beta * centre[:, 0] - alpha * centre[:, 1]
+    return matrices
+
+def _warp_faces(img, eyes):
+    """
+    Warp every face of img into an aligned ALIGNED_FACE_SIZE crop
+    The inverse maps of all faces are stacked into one map, so the whole batch is
+    resampled by a single cv2.remap call
+    Returns an (N, size, size, 3) array
     """
+    size = ALIGNED_FACE_SIZE
+    matrices = _alignment_matrices(np.asarray(eyes, dtype=np.float64))
+    
+    # Invert [A | t]: source = A^-1 (dest - t)
+    linear = matrices[:, :, :2]
+    inverse = np.linalg.inv(linear)
+    offset = -np.einsum('nij,nj->ni', inverse, matrices[:, :, 2])
+    
+    v, u = np.mgrid[0:size, 0:size].astype(np.float64)
+    map_x = inverse[:, 0, 0, None, None] * u + inverse[:, 0, 1, None, None] * v + offset[:, 0, None, None]
+    map_y = inverse[:, 1, 0, None, None] * u + inverse[:, 1, 1, None, None] * v + offset[:, 1, None, None]
+    
+    # cv2.remap maps are limited to 32767 rows
+    chunk = 32767 // size
+    warped = []
+    for start in range(0, len(matrices), chunk):
+        mx = map_x[start:start + chunk].reshape(-1, size).astype(np.float32)
+        my = map_y[start:start + chunk].reshape(-1, size).astype(np.float32)
+        out = cv2.remap(img, mx, my, interpolation=cv2.INTER_CUBIC, borderMode=cv2.BORDER_CONSTANT)
+        warped.append(out.reshape(-1, size, size, img.shape[2]))
+    return np.concatenate(warped)
+
+def _resized_face(img, face):
+    """Crop a face box without alignment, resized to ALIGNED_FACE_SIZE"""
     x, y, w, h = face
     
     # Ensure coordinates are within image boundaries
@@ -128,251 +465,440 @@ def align_face(img, face):
     w = min(w, img.shape[1] - x)
     h = min(h, img.shape[0] - y)
     
-    # Extract face region
     face_roi = img[y:y+h, x:x+w]
-    
-    # Check if ROI is valid
-    if face_roi.size == 0 or face_roi.shape[0] == 0 or face_roi.shape[1] == 0:
+    if face_roi.size == 0:
         logger.warning("Invalid face ROI")
-        return cv2.resize(img, (160, 160))
-    
-    # Convert to RGB for MediaPipe
-    rgb_roi = cv2.cvtColor(face_roi, cv2.COLOR_BGR2RGB)
-    
-    # Get face mesh landmarks
-    result = face_mesh.process(rgb_roi)
-    
-    if not result.multi_face_landmarks or len(result.multi_face_landmarks) == 0:
-        # If no landmarks found, just resize the face ROI
-        return cv2.resize(face_roi, (160, 160))
-    
-    landmarks = result.multi_face_landmarks[0].landmark
-    
-    # Get coordinates for eyes
-    left_eye_indices = [33, 145, 159]  # Simplified indices
-    right_eye_indices = [263, 374, 386]
-    
-    # Calculate eye centers
-    left_eye_points = []
-    right_eye_points = []
-    
-    h_roi, w_roi, _ = face_roi.shape
-    
-    for idx in left_eye_indices:
-        if idx < len(landmarks):
-            point = landmarks[idx]
-            x_coord, y_coord = int(point.x * w_roi), int(point.y * h_roi)
-            left_eye_points.append((x_coord, y_coord))
-    
-    for idx in right_eye_indices:
-        if idx < len(landmarks):
-            point = landmarks[idx]
-            x_coord, y_coord = int(point.x * w_roi), int(point.y * h_roi)
-            right_eye_points.append((x_coord, y_coord))
-    
-    # If we don't have enough points, just resize
-    if len(left_eye_points) == 0 or len(right_eye_points) == 0:
-        return cv2.resize(face_roi, (160, 160))
-    
-    left_eye_center = np.mean(left_eye_points, axis=0).astype(int)
-    right_eye_center = np.mean(right_eye_points, axis=0).astype(int)
+        return cv2.resize(img, (ALIGNED_FACE_SIZE, ALIGNED_FACE_SIZE))
+    return cv2.resize(face_roi, (ALIGNED_FACE_SIZE, ALIGNED_FACE_SIZE))
+
+def align_faces(img, faces, keypoints=None, source=None):
+    """
+    Align every face box of an image for better recognition accuracy
+    Eye centres come from the detector keypoints; faces without them (Haar or DeepFace
+    detections) are meshed one padded region at a time, and faces with no eyes found
+    are simply resized. The warps of all faces are applied in one remap
+    When img is a reduced decode, faces too small to fill the embedding input are
+    warped from padded full-resolution crops of the source instead
+    Returns an aligned crop (or None) for every box
+    """
+    faces = [tuple(int(v) for v in face) for face in faces]
+    if keypoints is None:
+        keypoints = [None] * len(faces)
+    eyes = [points[:2] if points is not None else None for points in keypoints]
+    
+    missing = [i for i, pair in enumerate(eyes) if pair is None]
+    if missing:
+        for i, pair in zip(missing, _mesh_eyes(img, [faces[i] for i in missing])):
+            eyes[i] = pair
+    
+    full_res = set()
+    if source is not None:
+        full_res = {i for i, (x, y, w, h) in enumerate(faces) if min(w, h) < EMBEDDING_INPUT_SIZE[0]}
+    
+    aligned = [None] * len(faces)
+    
+    warp = [i for i in range(len(faces)) if i not in full_res and eyes[i] is not None]
+    if warp:
+        for i, face_img in zip(warp, _warp_faces(img, [eyes[i] for i in warp])):
+            aligned[i] = face_img
+    for i in range(len(faces)):
+        if i not in full_res and eyes[i] is None:
+            aligned[i] = _resized_face(img, faces[i])
+    
+    if full_res:
+        order = sorted(full_res)
+        # Padded regions, so that rotating the face does not pull in black borders
+        regions = [_padded_box(faces[i], img.shape) for i in order]
+        factor = source.factor
+        for i, region, crop in zip(order, regions, source.crops(regions)):
+            if crop is None:
+                continue
+            origin = np.array([int(region[0] * factor), int(region[1] * factor)], dtype=np.float32)
+            if eyes[i] is None:
+                x, y, w, h = faces[i]
+                box = (int(x * factor) - int(origin[0]), int(y * factor) - int(origin[1]),
+                       int(round(w * factor)), int(round(h * factor)))
+                aligned[i] = _resized_face(crop, box)
+                continue
+            # Eye centres in the crop's full-resolution coordinates
+            aligned[i] = _warp_faces(crop, [eyes[i] * factor - origin])[0]
+    
+    return aligned
+
+def align_face(img, face, keypoints=None):
+    """
+    Align face for better recognition accuracy
+    """
+    return align_faces(img, [face], keypoints=[keypoints])[0]
+
+def get_embedding_backend():
+    """
+    Build the inference backend of the canonical embedding model (FACE_INFERENCE_BACKEND)
+    once per process and reuse it for every batch
+    """
+    global _embedding_backend
+    with _embedding_backend_lock:
+        if _embedding_backend is None:
+            _embedding_backend = create_backend(spec=EMBEDDING_MODEL)
+            logger.info(f"Embedding model running on {_embedding_backend.describe()}")
+    return _embedding_backend
+
+def _prepare_embedding_input(face_img):
+    """
+    Convert an aligned BGR face crop into a model input: EMBEDDING_INPUT_SIZE, BGR, scaled to [0, 1]
+    (the same layout DeepFace.represent feeds the model)
+    """
+    if face_img is None or face_img.size == 0:
+        return None
     
-    # Calculate angle for alignment
-    dY = right_eye_center[1] - left_eye_center[1]
-    dX = right_eye_center[0] - left_eye_center[0]
-    angle = np.degrees(np.arctan2(dY, dX))
+    if face_img.shape[:2] != EMBEDDING_INPUT_SIZE:
+        face_img = cv2.resize(face_img, EMBEDDING_INPUT_SIZE)
     
-    # Calculate scale
-    dist = np.sqrt((dX**2) + (dY**2))
-    desired_dist = 70  # Desired distance between eyes
-    scale = desired_dist / max(1, dist)
+    return face_img.astype(np.float32) / 255.0
+
+def extract_embeddings_batch(face_imgs, batch_size=None):
+    """
+    Extract facial embeddings for several aligned faces at once
+    The crops are stacked into one tensor and run through the model in chunks of
+    at most batch_size (FACE_EMBEDDING_BATCH_SIZE by default)
+    Returns a list with an embedding (or None) for every input face
+    """
+    embeddings = [None] * len(face_imgs)
     
-    # Calculate center point
-    eyes_center = (
-        int((left_eye_center[0] + right_eye_center[0]) // 2),
-        int((left_eye_center[1] + right_eye_center[1]) // 2)
-    )
+    batch_size = max(1, batch_size or EMBEDDING_BATCH_SIZE)
     
-    # Get rotation matrix
-    M = cv2.getRotationMatrix2D(eyes_center, angle, scale)
+    inputs = []
+    positions = []
+    for i, face_img in enumerate(face_imgs):
+        prepared = _prepare_embedding_input(face_img)
+        if prepared is None:
+            logger.error("Invalid face image")
+            continue
+        inputs.append(prepared)
+        positions.append(i)
     
-    # Update translation component
-    tX = 160 / 2  # Center horizontally
-    tY = 160 * 0.4  # Place eyes about 40% from the top
-    M[0, 2] += (tX - eyes_center[0])
-    M[1, 2] += (tY - eyes_center[1])
+    if not inputs:
+        return embeddings
     
-    # Apply the affine transformation
-    aligned_face = cv2.warpAffine(face_roi, M, (160, 160), flags=cv2.INTER_CUBIC)
+    try:
+        backend = get_embedding_backend()
+        batch = np.stack(inputs)
+        
+        for start in range(0, len(batch), batch_size):
+            chunk = batch[start:start + batch_size]
+            output = np.atleast_2d(backend.embed(chunk))
+            
+            for offset, embedding in enumerate(output):
+                embeddings[positions[start + offset]] = embedding
+    except Exception as e:
+        logger.error(f"Error extracting batch embeddings: {str(e)}")
     
-    return aligned_face
+    return embeddings
 
 def extract_embeddings(face_img):
     """
     Extract facial embeddings using DeepFace
     Returns embeddings for a single face
     """
-    if not DEEPFACE_AVAILABLE:
-        logger.error("DeepFace is not available")
-        return None
-    
+    return extract_embeddings_batch([face_img])[0]
+
+def embed_faces(img, faces, source=None, keypoints=None, timings=None):
+    """
+    Align every face box of an image and embed them in one batch
+    keypoints are the detector keypoints of the boxes, if known
+    timings, if a dict, receives the milliseconds spent in "align" and "embed"
+    Returns an embedding (or None) for every box
+    """
     try:
-        # Check if face is valid
-        if face_img is None or face_img.size == 0:
-            logger.error("Invalid face image")
-            return None
-        
-        # Convert to RGB (DeepFace expects RGB)
-        face_rgb = cv2.cvtColor(face_img, cv2.COLOR_BGR2RGB)
-        
-        # Ensure minimum size
-        if face_rgb.shape[0] < 64 or face_rgb.shape[1] < 64:
-            face_rgb = cv2.resize(face_rgb, (160, 160))
-        
-        # Use DeepFace for feature extraction
-        embedding_obj = DeepFace.represent(
-            face_rgb, 
-            model_name="Facenet", 
-            enforce_detection=False,
-            detector_backend="opencv"
-        )
-        
-        if embedding_obj and len(embedding_obj) > 0:
-            return embedding_obj[0]["embedding"]
-        return None
+        with timed("align", timings):
+            aligned_faces = align_faces(img, faces, keypoints=keypoints, source=source)
     except Exception as e:
-        logger.error(f"Error extracting embeddings: {str(e)}")
-        return None
+        logger.error(f"Error aligning faces: {str(e)}")
+        return [None] * len(faces)
+    
+    with timed("embed", timings):
+        return extract_embeddings_batch(aligned_faces)
+
+def identify_embeddings(embeddings, gallery, threshold=0.4, fallback_index=None):
+    """
+    Match a batch of embeddings against the gallery one-to-one, looking faces that
+    match nobody up in fallback_index (an IVFIndex over the whole campus) if given
+    Returns a {"student_id", "confidence"[, "in_roster"]} dict or None per embedding
+    """
+    if not len(embeddings):
+        return []
+    
+    matches = gallery.match(embeddings, threshold=threshold)
+    
+    # Identify the remaining faces against every approved student
+    unmatched = [i for i, match_result in enumerate(matches) if match_result is None]
+    if fallback_index is not None and len(fallback_index) and unmatched:
+        roster = set(gallery.ids)
+        ids, scores = fallback_index.search(np.stack([embeddings[i] for i in unmatched]), k=1)
+        for i, candidate, score in zip(unmatched, ids[:, 0], scores[:, 0]):
+            # Roster students were already given their chance in the one-to-one assignment
+            if candidate is not None and candidate not in roster and score > threshold:
+                matches[i] = {"student_id": candidate, "confidence": float(score), "in_roster": False}
+    
+    return matches
 
 def match_face_with_database(embedding, database, threshold=0.4):
     """
     Match a face embedding with a database of students
+    Accepts a student_id -> data dictionary or a prebuilt Gallery
     Returns the student ID if a match is found, None otherwise
     """
     if embedding is None or not database:
         return None
     
-    best_match = None
-    min_distance = float('inf')
-    
-    for student_id, student_data in database.items():
-        if not isinstance(student_data, dict) or "embeddings" not in student_data:
-            continue
-            
-        student_embedding = student_data["embeddings"]
-        distance = cosine(embedding, student_embedding)
-        
-        if distance < min_distance:
-            min_distance = distance
-            best_match = student_id
-    
-    # Calculate confidence score (1 - distance)
-    confidence = 1 - min_distance
-    
-    if confidence > threshold:
-        return {
-            "student_id": best_match,
-            "confidence": confidence
-        }
-    return None
+    gallery = database if isinstance(database, Gallery) else Gallery.from_database(database)
+    return gallery.match([embedding], threshold=threshold)[0]
+
+def _draw_face(result_img, box, scale, label, color):
+    """Draw a labelled face box, given in original coordinates, on a (possibly reduced) image"""
+    x, y, w, h = (int(round(v * scale)) for v in box)
+    cv2.rectangle(result_img, (x, y), (x + w, y + h), color, 2)
+    cv2.putText(result_img, label, (x, y - 10),
+               cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
 
-def recognize_students_in_image(img, database, draw_detections=True):
+def recognize_students_in_image(img, database, draw_detections=True, threshold=0.4, fallback_index=None,
+                                annotation_max_side=0, source=None, report=None):
     """
     Recognize multiple students in an image
-    Returns list of recognized students with bounding boxes
+    img may be a reduced decode with its FullResolutionSource as source; returned
+    boxes are always in full-resolution coordinates
+    The annotated image is drawn on a copy reduced to annotation_max_side pixels
+    (0 keeps the full resolution)
+    All faces are scored against the gallery with one matrix product and assigned
+    one-to-one, so two faces can never be marked as the same student
+    Faces matching nobody in the gallery are looked up in fallback_index (an
+    IVFIndex over the whole campus) if given; such matches carry in_roster=False
+    Faces too small, blurred or turned away to match are skipped before alignment;
+    they are listed under "rejected_faces" in report, if a dict is given, and the
+    milliseconds spent in every stage under "timings"
+    Returns list of recognized students with bounding boxes (and the face embedding,
+    which is not meant for clients)
     """
     if img is None:
         logger.error("Input image is None")
         return [], img
     
+    timings = report.setdefault("timings", {}) if report is not None else {}
+    
     # Make a copy of the image for drawing
-    result_img = img.copy() if draw_detections else None
+    result_img = None
+    draw_scale = 1.0
+    if draw_detections:
+        result_img, draw_scale = _detection_copy(img, annotation_max_side)
+        if result_img is img:
+            result_img = img.copy()
     
     # Detect faces
-    faces = detect_faces(img)
+    with timed("detect", timings):
+        faces, keypoints = detect_faces_with_keypoints(img)
     recognized_students = []
     
     if not faces:
-        logger.info("No faces detected in the image")
+        logger.info(f"No faces detected in the image (detect {timings['detect']:.0f} ms)")
         return [], result_img
     
-    # Process each detected face
-    for (x, y, w, h) in faces:
-        # Skip very small faces
-        if w < 50 or h < 50:
+    gallery = database if isinstance(database, Gallery) else Gallery.from_database(database)
+    
+    # Skip faces that cannot match: too small (measured at full resolution), blurred or
+    # turned away; only the rest go through alignment and the embedding model
+    scale = source.factor if source is not None else 1
+    with timed("quality", timings):
+        quality = assess_faces(img, faces, keypoints, scale=scale)
+    kept = [i for i, face_quality in enumerate(quality) if face_quality["passed"]]
+    boxes = [faces[i] for i in kept]
+    
+    rejected_faces = []
+    for (x, y, w, h), face_quality in zip(faces, quality):
+        if face_quality["passed"]:
             continue
+        rejected_faces.append(dict(
+            {key: value for key, value in face_quality.items() if key != "passed"},
+            bbox=tuple(int(round(v * scale)) for v in (x, y, w, h))
+        ))
+        if draw_detections:
+            _draw_face(result_img, (x, y, w, h), draw_scale, ", ".join(face_quality["reasons"]), (160, 160, 160))
+    if report is not None:
+        report["faces"] = len(faces)
+        report["rejected_faces"] = rejected_faces
+    
+    # Align and embed all faces in one forward pass, dropping faces that failed
+    embeddings = embed_faces(img, boxes, source=source, keypoints=[keypoints[i] for i in kept], timings=timings)
+    embedded = [(box, embedding) for box, embedding in zip(boxes, embeddings) if embedding is not None]
+    
+    # Match all faces of the frame against the gallery at once
+    with timed("match", timings):
+        matches = identify_embeddings(
+            np.stack([e for _, e in embedded]) if embedded else [],
+            gallery, threshold=threshold, fallback_index=fallback_index
+        )
+    
+    logger.info(
+        f"Recognition of {img.shape[1]}x{img.shape[0]} image with {len(faces)} faces "
+        f"({len(rejected_faces)} rejected by quality): "
+        + ", ".join(f"{stage} {ms:.0f} ms" for stage, ms in timings.items())
+    )
+    
+    for ((x, y, w, h), embedding), match_result in zip(embedded, matches):
+        if match_result:
+            student_id = match_result["student_id"]
+            confidence = match_result["confidence"]
             
-        try:
-            # Align the face
-            aligned_face = align_face(img, (x, y, w, h))
+            in_roster = match_result.get("in_roster", True)
             
-            # Extract embeddings
-            embedding = extract_embeddings(aligned_face)
+            recognized_students.append({
+                "student_id": student_id,
+                "confidence": confidence,
+                "bbox": tuple(int(round(v * scale)) for v in (x, y, w, h)),
+                "in_roster": in_roster,
+                "embedding": embedding
+            })
             
-            if embedding is not None:
-                # Match with database
-                match_result = match_face_with_database(embedding, database)
-                
-                if match_result:
-                    student_id = match_result["student_id"]
-                    confidence = match_result["confidence"]
-                    
-                    recognized_students.append({
-                        "student_id": student_id,
-                        "confidence": confidence,
-                        "bbox": (x, y, w, h)
-                    })
-                    
-                    # Draw bounding box and label if requested
-                    if draw_detections:
-                        cv2.rectangle(result_img, (x, y), (x + w, y + h), (0, 255, 0), 2)
-                        label = f"{student_id} ({confidence:.2f})"
-                        cv2.putText(result_img, label, (x, y - 10),
-                                   cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
-                else:
-                    # Draw red box for unrecognized faces
-                    if draw_detections:
-                        cv2.rectangle(result_img, (x, y), (x + w, y + h), (0, 0, 255), 2)
-                        cv2.putText(result_img, "Unknown", (x, y - 10),
-                                   cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 2)
-        except Exception as e:
-            logger.error(f"Error processing face at ({x},{y}): {str(e)}")
-            continue
+            # Draw bounding box and label if requested (orange for students from other sections)
+            if draw_detections:
+                color = (0, 255, 0) if in_roster else (0, 165, 255)
+                _draw_face(result_img, (x, y, w, h), draw_scale, f"{student_id} ({confidence:.2f})", color)
+        else:
+            # Draw red box for unrecognized faces
+            if draw_detections:
+                _draw_face(result_img, (x, y, w, h), draw_scale, "Unknown", (0, 0, 255))
     
     return recognized_students, result_img
 
-def process_attendance_image(base64_image, student_database):
+def track_students_in_frame(img, database, tracker, threshold=0.4, fallback_index=None):
+    """
+    Recognize students in one frame of a live stream
+    Faces are associated with the tracker's tracks, and only tracks that are new or
+    whose face got markedly larger are embedded; every other track reuses its
+    identity and simply adds a vote for it
+    Returns (tracks observed in the frame, number of faces embedded)
+    """
+    if img is None:
+        logger.error("Input image is None")
+        return [], 0
+    
+    gallery = database if isinstance(database, Gallery) else Gallery.from_database(database)
+    
+    # Skip very small faces (stream frames are already downscaled, so they are never tiled)
+    faces, keypoints = detect_faces_with_keypoints(img, tiled=False)
+    keypoints_by_box = {
+        tuple(face): points for face, points in zip(faces, keypoints) if face[2] >= 50 and face[3] >= 50
+    }
+    tracks = tracker.update(list(keypoints_by_box))
+    
+    # Tracks whose face is blurred or turned away this frame wait for a better one
+    pending = [track for track in tracks if track.needs_embedding()]
+    quality = assess_faces(img, [track.bbox for track in pending],
+                           [keypoints_by_box.get(track.bbox) for track in pending])
+    pending = [track for track, face_quality in zip(pending, quality) if face_quality["passed"]]
+    embedded = [
+        (track, embedding)
+        for track, embedding in zip(pending, embed_faces(
+            img, [track.bbox for track in pending],
+            keypoints=[keypoints_by_box.get(track.bbox) for track in pending]
+        ) if pending else [])
+        if embedding is not None
+    ]
+    
+    if embedded:
+        identities = identify_embeddings(
+            np.stack([embedding for _, embedding in embedded]),
+            gallery, threshold=threshold, fallback_index=fallback_index
+        )
+        for (track, embedding), identity in zip(embedded, identities):
+            track.set_embedding(embedding, identity)
+    
+    for track in tracks:
+        track.vote()
+    
+    return tracks, len(embedded)
+
+def process_attendance_image(image_bytes, student_database, fallback_index=None, annotate=False,
+                             annotation_max_side=0, report=None):
     """
     Process an attendance image with multiple students
-    Returns recognized students and annotated image
+    Accepts the encoded JPEG/PNG bytes of the snapshot
+    report, if a dict, receives the faces rejected by quality gating and the
+    milliseconds spent in every stage ("timings")
+    Returns recognized students and, if annotate is set, the annotated image reduced
+    to annotation_max_side pixels (or None)
     """
+    if report is None:
+        report = {}
+    timings = report.setdefault("timings", {})
+    
     try:
-        # Convert base64 to image
-        img = base64_to_cv2_image(base64_image)
+        # Decode the uploaded bytes, at reduced resolution for large JPEGs (tiled
+        # detection searches the full resolution)
+        with timed("decode", timings):
+            img, source = decode_image_for_detection(image_bytes, max_side=0 if FACE_DETECTION_TILING else None)
         
         if img is None:
-            logger.error("Failed to convert base64 to image")
+            logger.error("Failed to decode attendance image")
             return [], None
+        logger.info(
+            f"Decoded attendance image at {img.shape[1]}x{img.shape[0]} "
+            f"(1/{source.factor if source else 1}) in {timings['decode']:.0f} ms"
+        )
         
-        # Recognize students in the image
-        recognized_students, annotated_img = recognize_students_in_image(img, student_database)
-        
-        # Convert annotated image back to base64 for display
-        if annotated_img is not None:
-            _, buffer = cv2.imencode('.jpg', annotated_img)
-            img_str = base64.b64encode(buffer).decode('utf-8')
-            base64_img = f"data:image/jpeg;base64,{img_str}"
-        else:
-            base64_img = None
+        # Recognize students in the image, in a dedicated inference process if configured
+        pool = get_inference_pool()
+        if pool is not None:
+            gallery = student_database if isinstance(student_database, Gallery) else Gallery.from_database(student_database)
+            # The worker's stage timings come back in its report; "inference_pool" is the
+            # whole round trip, including queueing and the shared-memory hand-over
+            with timed("inference_pool", timings):
+                recognized_students, annotated_img = pool.recognize(
+                    img, gallery, fallback_index=fallback_index,
+                    draw_detections=annotate, annotation_max_side=annotation_max_side, source=source,
+                    report=report
+                )
+            return recognized_students, annotated_img
         
-        return recognized_students, base64_img
+        return recognize_students_in_image(
+            img, student_database, draw_detections=annotate, fallback_index=fallback_index,
+            annotation_max_side=annotation_max_side, source=source, report=report
+        )
     except Exception as e:
         logger.error(f"Error processing attendance image: {str(e)}")
         return [], None
 
-def load_student_embeddings(face_data_dir):
+def embed_face_image(face_path, enforce_detection=False):
+    """
+    Extract the reference embedding for a stored face image with the canonical model
+    This is the only way reference embeddings are produced (registration, gallery
+    building and re-embedding). The image goes through the recognition path
+    (detect_faces_with_keypoints, align_faces, extract_embeddings_batch), so
+    references and snapshot faces are aligned and preprocessed the same way
+    The largest detected face is the student's; with enforce_detection, images
+    without a detectable face yield None, otherwise the whole image is embedded
+    Returns the embedding vector or None
+    """
+    img = cv2.imread(face_path)
+    if img is None:
+        logger.error(f"Could not read face image {face_path}")
+        return None
+
+    faces, keypoints = detect_faces_with_keypoints(img, tiled=False)
+    if not faces:
+        if enforce_detection:
+            logger.warning(f"No face detected in {face_path}")
+            return None
+        faces, keypoints = [(0, 0, img.shape[1], img.shape[0])], [None]
+
+    largest = max(range(len(faces)), key=lambda i: faces[i][2] * faces[i][3])
+    return embed_faces(img, [faces[largest]], keypoints=[keypoints[largest]])[0]
+
+def load_student_embeddings(face_data_dir, roll_numbers=None):
     """
     Load student face embeddings from the face_data directory
+    Embeddings are served from the persistent embedding cache; only new or
+    changed images are run through the model.
+    If roll_numbers is given, only those students' images are considered.
     Returns a dictionary of student_id -> embeddings
     """
     database = {}
@@ -382,31 +908,24 @@ def load_student_embeddings(face_data_dir):
         return database
     
     try:
-        for filename in os.listdir(face_data_dir):
-            if filename.startswith("student_") and filename.endswith(".jpg"):
-                # Extract student ID from filename (student_12345.jpg -> 12345)
-                student_id = filename.replace("student_", "").replace(".jpg", "")
-                
-                # Full path to the face image
-                face_path = os.path.join(face_data_dir, filename)
-                
-                # Extract embeddings
-                if DEEPFACE_AVAILABLE:
-                    try:
-                        embedding = DeepFace.represent(
-                            img_path=face_path, 
-                            model_name="Facenet", 
-                            enforce_detection=False,
-                            detector_backend="opencv"
-                        )
-                        
-                        if embedding and len(embedding) > 0:
-                            database[student_id] = {
-                                "embeddings": embedding[0]["embedding"],
-                                "filename": filename
-                            }
-                    except Exception as e:
-                        logger.error(f"Error extracting embeddings for {student_id}: {str(e)}")
+        if roll_numbers is not None:
+            filenames = [f"student_{roll_number}.jpg" for roll_number in roll_numbers]
+        else:
+            filenames = [
+                filename for filename in os.listdir(face_data_dir)
+                if filename.startswith("student_") and filename.endswith(".jpg")
+            ]
+        
+        cache = get_embedding_cache(face_data_dir, model_name=EMBEDDING_MODEL_TAG)
+        embeddings = cache.get_embeddings(filenames, embed_face_image)
+        
+        for filename, embedding in embeddings.items():
+            # Extract student ID from filename (student_12345.jpg -> 12345)
+            student_id = filename[len("student_"):-len(".jpg")]
+            database[student_id] = {
+                "embeddings": embedding,
+                "filename": filename
+            }
     except Exception as e:
         logger.error(f"Error loading student database: {str(e)}")
     
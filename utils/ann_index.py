@@ -0,0 +1,201 @@
+import time
+import logging
+import numpy as np
+from utils.gallery import l2_normalize
+
+# Configure logger
+logger = logging.getLogger(__name__)
+
+def _kmeans(vectors, k, n_iter=15, seed=0):
+    """
+    Spherical k-means (cosine similarity) with Lloyd iterations
+    Returns a (k x dim) matrix of L2-normalized centroids
+    """
+    rng = np.random.default_rng(seed)
+    k = max(1, min(k, len(vectors)))
+    centroids = vectors[rng.choice(len(vectors), size=k, replace=False)].copy()
+
+    for _ in range(n_iter):
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+        counts = np.bincount(assignment, minlength=k)
+
+        # Reseed empty clusters with random points
+        empty = counts == 0
+        if empty.any():
+            sums[empty] = vectors[rng.choice(len(vectors), size=int(empty.sum()))]
+
+        centroids = l2_normalize(sums)
+
+    return centroids
+
+def exact_search(embeddings, ids, queries, k=5):
+    """
+    Brute-force cosine top-k search, used as the reference for recall
+
+    Returns:
+        (ids, scores) arrays of shape (queries x k); missing slots hold None / -inf
+    """
+    embeddings = l2_normalize(np.atleast_2d(embeddings))
+    queries = l2_normalize(np.atleast_2d(queries))
+    ids = np.asarray(ids, dtype=object)
+
+    result_ids = np.full((len(queries), k), None, dtype=object)
+    result_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+    if len(ids) == 0:
+        return result_ids, result_scores
+
+    scores = queries @ embeddings.T
+    kk = min(k, scores.shape[1])
+    top = np.argpartition(-scores, kk - 1, axis=1)[:, :kk]
+    for i in range(len(queries)):
+        order = top[i][np.argsort(-scores[i, top[i]])]
+        result_ids[i, :kk] = ids[order]
+        result_scores[i, :kk] = scores[i, order]
+    return result_ids, result_scores
+
+class IVFIndex:
+    """
+    Approximate nearest-neighbour index for cosine similarity, in pure NumPy
+
+    Vectors are L2-normalized and partitioned into ``n_lists`` inverted lists by
+    spherical k-means. A query only scores the vectors in its ``n_probe`` closest
+    lists. The index is built once from all identities and never modified; a
+    change of the campus rebuilds it.
+    """
+
+    # Identifies a cached, never modified index to the inference pool processes
+    cache_key = None
+
+    def __init__(self, n_lists=None, n_probe=8, seed=0):
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.seed = seed
+
+        self.centroids = None
+
+        self._ids = np.zeros(0, dtype=object)
+        self._data = None
+        self._lists = []
+        self._positions = {}
+
+    @property
+    def is_trained(self):
+        return self.centroids is not None
+
+    def __len__(self):
+        return len(self._positions)
+
+    def __contains__(self, identity):
+        return identity in self._positions
+
+    def train(self, vectors):
+        """Learn the coarse centroids from sample vectors"""
+        vectors = l2_normalize(np.atleast_2d(vectors))
+        n_lists = self.n_lists or max(1, int(np.sqrt(len(vectors))))
+        self.centroids = _kmeans(vectors, n_lists, seed=self.seed).astype(np.float32)
+        self._lists = [np.zeros(0, dtype=np.int64) for _ in range(len(self.centroids))]
+        return self
+
+    def add(self, ids, vectors):
+        """
+        Add new identities; the index must be trained first
+        """
+        if not self.is_trained:
+            raise ValueError("IVFIndex must be trained before adding vectors")
+
+        ids = list(ids)
+        if not ids:
+            return
+        duplicates = [identity for identity in ids if identity in self._positions]
+        if duplicates or len(set(ids)) != len(ids):
+            raise ValueError(f"Identities are already in the index: {duplicates or ids}")
+
+        vectors = l2_normalize(np.atleast_2d(vectors)).astype(np.float32)
+        assignment = np.argmax(vectors @ self.centroids.T, axis=1)
+
+        start = len(self._ids)
+        positions = np.arange(start, start + len(ids))
+
+        self._ids = np.concatenate([self._ids, np.asarray(ids, dtype=object)])
+        self._data = vectors if self._data is None else np.concatenate([self._data, vectors])
+
+        for list_id in np.unique(assignment):
+            self._lists[list_id] = np.concatenate([self._lists[list_id], positions[assignment == list_id]])
+        for identity, position in zip(ids, positions):
+            self._positions[identity] = int(position)
+
+    def search(self, queries, k=5, n_probe=None):
+        """
+        Approximate cosine top-k search for a batch of query embeddings
+
+        Returns:
+            (ids, scores) arrays of shape (queries x k); missing slots hold None / -inf
+        """
+        queries = l2_normalize(np.atleast_2d(queries))
+        n_probe = min(n_probe or self.n_probe, len(self._lists)) if self.is_trained else 0
+
+        result_ids = np.full((len(queries), k), None, dtype=object)
+        result_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        if not len(self) or n_probe == 0:
+            return result_ids, result_scores
+
+        coarse = queries @ self.centroids.T
+        probes = np.argpartition(-coarse, n_probe - 1, axis=1)[:, :n_probe]
+
+        for i, query in enumerate(queries):
+            candidates = np.concatenate([self._lists[list_id] for list_id in probes[i]])
+            if not len(candidates):
+                continue
+
+            scores = self._data[candidates] @ query
+
+            kk = min(k, len(candidates))
+            top = np.argpartition(-scores, kk - 1)[:kk]
+            top = top[np.argsort(-scores[top])]
+            result_ids[i, :kk] = self._ids[candidates[top]]
+            result_scores[i, :kk] = scores[top]
+
+        return result_ids, result_scores
+
+    def recall(self, queries, embeddings, ids, k=5, n_probe=None):
+        """
+        Measure recall@k of this index against exact search over the given embeddings
+
+        Returns:
+            Dictionary with recall, ANN and exact query latency (ms) and index size
+        """
+        start = time.perf_counter()
+        exact_ids, _ = exact_search(embeddings, ids, queries, k=k)
+        exact_ms = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        ann_ids, _ = self.search(queries, k=k, n_probe=n_probe)
+        ann_ms = (time.perf_counter() - start) * 1000
+
+        hits = 0
+        total = 0
+        for truth, found in zip(exact_ids, ann_ids):
+            truth = {identity for identity in truth if identity is not None}
+            hits += len(truth & {identity for identity in found if identity is not None})
+            total += len(truth)
+
+        return {
+            'recall': hits / total if total else 1.0,
+            'k': k,
+            'n_probe': n_probe or self.n_probe,
+            'ann_ms': ann_ms,
+            'exact_ms': exact_ms,
+            'size': len(self)
+        }
+
+    @classmethod
+    def build(cls, ids, embeddings, **kwargs):
+        """Train an index on the given embeddings and add them all"""
+        index = cls(**kwargs)
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if len(embeddings):
+            index.train(embeddings)
+            index.add(ids, embeddings)
+        return index
@@ -0,0 +1,75 @@
+import os
+import re
+import time
+import uuid
+import logging
+import tempfile
+import cv2
+
+# Configure logger
+logger = logging.getLogger(__name__)
+
+# Annotated snapshots are stored as files so any worker can serve them
+ANNOTATED_IMAGE_DIR = os.environ.get(
+    'ANNOTATED_IMAGE_DIR', os.path.join(tempfile.gettempdir(), 'smartclass_annotated')
+)
+
+# Longest side of the stored annotated image, and how long it is kept (seconds)
+ANNOTATED_IMAGE_MAX_SIDE = int(os.environ.get('ANNOTATED_IMAGE_MAX_SIDE', 960))
+ANNOTATED_IMAGE_TTL = int(os.environ.get('ANNOTATED_IMAGE_TTL', 3600))
+
+_TOKEN_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+def _path(token):
+    return os.path.join(ANNOTATED_IMAGE_DIR, f"{token}.jpg")
+
+def _purge_expired(now):
+    try:
+        for filename in os.listdir(ANNOTATED_IMAGE_DIR):
+            path = os.path.join(ANNOTATED_IMAGE_DIR, filename)
+            try:
+                if now - os.stat(path).st_mtime > ANNOTATED_IMAGE_TTL:
+                    os.remove(path)
+            except OSError:
+                pass
+    except FileNotFoundError:
+        pass
+
+def save_annotated_image(img, quality=80):
+    """
+    Encode an annotated image as JPEG and store it
+
+    Returns:
+        Token to fetch it with load_annotated_image, or None on failure
+    """
+    if img is None:
+        return None
+
+    try:
+        ok, buffer = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        if not ok:
+            return None
+
+        os.makedirs(ANNOTATED_IMAGE_DIR, exist_ok=True)
+        _purge_expired(time.time())
+
+        token = uuid.uuid4().hex
+        tmp_path = _path(token) + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(buffer.tobytes())
+        os.replace(tmp_path, _path(token))
+        return token
+    except OSError as e:
+        logger.error(f"Error saving annotated image: {str(e)}")
+        return None
+
+def load_annotated_image(token):
+    """Return the JPEG bytes of a stored annotated image, or None if unknown or expired"""
+    if not _TOKEN_PATTERN.match(token or ''):
+        return None
+
+    try:
+        with open(_path(token), 'rb') as f:
+            return f.read()
+    except OSError:
+        return None
@@ -0,0 +1,182 @@
+import io
+import os
+import re
+import csv
+import zipfile
+from xml.sax.saxutils import escape
+
+from utils.attendance_reports import iter_attendance_summaries
+
+# Rows read from the database and written to the response per chunk
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 1000))
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+}
+
+STUDENT_COLUMNS = ['Student ID', 'Name', 'Roll Number', 'Present', 'Total Classes', 'Attendance Percentage']
+COURSE_COLUMNS = ['Course Code', 'Course', 'Department']
+
+# Characters XML 1.0 does not allow, even escaped
+_INVALID_XML_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+
+def _export_rows(course_id, department, batch_size, percentage):
+    """Header and a generator of the rows of an attendance export"""
+    # A single course keeps the columns of the original per-course export
+    header = STUDENT_COLUMNS if course_id is not None else COURSE_COLUMNS + STUDENT_COLUMNS
+
+    def rows():
+        for course_code, course_name, course_department, row in iter_attendance_summaries(
+                course_id=course_id, department=department, batch_size=batch_size):
+            values = [row.student_id, row.student_name, row.roll_number, row.present_count,
+                      row.total_classes, percentage(row.attendance_percentage)]
+            yield values if course_id is not None else [course_code, course_name, course_department] + values
+
+    return header, rows()
+
+def iter_attendance_csv(course_id=None, department=None, batch_size=EXPORT_BATCH_SIZE):
+    """
+    Attendance export as CSV, in chunks of batch_size rows
+
+    Args:
+        course_id: Only this course, if given
+        department: Only courses of this department, if given
+        batch_size: Rows per yielded chunk
+
+    Yields:
+        CSV text, starting with the header line
+    """
+    header, rows = _export_rows(course_id, department, batch_size, lambda value: f"{value:.2f}%")
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+
+    for count, values in enumerate(rows, 1):
+        writer.writerow(values)
+        if count % batch_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+class _ChunkBuffer(io.RawIOBase):
+    """
+    Write-only, unseekable file that collects what is written until drained
+
+    zipfile writes to it in streaming mode (local headers followed by data
+    descriptors), so an archive can be sent while it is being compressed.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+def _cell(column, row, value):
+    ref = f"{chr(ord('A') + column)}{row}"
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return f'<c r="{ref}"><v>{value}</v></c>'
+    text = escape(_INVALID_XML_CHARS.sub('', '' if value is None else str(value)))
+    return f'<c r="{ref}" t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+def _row(number, values):
+    return f'<row r="{number}">' + ''.join(_cell(i, number, value) for i, value in enumerate(values)) + '</row>'
+
+_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '</Types>'
+)
+_ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="Attendance" sheetId="1" r:id="rId1"/></sheets>'
+    '</workbook>'
+)
+_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+    'Target="worksheets/sheet1.xml"/>'
+    '</Relationships>'
+)
+_SHEET_START = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+)
+_SHEET_END = '</sheetData></worksheet>'
+
+def iter_attendance_xlsx(course_id=None, department=None, batch_size=EXPORT_BATCH_SIZE):
+    """
+    Attendance export as an XLSX workbook, written in constant memory
+
+    The workbook is a minimal SpreadsheetML package with one sheet of inline
+    strings, zipped as it is generated, so no spreadsheet library is needed and
+    only one batch of rows is ever held. The percentage is a number rounded to
+    two decimals rather than text.
+
+    Args:
+        course_id: Only this course, if given
+        department: Only courses of this department, if given
+        batch_size: Rows per yielded chunk
+
+    Yields:
+        Bytes of the .xlsx file
+    """
+    header, rows = _export_rows(course_id, department, batch_size, lambda value: round(value, 2))
+    buffer = _ChunkBuffer()
+
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('[Content_Types].xml', _CONTENT_TYPES)
+        archive.writestr('_rels/.rels', _ROOT_RELS)
+        archive.writestr('xl/workbook.xml', _WORKBOOK)
+        archive.writestr('xl/_rels/workbook.xml.rels', _WORKBOOK_RELS)
+
+        # force_zip64: the size of the sheet is not known before it is written
+        with archive.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as sheet:
+            sheet.write((_SHEET_START + _row(1, header)).encode('utf-8'))
+            for number, values in enumerate(rows, 2):
+                sheet.write(_row(number, values).encode('utf-8'))
+                if (number - 1) % batch_size == 0:
+                    yield buffer.drain()
+            sheet.write(_SHEET_END.encode('utf-8'))
+
+    yield buffer.drain()
+
+def iter_attendance_export(export_format, course_id=None, department=None, batch_size=EXPORT_BATCH_SIZE):
+    """Chunks of an attendance export in export_format (a key of EXPORT_FORMATS)"""
+    if export_format == 'xlsx':
+        return iter_attendance_xlsx(course_id, department, batch_size)
+    return iter_attendance_csv(course_id, department, batch_size)
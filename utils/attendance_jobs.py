@@ -0,0 +1,425 @@
+import os
+import uuid
+import socket
+import logging
+import threading
+from datetime import datetime, date, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+# Configure logger
+logger = logging.getLogger(__name__)
+
+# Background threads per web worker that run submitted recognition jobs
+ATTENDANCE_JOB_WORKERS = int(os.environ.get('ATTENDANCE_JOB_WORKERS', 2))
+
+# A job still running after this many seconds is assumed lost (e.g. the worker was restarted)
+ATTENDANCE_JOB_TIMEOUT = int(os.environ.get('ATTENDANCE_JOB_TIMEOUT', 300))
+
+# Keep confident recognitions as extra face templates (at most one per student per day)
+FACE_TEMPLATES_FROM_RECOGNITION = os.environ.get('FACE_TEMPLATES_FROM_RECOGNITION', 'False').lower() == 'true'
+FACE_TEMPLATE_MIN_CONFIDENCE = float(os.environ.get('FACE_TEMPLATE_MIN_CONFIDENCE', 0.75))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=max(1, ATTENDANCE_JOB_WORKERS),
+                thread_name_prefix='attendance-job'
+            )
+        return _executor
+
+def mark_students_present(timetable, course, course_gallery, recognized_students):
+    """
+    Mark today's attendance for recognized roster students (the caller commits)
+
+    Returns:
+        (marked students, students recognized campus-wide who are not on the roster)
+    """
+    from models.models import Attendance
+
+    today = date.today()
+
+    marked_students = []
+    other_section_students = []
+    for recognition in recognized_students:
+        roll_number = recognition['student_id']
+        confidence = recognition['confidence']
+
+        # Students identified campus-wide are reported, never marked
+        if not recognition.get('in_roster', True):
+            other_section_students.append({
+                'roll_number': roll_number,
+                'confidence': f"{confidence:.2f}",
+                'bbox': recognition.get('bbox')
+            })
+            continue
+
+        # Find the student in the course roster
+        student = course_gallery.students.get(roll_number)
+
+        if student:
+            attendance, created = Attendance.get_or_create(
+                student['id'], course.id, timetable.id, today,
+                is_present=True,
+                marked_by='auto',
+                time_in=datetime.now()
+            )
+            if not created:
+                attendance.is_present = True
+                attendance.marked_by = 'auto'
+                if not attendance.time_in:
+                    attendance.time_in = datetime.now()
+
+            marked_students.append({
+                'id': student['id'],
+                'name': student['name'],
+                'roll_number': student['roll_number'],
+                'confidence': f"{confidence:.2f}",
+                'bbox': recognition.get('bbox')
+            })
+
+    return marked_students, other_section_students
+
+def learn_face_templates(course_gallery, recognized_students):
+    """
+    Store confident roster recognitions as extra face templates (the caller commits)
+
+    Returns:
+        Ids of the courses whose galleries have to be rebuilt
+    """
+    from models.models import Student, FaceTemplate
+    from utils.advanced_face_recognition import EMBEDDING_MODEL_TAG
+    from utils.embedding_store import add_face_template
+
+    today_start = datetime.combine(date.today(), datetime.min.time())
+
+    course_ids = set()
+    for recognition in recognized_students:
+        if not recognition.get('in_roster', True) or recognition.get('embedding') is None:
+            continue
+        if recognition['confidence'] < FACE_TEMPLATE_MIN_CONFIDENCE:
+            continue
+        roster_entry = course_gallery.students.get(recognition['student_id'])
+        if roster_entry is None:
+            continue
+
+        student = Student.query.get(roster_entry['id'])
+        learned_today = student.face_templates.filter(
+            FaceTemplate.source == 'recognition',
+            FaceTemplate.created_at >= today_start
+        ).first()
+        if learned_today:
+            continue
+
+        add_face_template(student, recognition['embedding'], EMBEDDING_MODEL_TAG, 'recognition',
+                          confidence=float(recognition['confidence']))
+        course_ids.update(course.id for course in student.courses)
+
+    return course_ids
+
+def _record_snapshot_metrics(report, recognized_students, timings):
+    """Add a snapshot's stage timings and face outcomes to the process metrics"""
+    from utils.metrics import ATTENDANCE_FACES, observe_stage_timings
+
+    observe_stage_timings(timings)
+
+    other_section = sum(1 for recognition in recognized_students if not recognition.get('in_roster', True))
+    rejected = len(report.get('rejected_faces', []))
+    outcomes = {
+        'recognized': len(recognized_students) - other_section,
+        'other_section': other_section,
+        'rejected': rejected,
+        'unrecognized': max(0, report.get('faces', 0) - rejected - len(recognized_students))
+    }
+    for outcome, count in outcomes.items():
+        if count:
+            ATTENDANCE_FACES.inc(count, outcome=outcome)
+
+def run_auto_attendance(timetable, course, image_bytes, annotate=False, include_timings=False):
+    """
+    Recognize the students in a snapshot and mark their attendance for today
+
+    Args:
+        timetable: TimeTable of the session
+        course: Course of the session
+        image_bytes: Encoded JPEG/PNG snapshot
+        annotate: Also store a reduced-resolution annotated image
+        include_timings: Add the milliseconds spent in every stage to the payload
+
+    Returns:
+        Response payload with the marked students and off-roster students (with their
+        boxes), the faces skipped for poor quality and, if annotated, the token of the
+        stored annotated image
+    """
+    from app import db
+    from utils.advanced_face_recognition import process_attendance_image
+    from utils.annotated_images import ANNOTATED_IMAGE_MAX_SIDE, save_annotated_image
+    from utils.course_gallery import get_course_gallery, get_campus_index, invalidate_course_galleries
+    from utils.metrics import timed
+
+    report = {'timings': {}}
+    timings = report['timings']
+
+    with timed('total', timings):
+        # Cached gallery for the students of this course/year (rebuilt only when
+        # enrollment, face data or approvals change)
+        with timed('gallery', timings):
+            course_gallery = get_course_gallery(course, timetable.year)
+            campus_index = get_campus_index()
+
+        # Process the image and recognize students
+        recognized_students, annotated_img = process_attendance_image(
+            image_bytes, course_gallery.gallery, fallback_index=campus_index,
+            annotate=annotate, annotation_max_side=ANNOTATED_IMAGE_MAX_SIDE, report=report
+        )
+        annotated_image_token = None
+        if annotate:
+            with timed('annotate', timings):
+                annotated_image_token = save_annotated_image(annotated_img)
+        rejected_faces = report.get('rejected_faces', [])
+
+        payload = {
+            'success': True,
+            'message': 'No students recognized in the image.',
+            'recognized_students': [],
+            'rejected_faces': rejected_faces,
+            'annotated_image_token': annotated_image_token
+        }
+
+        if recognized_students:
+            with timed('db_write', timings):
+                marked_students, other_section_students = mark_students_present(
+                    timetable, course, course_gallery, recognized_students
+                )
+                learned_course_ids = learn_face_templates(course_gallery, recognized_students) \
+                    if FACE_TEMPLATES_FROM_RECOGNITION else set()
+
+                # Commit the database changes
+                db.session.commit()
+
+            if learned_course_ids:
+                invalidate_course_galleries(learned_course_ids)
+
+            payload.update({
+                'message': f'Successfully recognized {len(marked_students)} students',
+                'recognized_students': marked_students,
+                'other_section_students': other_section_students
+            })
+
+    _record_snapshot_metrics(report, recognized_students, timings)
+    if include_timings:
+        payload['timings'] = timings
+    return payload
+
+def run_stream_frame(timetable, course, session, image_bytes):
+    """
+    Track and recognize the students in one frame of a live attendance stream
+
+    A student is marked present once one track has been recognized as them in
+    STREAM_MIN_VOTES frames.
+
+    Returns:
+        Response payload with the frame's tracks and the students marked so far
+    """
+    from app import db
+    from utils.advanced_face_recognition import decode_image, track_students_in_frame
+    from utils.course_gallery import get_course_gallery, get_campus_index
+    from utils.face_tracking import STREAM_MIN_VOTES, save_stream_session
+
+    course_gallery = get_course_gallery(course, timetable.year)
+
+    img = decode_image(image_bytes)
+    if img is None:
+        db.session.rollback()
+        return {'success': False, 'message': 'Could not decode the frame'}
+
+    tracks, embedded_count = track_students_in_frame(
+        img, course_gallery.gallery, session.tracker, fallback_index=get_campus_index()
+    )
+    session.frames += 1
+    session.embedded_faces += embedded_count
+
+    # Tracks whose leading identity has enough votes and has not been marked yet
+    confirmed = []
+    for track in tracks:
+        student_id, votes = track.leading_identity()
+        if votes >= STREAM_MIN_VOTES and student_id not in session.marked and track.identity:
+            confirmed.append({
+                'student_id': student_id,
+                'confidence': track.identity['confidence'],
+                'in_roster': track.identity.get('in_roster', True)
+            })
+
+    newly_marked, other_section_students = mark_students_present(
+        timetable, course, course_gallery, confirmed
+    )
+    for student in newly_marked:
+        session.marked[student['roll_number']] = student
+
+    # The attendance and the stream state are committed together
+    save_stream_session(session)
+    db.session.commit()
+
+    return {
+        'success': True,
+        'stream_id': session.stream_id,
+        'tracks': [track.to_dict() for track in tracks],
+        'newly_marked': newly_marked,
+        'recognized_students': list(session.marked.values()),
+        'other_section_students': other_section_students,
+        'frames': session.frames,
+        'embedded_faces': session.embedded_faces,
+        'message': f'{len(session.marked)} students marked present'
+    }
+
+def _runner_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def _claim_job(job_id):
+    """Move a queued job to running; False if another process claimed it first"""
+    from app import db
+    from models.models import AttendanceJob
+
+    claimed = AttendanceJob.query.filter_by(id=job_id, status='queued').update(
+        {'status': 'running', 'started_at': datetime.utcnow(), 'runner': _runner_id()},
+        synchronize_session=False
+    )
+    db.session.commit()
+    return claimed == 1
+
+def _run_job(app, job_id):
+    """Executor entry point: run one job inside its own application context"""
+    from app import db
+    from models.models import AttendanceJob, TimeTable, Course
+
+    with app.app_context():
+        if not _claim_job(job_id):
+            return
+        job = AttendanceJob.query.get(job_id)
+
+        try:
+            timetable = TimeTable.query.get(job.timetable_id)
+            course = Course.query.get(timetable.course_id)
+            result = run_auto_attendance(timetable, course, job.image, annotate=bool(job.annotate),
+                                         include_timings=bool(job.include_timings))
+
+            job.set_result(result)
+            job.status = 'done'
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error in attendance job {job_id}: {str(e)}")
+            job = AttendanceJob.query.get(job_id)
+            job.error = str(e)
+            job.status = 'failed'
+
+        job.image = None
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+
+def submit_attendance_job(app, timetable, faculty_id, image_bytes, annotate=False, include_timings=False):
+    """
+    Persist a queued job with its snapshot and run recognition for it in the background
+
+    Returns:
+        The new AttendanceJob
+    """
+    from app import db
+    from models.models import AttendanceJob
+
+    job = AttendanceJob(
+        id=uuid.uuid4().hex,
+        status='queued',
+        timetable_id=timetable.id,
+        faculty_id=faculty_id,
+        image=image_bytes,
+        annotate=annotate,
+        include_timings=include_timings
+    )
+    db.session.add(job)
+    db.session.commit()
+
+    _get_executor().submit(_run_job, app, job.id)
+    return job
+
+def resume_attendance_jobs(app):
+    """
+    Queue the stored jobs that no process is running, when a worker starts
+
+    Running jobs whose process on this host has died go back to the queue. Queued
+    jobs are run again unless they are older than ATTENDANCE_JOB_TIMEOUT or have no
+    stored snapshot; those are failed. Every worker may queue the same job, the
+    claim in _run_job lets only one of them run it.
+    """
+    from app import db
+    from models.models import AttendanceJob
+
+    with app.app_context():
+        try:
+            host = f"{socket.gethostname()}:"
+            for job in AttendanceJob.query.filter_by(status='running').filter(
+                    AttendanceJob.runner.like(f"{host}%")).all():
+                if not _process_alive(int(job.runner[len(host):])):
+                    logger.info(f"Requeuing attendance job {job.id} of a process that died")
+                    job.status = 'queued'
+                    job.runner = None
+
+            expired = datetime.utcnow() - timedelta(seconds=ATTENDANCE_JOB_TIMEOUT)
+            job_ids = []
+            for job in AttendanceJob.query.filter_by(status='queued').all():
+                if job.image is None or job.created_at < expired:
+                    job.status = 'failed'
+                    job.error = 'Recognition was interrupted, please capture again'
+                    job.image = None
+                    job.finished_at = datetime.utcnow()
+                else:
+                    job_ids.append(job.id)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Could not resume attendance jobs: {str(e)}")
+            return []
+
+    for job_id in job_ids:
+        _get_executor().submit(_run_job, app, job_id)
+    if job_ids:
+        logger.info(f"Resumed {len(job_ids)} queued attendance jobs")
+    return job_ids
+
+def get_job_status(job):
+    """
+    Return the client-facing status of a job, failing jobs that outlived ATTENDANCE_JOB_TIMEOUT
+    """
+    from app import db
+
+    if job.status in ('queued', 'running'):
+        started = job.started_at or job.created_at
+        if started and datetime.utcnow() - started > timedelta(seconds=ATTENDANCE_JOB_TIMEOUT):
+            job.status = 'failed'
+            job.error = 'Recognition was interrupted, please capture again'
+            job.finished_at = datetime.utcnow()
+            db.session.commit()
+
+    status = {
+        'job_id': job.id,
+        'status': job.status,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None
+    }
+    if job.status == 'done':
+        status['result'] = job.get_result()
+    elif job.status == 'failed':
+        status['error'] = job.error
+    return status
@@ -0,0 +1,103 @@
+from collections import namedtuple
+from sqlalchemy import and_, case, func
+
+# Students below this attendance percentage are flagged in reports
+LOW_ATTENDANCE_THRESHOLD = 75
+
+class StudentAttendance(namedtuple('StudentAttendance',
+                                   'student_id student_name roll_number present_count total_classes')):
+    """One student's attendance in a course, as a plain row instead of ORM objects"""
+
+    __slots__ = ()
+
+    @property
+    def attendance_percentage(self):
+        return (self.present_count / self.total_classes * 100) if self.total_classes > 0 else 0
+
+    @property
+    def low_attendance(self):
+        return self.attendance_percentage < LOW_ATTENDANCE_THRESHOLD
+
+def _present_and_total():
+    """Aggregates of a student's attendance rows: sessions present and sessions held"""
+    from models.models import Attendance
+
+    present = func.coalesce(func.sum(case((Attendance.is_present == True, 1), else_=0)), 0)
+    return present, func.count(Attendance.id)
+
+def course_attendance_summary(course_id, department=None):
+    """
+    Present and total session counts of every student enrolled in a course
+
+    The roster and its attendance are aggregated by the database in a single
+    LEFT JOIN ... GROUP BY query, so students without any record are included with
+    zero counts and no Attendance objects are loaded.
+
+    Args:
+        course_id: Course to report on
+        department: Only include enrolled students of this department, if given
+
+    Returns:
+        List of StudentAttendance rows ordered by student id
+    """
+    from app import db
+    from models.models import Attendance, Student, student_course
+
+    present, total = _present_and_total()
+    query = db.session.query(
+        Student.id, Student.name, Student.roll_number, present, total
+    ).join(
+        student_course, student_course.c.student_id == Student.id
+    ).outerjoin(
+        Attendance, and_(Attendance.student_id == Student.id, Attendance.course_id == course_id)
+    ).filter(
+        student_course.c.course_id == course_id
+    )
+    if department is not None:
+        query = query.filter(Student.department == department)
+
+    rows = query.group_by(Student.id, Student.name, Student.roll_number).order_by(Student.id).all()
+    return [StudentAttendance(*row) for row in rows]
+
+def iter_attendance_summaries(course_id=None, department=None, batch_size=1000):
+    """
+    Stream the attendance of every enrolled student of every course in scope
+
+    Rows are fetched batch_size at a time from a server-side cursor (where the
+    database driver supports one), so a campus-wide export never holds all rows.
+
+    Args:
+        course_id: Only this course, if given
+        department: Only courses of this department, if given
+        batch_size: Rows fetched per round trip
+
+    Yields:
+        (course code, course name, course department, StudentAttendance) per student
+        and course, ordered by course and student
+    """
+    from app import db
+    from models.models import Attendance, Course, Student, student_course
+
+    present, total = _present_and_total()
+    query = db.session.query(
+        Course.id, Course.course_code, Course.name, Course.department,
+        Student.id, Student.name, Student.roll_number, present, total
+    ).select_from(student_course).join(
+        Course, Course.id == student_course.c.course_id
+    ).join(
+        Student, Student.id == student_course.c.student_id
+    ).outerjoin(
+        Attendance, and_(Attendance.student_id == Student.id, Attendance.course_id == Course.id)
+    )
+    if course_id is not None:
+        query = query.filter(Course.id == course_id)
+    if department is not None:
+        query = query.filter(Course.department == department)
+
+    query = query.group_by(
+        Course.id, Course.course_code, Course.name, Course.department,
+        Student.id, Student.name, Student.roll_number
+    ).order_by(Course.id, Student.id)
+
+    for _, course_code, course_name, course_department, *student in query.yield_per(batch_size):
+        yield course_code, course_name, course_department, StudentAttendance(*student)
@@ -0,0 +1,252 @@
+import os
+import logging
+import threading
+import itertools
+import numpy as np
+from utils.embedding_cache import CACHE_DIR_NAME
+from utils.gallery import Gallery
+from utils.ann_index import IVFIndex
+from utils.embedding_store import load_stored_embeddings, load_face_templates, store_embeddings
+from utils.metrics import GALLERY_CACHE_REQUESTS, GALLERY_STUDENTS, GALLERY_TEMPLATES, register_collector
+
+# Configure logger
+logger = logging.getLogger(__name__)
+
+# Directory where face images are stored
+FACE_DATA_DIR = 'face_data'
+
+# Touched on every invalidation so that other worker processes drop their galleries too
+STAMP_PATH = os.path.join(FACE_DATA_DIR, CACHE_DIR_NAME, 'galleries.stamp')
+
+# Search faces that match nobody on the roster against every approved student
+CAMPUS_IDENTIFICATION = os.environ.get('CAMPUS_IDENTIFICATION', 'False').lower() == 'true'
+CAMPUS_INDEX_N_PROBE = int(os.environ.get('CAMPUS_INDEX_N_PROBE', 8))
+
+# How a student's templates are matched: 'max' (best template) or 'centroid' (their mean)
+FACE_GALLERY_MODE = os.environ.get('FACE_GALLERY_MODE', 'max').lower()
+
+# (course_id, year) -> CourseGallery; the campus-wide index is stored under CAMPUS_KEY
+CAMPUS_KEY = 'campus'
+_galleries = {}
+_lock = threading.Lock()
+_stamp = None
+_builds = itertools.count()
+
+class CourseGallery:
+    """
+    Recognition gallery for one (course, year) roster
+
+    Holds the stacked embedding matrix (as a Gallery keyed by roll number) together
+    with the roster's student records, so repeat snapshots of the same class need
+    neither the roster query nor gallery assembly.
+    """
+
+    def __init__(self, course_id, year, gallery, students):
+        self.course_id = course_id
+        self.year = year
+        self.gallery = gallery
+        # roll_number -> {"id", "name", "roll_number"} for every enrolled student
+        self.students = students
+
+    def __len__(self):
+        return len(self.gallery)
+
+def _read_stamp():
+    try:
+        return os.stat(STAMP_PATH).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+def _load_embeddings(roll_numbers):
+    """
+    Return (roll numbers, embedding matrix) for the given approved students
+
+    Embeddings stored on the Student rows for the current model are read with one
+    query. Students without one are embedded from their face image (through the
+    embedding cache) and the result is stored, so later builds need no image work.
+    """
+    from app import db
+    from utils.advanced_face_recognition import EMBEDDING_MODEL_TAG, load_student_embeddings
+
+    ids, matrix = load_stored_embeddings(roll_numbers, EMBEDDING_MODEL_TAG)
+
+    stored = set(ids)
+    missing = [roll_number for roll_number in roll_numbers if roll_number not in stored]
+    if not missing:
+        return ids, matrix
+
+    raw_embeddings = load_student_embeddings(FACE_DATA_DIR, roll_numbers=missing)
+    computed = {roll_number: data["embeddings"] for roll_number, data in raw_embeddings.items()}
+    if computed:
+        try:
+            store_embeddings(computed, EMBEDDING_MODEL_TAG)
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error storing computed embeddings: {str(e)}")
+
+    vectors = list(matrix) + list(computed.values())
+    return ids + list(computed), (np.stack(vectors) if vectors else np.zeros((0, 0), dtype=np.float32))
+
+def _load_templates(roll_numbers):
+    """
+    Return (roll number of every template, template matrix) for the given approved
+    students: each student's own embedding followed by their extra face templates
+    """
+    from utils.advanced_face_recognition import EMBEDDING_MODEL_TAG
+
+    ids, matrix = _load_embeddings(roll_numbers)
+    template_ids, templates = load_face_templates(roll_numbers, EMBEDDING_MODEL_TAG)
+    if not template_ids:
+        return ids, matrix
+    if len(ids) and templates.shape[1] != matrix.shape[1]:
+        logger.error(f"Ignoring face templates of dimension {templates.shape[1]}, expected {matrix.shape[1]}")
+        return ids, matrix
+    return ids + template_ids, (np.concatenate([matrix, templates]) if len(ids) else templates)
+
+def _build_course_gallery(course, year):
+    """Query the roster of a course and assemble its gallery from the stored embeddings"""
+    from models.models import Student, student_course
+
+    students = Student.query.filter_by(
+        department=course.department,
+        year=year
+    ).join(
+        student_course, Student.id == student_course.c.student_id
+    ).filter(
+        student_course.c.course_id == course.id
+    ).all()
+
+    roster = {
+        student.roll_number: {
+            'id': student.id,
+            'name': student.name,
+            'roll_number': student.roll_number
+        }
+        for student in students
+    }
+
+    # Only approved students are recognized
+    template_ids, embeddings = _load_templates(
+        [student.roll_number for student in students if student.is_approved]
+    )
+    gallery = Gallery.from_templates(
+        template_ids,
+        embeddings,
+        student_ids={roll_number: roster[roll_number]['id'] for roll_number in template_ids},
+        mode=FACE_GALLERY_MODE
+    )
+
+    return CourseGallery(course.id, year, gallery, roster)
+
+def _build_campus_index():
+    """
+    Build an ANN index over all approved students, with one centroid of their
+    templates per student to keep the index at one vector each
+    """
+    from models.models import Student
+
+    roll_numbers = [
+        roll_number for (roll_number,) in
+        Student.query.with_entities(Student.roll_number).filter_by(is_approved=True).all()
+    ]
+    template_ids, embeddings = _load_templates(roll_numbers)
+    ids, centroids = Gallery.from_templates(template_ids, embeddings, mode='centroid').centroids()
+    return IVFIndex.build(list(ids), centroids, n_probe=CAMPUS_INDEX_N_PROBE)
+
+def _get_cached(key, build_fn):
+    """Return the cached entry for key, building it on a miss"""
+    global _stamp
+    stamp = _read_stamp()
+
+    with _lock:
+        if stamp != _stamp:
+            # Another process invalidated the galleries
+            _galleries.clear()
+            _stamp = stamp
+        entry = _galleries.get(key)
+
+    kind = CAMPUS_KEY if key == CAMPUS_KEY else 'course'
+    GALLERY_CACHE_REQUESTS.inc(kind=kind, result='miss' if entry is None else 'hit')
+    if entry is not None:
+        return entry
+
+    entry = build_fn()
+    # Lets the inference processes keep their own copy of this build
+    cached = entry if key == CAMPUS_KEY else entry.gallery
+    cached.cache_key = (key, stamp, next(_builds))
+
+    with _lock:
+        if _stamp == stamp:
+            _galleries[key] = entry
+    return entry
+
+def get_course_gallery(course, year):
+    """
+    Return the cached gallery for a course/year roster, building it on a miss
+    """
+    def build():
+        course_gallery = _build_course_gallery(course, year)
+        logger.info(
+            f"Built gallery for course {course.id} year {year} with {len(course_gallery)} students "
+            f"({course_gallery.gallery.template_count} templates)"
+        )
+        return course_gallery
+
+    return _get_cached((course.id, year), build)
+
+def get_campus_index():
+    """
+    Return the cached campus-wide ANN index of approved students, or None if
+    campus identification is disabled
+    """
+    if not CAMPUS_IDENTIFICATION:
+        return None
+
+    def build():
+        index = _build_campus_index()
+        logger.info(f"Built campus face index with {len(index)} students")
+        return index
+
+    return _get_cached(CAMPUS_KEY, build)
+
+@register_collector
+def _collect_gallery_sizes():
+    """Expose the size of every gallery cached in this process"""
+    with _lock:
+        entries = list(_galleries.items())
+
+    GALLERY_STUDENTS.clear()
+    GALLERY_TEMPLATES.clear()
+    for key, entry in entries:
+        if key == CAMPUS_KEY:
+            GALLERY_STUDENTS.set(len(entry), gallery=CAMPUS_KEY)
+            continue
+        name = f"course_{key[0]}_year_{key[1]}"
+        GALLERY_STUDENTS.set(len(entry), gallery=name)
+        GALLERY_TEMPLATES.set(entry.gallery.template_count, gallery=name)
+
+def invalidate_course_galleries(course_ids=None):
+    """
+    Drop cached course galleries after enrollment, face data or approval changes
+
+    Args:
+        course_ids: Courses whose galleries are affected, or None for all of them
+    """
+    global _stamp
+    with _lock:
+        if course_ids is None:
+            _galleries.clear()
+        else:
+            course_ids = set(course_ids)
+            for key in [key for key in _galleries if key == CAMPUS_KEY or key[0] in course_ids]:
+                del _galleries[key]
+
+        # Let the other worker processes know
+        try:
+            os.makedirs(os.path.dirname(STAMP_PATH), exist_ok=True)
+            with open(STAMP_PATH, 'a'):
+                pass
+            os.utime(STAMP_PATH, None)
+            _stamp = _read_stamp()
+        except OSError as e:
+            logger.error(f"Error updating gallery stamp: {str(e)}")
@@ -1,6 +1,7 @@
 import os
 import warnings
 import logging
+import threading
 import numpy as np
 import cv2
 import tensorflow as tf
@@ -15,13 +16,15 @@ os.environ["TF_CPP_MIN_LOG_LEVEL"] = "3"
 # Initialize the face detection model
 face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
 
-# Initialize VGG model (will be loaded on first use)
+# Initialize VGG model (will be loaded on first use or by utils.model_warmup)
 _vgg_model = None
+_vgg_model_lock = threading.Lock()
 
 def get_vgg_model():
     global _vgg_model
-    if _vgg_model is None:
-        _vgg_model = VGG16(weights='imagenet', include_top=False, pooling='avg')
+    with _vgg_model_lock:
+        if _vgg_model is None:
+            _vgg_model = VGG16(weights='imagenet', include_top=False, pooling='avg')
     return _vgg_model
 
 def represent(
@@ -71,17 +74,18 @@ def represent(
                 # If no face detected and enforce_detection is False, use whole image
                 faces = [(0, 0, img.shape[1], img.shape[0])]
         
-        results = []
+        # Extract and preprocess all faces, then embed them in one forward pass
+        crops = []
         for (x, y, w, h) in faces:
-            # Extract and preprocess face
             face = img[y:y+h, x:x+w]
             face = cv2.resize(face, (224, 224))
-            face = preprocess_input(face)
-            
-            # Get embedding using VGG16
-            model = get_vgg_model()
-            embedding = model.predict(np.expand_dims(face, axis=0), verbose=0)[0]
-            
+            crops.append(preprocess_input(face.astype(np.float32)))
+        
+        model = get_vgg_model()
+        embeddings = model.predict_on_batch(np.stack(crops))
+        
+        results = []
+        for (x, y, w, h), embedding in zip(faces, embeddings):
             result = {
                 'embedding': embedding,
                 'facial_area': {'x': x, 'y': y, 'w': w, 'h': h},
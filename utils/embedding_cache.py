@@ -0,0 +1,248 @@
+import os
+import json
+import glob
+import uuid
+import fcntl
+import hashlib
+import logging
+import threading
+import numpy as np
+from contextlib import contextmanager
+from utils.metrics import EMBEDDING_CACHE_FILES
+
+# Configure logger
+logger = logging.getLogger(__name__)
+
+# Sub-directory (inside the face data directory) that holds the cache files
+CACHE_DIR_NAME = '.embedding_cache'
+
+# One cache object per (directory, model) so the index is parsed once per process
+_caches = {}
+_caches_lock = threading.Lock()
+
+def _file_digest(path, chunk_size=1 << 20):
+    """Return the SHA-1 hex digest of a file's content"""
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+class EmbeddingCache:
+    """
+    Persistent on-disk store of face embeddings for the images in a face data directory.
+
+    All vectors live in a single float32 ``.npy`` matrix that is memory-mapped on load,
+    next to a small JSON index mapping each image filename to its row, content hash,
+    mtime and size. An image is only re-embedded when its mtime/size changed *and* its
+    content hash no longer matches, so loading the gallery is a stat per file instead
+    of a forward pass per file.
+    """
+
+    def __init__(self, face_data_dir, model_name="Facenet", cache_dir=None):
+        self.face_data_dir = face_data_dir
+        self.model_name = model_name
+        self.cache_dir = cache_dir or os.path.join(face_data_dir, CACHE_DIR_NAME)
+        self.index_path = os.path.join(self.cache_dir, f"index_{model_name}.json")
+        self.lock_path = os.path.join(self.cache_dir, f"index_{model_name}.lock")
+
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._matrix = None
+        self._index_mtime = None
+
+    def _reset(self):
+        self._entries = {}
+        self._matrix = None
+
+    @contextmanager
+    def _file_lock(self, operation):
+        """
+        Hold an flock on the model's lock file: LOCK_SH to read the index and its
+        matrix, LOCK_EX to replace them, so no process deletes a matrix another one
+        has just swapped in or is about to open
+        """
+        with open(self.lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _load_index(self):
+        """(Re)load the index and memory-map the matrix if another process updated it"""
+        try:
+            index_mtime = os.stat(self.index_path).st_mtime_ns
+        except FileNotFoundError:
+            self._reset()
+            self._index_mtime = None
+            return
+
+        if index_mtime == self._index_mtime:
+            return
+
+        with self._file_lock(fcntl.LOCK_SH):
+            self._read_index(index_mtime)
+
+    def _read_index(self, index_mtime):
+        try:
+            with open(self.index_path, 'r') as f:
+                index = json.load(f)
+
+            if index.get('model') != self.model_name:
+                raise ValueError(f"index was built for model {index.get('model')}")
+
+            matrix = np.load(os.path.join(self.cache_dir, index['matrix']), mmap_mode='r')
+            entries = index.get('entries', {})
+
+            if any(entry['row'] >= len(matrix) for entry in entries.values()):
+                raise ValueError("index refers to rows outside the embedding matrix")
+
+            self._entries = entries
+            self._matrix = matrix
+        except Exception as e:
+            # A corrupt or half-written cache is simply rebuilt
+            logger.warning(f"Discarding embedding cache {self.index_path}: {str(e)}")
+            self._reset()
+
+        self._index_mtime = index_mtime
+
+    def _write(self, entries, vectors):
+        """
+        Persist the given entries. ``vectors`` maps filename -> embedding and must
+        contain a vector for every entry.
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with self._file_lock(fcntl.LOCK_EX):
+            self._write_locked(entries, vectors)
+
+    def _write_locked(self, entries, vectors):
+        if not entries:
+            if os.path.exists(self.index_path):
+                os.remove(self.index_path)
+            self._reset()
+            self._index_mtime = None
+            return
+
+        filenames = sorted(entries)
+        matrix = np.asarray([vectors[fn] for fn in filenames], dtype=np.float32)
+        for row, fn in enumerate(filenames):
+            entries[fn]['row'] = row
+
+        # Write the matrix under a fresh name, then atomically swap the index to point
+        # at it. Readers holding a memory map of the previous matrix keep a valid view,
+        # and the exclusive lock keeps any other process from opening it meanwhile.
+        matrix_name = f"embeddings_{self.model_name}_{uuid.uuid4().hex[:12]}.npy"
+        matrix_path = os.path.join(self.cache_dir, matrix_name)
+        np.save(matrix_path, matrix)
+
+        tmp_index_path = f"{self.index_path}.{uuid.uuid4().hex[:8]}.tmp"
+        with open(tmp_index_path, 'w') as f:
+            json.dump({
+                'model': self.model_name,
+                'dim': int(matrix.shape[1]),
+                'matrix': matrix_name,
+                'entries': entries
+            }, f)
+        os.replace(tmp_index_path, self.index_path)
+
+        # Remove matrices no longer referenced by the index (writers are serialized,
+        # so every other matrix belongs to an index that has been replaced)
+        for old_path in glob.glob(os.path.join(self.cache_dir, f"embeddings_{self.model_name}_*.npy")):
+            if os.path.basename(old_path) != matrix_name:
+                try:
+                    os.remove(old_path)
+                except OSError:
+                    pass
+
+        self._entries = entries
+        self._matrix = np.load(matrix_path, mmap_mode='r')
+        self._index_mtime = os.stat(self.index_path).st_mtime_ns
+
+    def get_embeddings(self, filenames, embed_fn):
+        """
+        Return embeddings for the given image filenames, embedding only new or changed files
+
+        Args:
+            filenames: Image filenames relative to the face data directory
+            embed_fn: Callable taking an image path and returning an embedding (or None)
+
+        Returns:
+            Dictionary of filename -> float32 embedding vector (files that could not be
+            embedded are left out)
+        """
+        with self._lock:
+            self._load_index()
+
+            requested = set(filenames)
+            entries = {}
+            changed = False
+            stale = []
+
+            for filename in filenames:
+                path = os.path.join(self.face_data_dir, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+
+                entry = self._entries.get(filename)
+                if entry and entry['mtime_ns'] == stat.st_mtime_ns and entry['size'] == stat.st_size:
+                    entries[filename] = dict(entry)
+                    continue
+
+                # The file was touched; only re-embed if its content actually changed
+                digest = _file_digest(path)
+                if entry and entry['sha1'] == digest:
+                    entries[filename] = dict(entry, mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+                    changed = True
+                    continue
+
+                stale.append((filename, path, digest, stat))
+
+            vectors = {fn: self._matrix[entry['row']] for fn, entry in entries.items()}
+
+            for filename, path, digest, stat in stale:
+                embedding = embed_fn(path)
+                if embedding is None:
+                    continue
+                vectors[filename] = np.asarray(embedding, dtype=np.float32)
+                entries[filename] = {
+                    'sha1': digest,
+                    'mtime_ns': stat.st_mtime_ns,
+                    'size': stat.st_size
+                }
+                changed = True
+
+            # Entries for files outside this request keep their rows so that other callers
+            # (e.g. a different roster) still hit the cache; deleted files are dropped
+            for filename, entry in self._entries.items():
+                if filename in entries:
+                    continue
+                if filename not in requested and os.path.exists(os.path.join(self.face_data_dir, filename)):
+                    entries[filename] = dict(entry)
+                    vectors[filename] = self._matrix[entry['row']]
+                else:
+                    changed = True
+
+            if changed:
+                try:
+                    self._write(entries, vectors)
+                except Exception as e:
+                    logger.error(f"Error writing embedding cache: {str(e)}")
+
+            if stale:
+                logger.info(f"Embedded {len(stale)} new or changed face images ({self.model_name})")
+            EMBEDDING_CACHE_FILES.inc(len(filenames) - len(stale), result='hit')
+            EMBEDDING_CACHE_FILES.inc(len(stale), result='miss')
+
+            return {fn: vectors[fn] for fn in filenames if fn in vectors}
+
+def get_embedding_cache(face_data_dir, model_name="Facenet"):
+    """Return the process-wide embedding cache for a face data directory and model"""
+    cache_dir = os.environ.get('FACE_EMBEDDING_CACHE_DIR')
+    key = (os.path.abspath(face_data_dir), model_name, cache_dir)
+    with _caches_lock:
+        if key not in _caches:
+            _caches[key] = EmbeddingCache(face_data_dir, model_name=model_name, cache_dir=cache_dir)
+        return _caches[key]
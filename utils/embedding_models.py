@@ -0,0 +1,45 @@
+import os
+
+class EmbeddingModelSpec:
+    """
+    A face embedding model as used for recognition
+
+    The version is bumped whenever anything that changes the vectors (weights,
+    detector, alignment, preprocessing) changes, so stored embeddings of an older
+    version are never compared with new ones.
+    """
+
+    def __init__(self, name, version, dim, input_size, deepface_name=None):
+        self.name = name
+        self.version = version
+        self.dim = dim
+        self.input_size = input_size
+        self.deepface_name = deepface_name or name
+
+    @property
+    def tag(self):
+        """Identifier stored with every embedding, e.g. "Facenet@2" """
+        return f"{self.name}@{self.version}"
+
+    def __repr__(self):
+        return f"EmbeddingModelSpec({self.tag}, dim={self.dim})"
+
+# Every model recognition can be configured to use, by tag
+EMBEDDING_MODELS = {
+    spec.tag: spec for spec in (
+        # Version 2: reference images are aligned and preprocessed like snapshot faces
+        EmbeddingModelSpec('Facenet', 2, 128, (160, 160)),
+        EmbeddingModelSpec('Facenet512', 2, 512, (160, 160)),
+        EmbeddingModelSpec('ArcFace', 2, 512, (112, 112)),
+    )
+}
+
+# The one model recognition, registration and the stored embeddings use
+CANONICAL_EMBEDDING_MODEL = os.environ.get('FACE_EMBEDDING_MODEL', 'Facenet@2')
+
+def get_embedding_model_spec(tag=None):
+    """Return the spec for tag (the canonical model by default)"""
+    tag = tag or CANONICAL_EMBEDDING_MODEL
+    if tag not in EMBEDDING_MODELS:
+        raise ValueError(f"Unknown embedding model {tag}; expected one of {', '.join(EMBEDDING_MODELS)}")
+    return EMBEDDING_MODELS[tag]
@@ -0,0 +1,165 @@
+import os
+import logging
+import numpy as np
+
+# Configure logger
+logger = logging.getLogger(__name__)
+
+# Precision of embeddings stored in Student.face_embedding (float32 or float16)
+EMBEDDING_DTYPE = np.dtype(os.environ.get('FACE_EMBEDDING_DTYPE', 'float32'))
+
+# Stored dtype, recognised from the blob length per dimension
+_DTYPES_BY_ITEMSIZE = {4: np.dtype('<f4'), 2: np.dtype('<f2')}
+
+def encode_embedding(embedding, dtype=None):
+    """Serialize an embedding as little-endian float32/float16 bytes"""
+    dtype = np.dtype(dtype or EMBEDDING_DTYPE).newbyteorder('<')
+    return np.ascontiguousarray(np.asarray(embedding).ravel(), dtype=dtype).tobytes()
+
+def decode_embedding(blob, dim):
+    """Deserialize a stored embedding into a float32 vector"""
+    dtype = _DTYPES_BY_ITEMSIZE.get(len(blob) // dim) if dim else None
+    if dtype is None or len(blob) != dim * dtype.itemsize:
+        raise ValueError(f"Embedding blob of {len(blob)} bytes does not match dimension {dim}")
+    return np.frombuffer(blob, dtype=dtype).astype(np.float32)
+
+# Reference embeddings kept per student: the Student row's own plus extra FaceTemplate rows
+FACE_TEMPLATES_PER_STUDENT = int(os.environ.get('FACE_TEMPLATES_PER_STUDENT', 5))
+
+def _empty():
+    return [], np.zeros((0, 0), dtype=np.float32)
+
+def _stack_rows(rows):
+    """
+    Decode (key, blob, dim) rows into (keys, float32 matrix)
+
+    Rows normally share one dimension and dtype, so they are all decoded from a
+    single joined buffer.
+    """
+    rows = [row for row in rows if row[2]]
+    if not rows:
+        return _empty()
+
+    dim = rows[0][2]
+    itemsize = len(rows[0][1]) // dim
+    if all(row[2] == dim and len(row[1]) == dim * itemsize for row in rows) and itemsize in _DTYPES_BY_ITEMSIZE:
+        matrix = np.frombuffer(
+            b''.join(row[1] for row in rows), dtype=_DTYPES_BY_ITEMSIZE[itemsize]
+        ).reshape(len(rows), dim).astype(np.float32, copy=False)
+        return [row[0] for row in rows], matrix
+
+    # Mixed layouts (e.g. while switching precision): decode row by row
+    keys = []
+    vectors = []
+    for key, blob, row_dim in rows:
+        try:
+            vector = decode_embedding(blob, row_dim)
+        except ValueError as e:
+            logger.error(f"Skipping stored embedding of {key}: {str(e)}")
+            continue
+        if vectors and len(vector) != len(vectors[0]):
+            logger.error(f"Skipping stored embedding of {key}: dimension {len(vector)}")
+            continue
+        keys.append(key)
+        vectors.append(vector)
+    return keys, (np.stack(vectors) if vectors else np.zeros((0, 0), dtype=np.float32))
+
+def load_stored_embeddings(roll_numbers, model_tag, approved_only=True):
+    """
+    Read the stored embeddings of a roster with one query
+
+    Only embeddings produced by model_tag are returned; students without one are
+    simply left out.
+
+    Returns:
+        (roll numbers, float32 matrix with one row per returned roll number)
+    """
+    from models.models import Student
+
+    roll_numbers = list(roll_numbers)
+    if not roll_numbers:
+        return _empty()
+
+    query = Student.query.with_entities(
+        Student.roll_number, Student.face_embedding, Student.face_embedding_dim
+    ).filter(
+        Student.roll_number.in_(roll_numbers),
+        Student.face_embedding_model == model_tag,
+        Student.face_embedding != None
+    )
+    if approved_only:
+        query = query.filter(Student.is_approved == True)
+    return _stack_rows(query.all())
+
+def load_face_templates(roll_numbers, model_tag, approved_only=True):
+    """
+    Read the extra FaceTemplate embeddings of a roster with one query
+
+    Returns:
+        (roll number of every template, float32 matrix with one row per template)
+    """
+    from models.models import Student, FaceTemplate
+
+    roll_numbers = list(roll_numbers)
+    if not roll_numbers:
+        return _empty()
+
+    query = FaceTemplate.query.join(
+        Student, Student.id == FaceTemplate.student_id
+    ).with_entities(
+        Student.roll_number, FaceTemplate.embedding, FaceTemplate.dim
+    ).filter(
+        Student.roll_number.in_(roll_numbers),
+        FaceTemplate.model_tag == model_tag
+    )
+    if approved_only:
+        query = query.filter(Student.is_approved == True)
+    return _stack_rows(query.order_by(FaceTemplate.student_id, FaceTemplate.id).all())
+
+def add_face_template(student, embedding, model_tag, source, confidence=None):
+    """
+    Keep an extra reference embedding for a student (the caller commits)
+
+    The oldest templates are dropped so that a student never has more than
+    FACE_TEMPLATES_PER_STUDENT embeddings of a model, counting the Student row's own.
+    """
+    from app import db
+    from models.models import FaceTemplate
+
+    embedding = np.asarray(embedding).ravel()
+    keep = max(0, FACE_TEMPLATES_PER_STUDENT - 1)
+
+    existing = student.face_templates.filter_by(model_tag=model_tag).order_by(FaceTemplate.id.desc()).all()
+    for template in existing[max(0, keep - 1):]:
+        db.session.delete(template)
+    if keep == 0:
+        return None
+
+    template = FaceTemplate(
+        student_id=student.id,
+        embedding=encode_embedding(embedding),
+        model_tag=model_tag,
+        dim=len(embedding),
+        source=source,
+        confidence=confidence
+    )
+    db.session.add(template)
+    return template
+
+def store_embeddings(embeddings, model_tag):
+    """
+    Persist embeddings computed elsewhere (roll number -> vector) on the Student rows
+
+    The caller's session is committed.
+    """
+    from app import db
+    from models.models import Student
+
+    if not embeddings:
+        return 0
+
+    students = Student.query.filter(Student.roll_number.in_(list(embeddings))).all()
+    for student in students:
+        student.set_face_encoding(embeddings[student.roll_number], model_tag)
+    db.session.commit()
+    return len(students)
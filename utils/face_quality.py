@@ -0,0 +1,119 @@
+import os
+import cv2
+import numpy as np
+
+# Faces failing any of these checks are not aligned or embedded
+FACE_MIN_SIZE = int(os.environ.get('FACE_MIN_SIZE', 50))  # Shorter box side, full-resolution pixels
+FACE_MIN_SHARPNESS = float(os.environ.get('FACE_MIN_SHARPNESS', 40))  # Laplacian variance
+FACE_MAX_YAW = float(os.environ.get('FACE_MAX_YAW', 45))  # Degrees
+FACE_MAX_PITCH = float(os.environ.get('FACE_MAX_PITCH', 35))  # Degrees
+FACE_MIN_ASPECT = float(os.environ.get('FACE_MIN_ASPECT', 0.5))  # Box width / height
+FACE_MAX_ASPECT = float(os.environ.get('FACE_MAX_ASPECT', 2.0))
+
+# Sharpness is measured on grayscale crops of this size, so it does not depend on face size
+_SHARPNESS_SIZE = 64
+
+# Nose-tip height between the eyes and the mouth of a level face, and how much it moves
+# per unit of sin(pitch); rough constants for the MediaPipe keypoints
+_NEUTRAL_NOSE_RATIO = 0.53
+_NOSE_PITCH_GAIN = 0.6
+
+def sharpness_scores(img, faces):
+    """
+    Variance of the Laplacian of every face crop, as a blur measure (higher is sharper)
+
+    The crops are resized to a common size and stacked into one image, so the
+    Laplacian of all faces is computed by a single cv2 call.
+    """
+    if not len(faces):
+        return np.zeros(0, dtype=np.float32)
+
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+    size = _SHARPNESS_SIZE
+    mosaic = np.zeros((len(faces) * size, size), dtype=np.uint8)
+    for i, (x, y, w, h) in enumerate(faces):
+        crop = gray[max(0, y):y + h, max(0, x):x + w]
+        if crop.size:
+            mosaic[i * size:(i + 1) * size] = cv2.resize(crop, (size, size), interpolation=cv2.INTER_AREA)
+
+    laplacian = cv2.Laplacian(mosaic, cv2.CV_32F).reshape(len(faces), size, size)
+    # Leave out the border rows and columns, which see the neighbouring crops
+    return laplacian[:, 1:-1, 1:-1].reshape(len(faces), -1).var(axis=1)
+
+def pose_angles(keypoints):
+    """
+    Estimate yaw and pitch (degrees) of every face from its six MediaPipe keypoints
+
+    Yaw comes from how far the nose tip sits between the two ears, pitch from its
+    height between the eyes and the mouth, both measured along the eye line so that
+    head roll does not matter. Faces without keypoints get NaN.
+    """
+    yaw = np.full(len(keypoints), np.nan, dtype=np.float32)
+    pitch = np.full(len(keypoints), np.nan, dtype=np.float32)
+
+    known = [i for i, points in enumerate(keypoints) if points is not None and len(points) >= 6]
+    if not known:
+        return yaw, pitch
+
+    points = np.stack([keypoints[i][:6] for i in known]).astype(np.float64)
+    left_eye, right_eye, nose, mouth, left_ear, right_ear = (points[:, j] for j in range(6))
+
+    # Unit vector along the eyes and the one perpendicular to it (pointing down)
+    across = right_eye - left_eye
+    across /= np.maximum(np.linalg.norm(across, axis=1, keepdims=True), 1e-9)
+    down = np.stack([-across[:, 1], across[:, 0]], axis=1)
+
+    to_left = np.einsum('ij,ij->i', nose - left_ear, across)
+    to_right = np.einsum('ij,ij->i', right_ear - nose, across)
+    yaw_ratio = (to_left - to_right) / np.maximum(np.abs(to_left) + np.abs(to_right), 1e-9)
+
+    eyes = (left_eye + right_eye) / 2
+    nose_drop = np.einsum('ij,ij->i', nose - eyes, down)
+    mouth_drop = np.einsum('ij,ij->i', mouth - eyes, down)
+    nose_ratio = nose_drop / np.where(np.abs(mouth_drop) > 1e-9, mouth_drop, 1e-9)
+
+    yaw[known] = np.degrees(np.arcsin(np.clip(yaw_ratio, -1, 1)))
+    pitch[known] = np.degrees(np.arcsin(np.clip((nose_ratio - _NEUTRAL_NOSE_RATIO) / _NOSE_PITCH_GAIN, -1, 1)))
+    return yaw, pitch
+
+def assess_faces(img, faces, keypoints=None, scale=1):
+    """
+    Score every detected face and decide whether it is worth embedding
+
+    Args:
+        img: Image the boxes refer to
+        faces: (x, y, w, h) boxes in img coordinates
+        keypoints: Detector keypoints per box (None where unknown)
+        scale: Factor from img to full-resolution pixels, for the size check
+
+    Returns:
+        List with, for every face, {"passed", "reasons", "sharpness", "yaw", "pitch"};
+        reasons lists the failed checks (size, aspect, blur, pose)
+    """
+    if not len(faces):
+        return []
+
+    boxes = np.asarray(faces, dtype=np.float64).reshape(-1, 4)
+    sharpness = sharpness_scores(img, faces)
+    yaw, pitch = pose_angles(keypoints if keypoints is not None else [None] * len(faces))
+    aspect = boxes[:, 2] / np.maximum(boxes[:, 3], 1)
+
+    checks = {
+        'size': np.minimum(boxes[:, 2], boxes[:, 3]) * scale < FACE_MIN_SIZE,
+        'aspect': (aspect < FACE_MIN_ASPECT) | (aspect > FACE_MAX_ASPECT),
+        'blur': sharpness < FACE_MIN_SHARPNESS,
+        # Unknown angles (NaN) compare False, so faces without keypoints are not rejected for pose
+        'pose': (np.abs(yaw) > FACE_MAX_YAW) | (np.abs(pitch) > FACE_MAX_PITCH),
+    }
+
+    quality = []
+    for i in range(len(boxes)):
+        reasons = [name for name, failed in checks.items() if failed[i]]
+        quality.append({
+            'passed': not reasons,
+            'reasons': reasons,
+            'sharpness': round(float(sharpness[i]), 1),
+            'yaw': None if np.isnan(yaw[i]) else round(float(yaw[i]), 1),
+            'pitch': None if np.isnan(pitch[i]) else round(float(pitch[i]), 1)
+        })
+    return quality
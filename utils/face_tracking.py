@@ -0,0 +1,304 @@
+import os
+import json
+import uuid
+import base64
+import logging
+import numpy as np
+from datetime import datetime, timedelta
+from scipy.optimize import linear_sum_assignment
+
+# Configure logger
+logger = logging.getLogger(__name__)
+
+# Frames a track must be recognized as the same student before attendance is marked
+STREAM_MIN_VOTES = int(os.environ.get('STREAM_MIN_VOTES', 3))
+
+# A track is re-embedded when its face grows by this factor over the embedded one
+STREAM_REEMBED_GAIN = float(os.environ.get('STREAM_REEMBED_GAIN', 1.5))
+
+# Stream sessions idle for this many seconds are dropped
+STREAM_SESSION_TTL = int(os.environ.get('STREAM_SESSION_TTL', 300))
+
+def box_iou(boxes_a, boxes_b):
+    """
+    Pairwise IoU of two sets of (x, y, w, h) boxes
+    Returns a (len(boxes_a) x len(boxes_b)) matrix
+    """
+    a = np.asarray(boxes_a, dtype=np.float32).reshape(-1, 4)
+    b = np.asarray(boxes_b, dtype=np.float32).reshape(-1, 4)
+
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 0] + a[:, None, 2], b[None, :, 0] + b[None, :, 2])
+    y2 = np.minimum(a[:, None, 1] + a[:, None, 3], b[None, :, 1] + b[None, :, 3])
+
+    intersection = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    union = (a[:, None, 2] * a[:, None, 3]) + (b[None, :, 2] * b[None, :, 3]) - intersection
+    return np.where(union > 0, intersection / np.maximum(union, 1e-6), 0.0)
+
+def _centroid_affinity(boxes_a, boxes_b):
+    """
+    Similarity in [0, 1] between box centres, relative to the size of the first box
+    Keeps fast-moving faces (no overlap between frames) on their track
+    """
+    a = np.asarray(boxes_a, dtype=np.float32).reshape(-1, 4)
+    b = np.asarray(boxes_b, dtype=np.float32).reshape(-1, 4)
+
+    centres_a = a[:, :2] + a[:, 2:] / 2
+    centres_b = b[:, :2] + b[:, 2:] / 2
+    distance = np.linalg.norm(centres_a[:, None, :] - centres_b[None, :, :], axis=2)
+    scale = np.maximum(a[:, 2:].max(axis=1), 1)[:, None]
+    return np.clip(1 - distance / scale, 0, 1)
+
+class Track:
+    """A face followed across frames, with the identity votes it has collected"""
+
+    def __init__(self, track_id, bbox):
+        self.track_id = track_id
+        self.bbox = tuple(int(v) for v in bbox)
+        self.hits = 1
+        self.misses = 0
+
+        # Latest embedding of this face and the size of the face it came from
+        self.embedding = None
+        self.embedded_quality = 0.0
+
+        # Identity from the latest embedding: {"student_id", "confidence", "in_roster"} or None
+        self.identity = None
+        # student_id -> number of frames this track was seen as that student
+        self.votes = {}
+
+    @property
+    def quality(self):
+        return float(self.bbox[2] * self.bbox[3])
+
+    def needs_embedding(self, reembed_gain=None):
+        """A track is embedded once, and again only when its face got markedly larger"""
+        if self.embedding is None:
+            return True
+        return self.quality > self.embedded_quality * (reembed_gain or STREAM_REEMBED_GAIN)
+
+    def set_embedding(self, embedding, identity):
+        self.embedding = embedding
+        self.embedded_quality = self.quality
+        self.identity = identity
+
+    def vote(self):
+        """Record one frame of evidence for the current identity"""
+        if self.identity is not None:
+            student_id = self.identity['student_id']
+            self.votes[student_id] = self.votes.get(student_id, 0) + 1
+
+    def leading_identity(self):
+        """Return (student_id, votes) of the most voted student, or (None, 0)"""
+        if not self.votes:
+            return None, 0
+        student_id = max(self.votes, key=self.votes.get)
+        return student_id, self.votes[student_id]
+
+    def get_state(self):
+        """JSON-serializable state, restored by Track.from_state"""
+        return {
+            'track_id': self.track_id,
+            'bbox': self.bbox,
+            'hits': self.hits,
+            'misses': self.misses,
+            'embedding': (base64.b64encode(np.asarray(self.embedding, dtype=np.float32).tobytes()).decode()
+                          if self.embedding is not None else None),
+            'embedded_quality': self.embedded_quality,
+            'identity': self.identity,
+            'votes': self.votes
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        track = cls(state['track_id'], state['bbox'])
+        track.hits = state['hits']
+        track.misses = state['misses']
+        if state['embedding'] is not None:
+            track.embedding = np.frombuffer(base64.b64decode(state['embedding']), dtype=np.float32)
+        track.embedded_quality = state['embedded_quality']
+        track.identity = state['identity']
+        track.votes = state['votes']
+        return track
+
+    def to_dict(self):
+        student_id, votes = self.leading_identity()
+        return {
+            'track_id': self.track_id,
+            'bbox': self.bbox,
+            'student_id': student_id,
+            'votes': votes,
+            'confidence': self.identity['confidence'] if self.identity else None,
+            'in_roster': self.identity.get('in_roster', True) if self.identity else None
+        }
+
+class FaceTracker:
+    """
+    Associates per-frame face boxes with tracks using IoU, falling back to centroid
+    distance, with a one-to-one assignment per frame
+    """
+
+    def __init__(self, iou_threshold=0.3, centroid_threshold=0.5, max_misses=3):
+        self.iou_threshold = iou_threshold
+        self.centroid_threshold = centroid_threshold
+        self.max_misses = max_misses
+        self.tracks = []
+        self._next_id = 1
+
+    def get_state(self):
+        """JSON-serializable state, restored by FaceTracker.from_state"""
+        return {
+            'iou_threshold': self.iou_threshold,
+            'centroid_threshold': self.centroid_threshold,
+            'max_misses': self.max_misses,
+            'next_id': self._next_id,
+            'tracks': [track.get_state() for track in self.tracks]
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        tracker = cls(state['iou_threshold'], state['centroid_threshold'], state['max_misses'])
+        tracker._next_id = state['next_id']
+        tracker.tracks = [Track.from_state(track) for track in state['tracks']]
+        return tracker
+
+    def update(self, boxes):
+        """
+        Advance the tracker by one frame
+
+        Returns:
+            The tracks observed in this frame, in the order of boxes
+        """
+        boxes = [tuple(int(v) for v in box) for box in boxes]
+        observed = [None] * len(boxes)
+
+        if self.tracks and boxes:
+            track_boxes = [track.bbox for track in self.tracks]
+            iou = box_iou(track_boxes, boxes)
+            affinity = np.where(iou >= self.iou_threshold, 1 + iou, _centroid_affinity(track_boxes, boxes))
+            affinity[(iou < self.iou_threshold) & (affinity < self.centroid_threshold)] = 0
+
+            rows, cols = linear_sum_assignment(affinity, maximize=True)
+            for row, col in zip(rows, cols):
+                if affinity[row, col] > 0:
+                    track = self.tracks[row]
+                    track.bbox = boxes[col]
+                    track.hits += 1
+                    track.misses = 0
+                    observed[col] = track
+
+        seen = {id(track) for track in observed if track is not None}
+        for track in self.tracks:
+            if id(track) not in seen:
+                track.misses += 1
+
+        # Lost tracks are dropped; a face that reappears starts a new track and is embedded again
+        self.tracks = [track for track in self.tracks if track.misses <= self.max_misses]
+
+        for i, box in enumerate(boxes):
+            if observed[i] is None:
+                observed[i] = Track(self._next_id, box)
+                self._next_id += 1
+                self.tracks.append(observed[i])
+
+        return observed
+
+class StreamSessionError(Exception):
+    """A frame referred to a stream that cannot be continued; the client starts a new one"""
+
+    def __init__(self, message, status):
+        super().__init__(message)
+        self.status = status
+
+class StreamSession:
+    """
+    Tracking state and marked students of one live attendance stream
+
+    The state is stored in the attendance_stream table after every frame, so the
+    frames of a stream can be handled by any worker process.
+    """
+
+    def __init__(self, timetable_id, faculty_id, stream_id=None, tracker=None, marked=None, frames=0,
+                 embedded_faces=0):
+        self.stream_id = stream_id or uuid.uuid4().hex
+        self.timetable_id = timetable_id
+        self.faculty_id = faculty_id
+        self.tracker = tracker or FaceTracker()
+        # roll_number -> marked student payload
+        self.marked = marked or {}
+        self.frames = frames
+        self.embedded_faces = embedded_faces
+
+    def get_state(self):
+        return {
+            'tracker': self.tracker.get_state(),
+            'marked': self.marked,
+            'frames': self.frames,
+            'embedded_faces': self.embedded_faces
+        }
+
+    @classmethod
+    def from_record(cls, record):
+        state = json.loads(record.state)
+        return cls(
+            record.timetable_id, record.faculty_id, stream_id=record.id,
+            tracker=FaceTracker.from_state(state['tracker']), marked=state['marked'],
+            frames=state['frames'], embedded_faces=state['embedded_faces']
+        )
+
+def _expire_sessions(now):
+    from models.models import AttendanceStream
+    AttendanceStream.query.filter(
+        AttendanceStream.last_seen < now - timedelta(seconds=STREAM_SESSION_TTL)
+    ).delete(synchronize_session=False)
+
+def get_stream_session(stream_id, timetable_id, faculty_id):
+    """
+    Return the session for stream_id, or start a new one if stream_id is empty
+
+    The stream's row stays locked (on databases with row locks) until the caller
+    commits, so that frames of one stream are processed one at a time.
+
+    Raises:
+        StreamSessionError: 404 if the stream is unknown or expired, 409 if it
+        belongs to another timetable or faculty
+    """
+    from models.models import AttendanceStream
+
+    if not stream_id:
+        session = StreamSession(timetable_id, faculty_id)
+        logger.info(f"Started attendance stream {session.stream_id} for timetable {timetable_id}")
+        return session
+
+    record = AttendanceStream.query.filter_by(id=stream_id).with_for_update().first()
+    if record is None or datetime.utcnow() - record.last_seen > timedelta(seconds=STREAM_SESSION_TTL):
+        raise StreamSessionError('Unknown or expired stream, start a new one', 404)
+    if record.timetable_id != timetable_id or record.faculty_id != faculty_id:
+        raise StreamSessionError('The stream belongs to another session, start a new one', 409)
+    return StreamSession.from_record(record)
+
+def save_stream_session(session):
+    """Store the state of a session after a frame; the caller commits"""
+    from app import db
+    from models.models import AttendanceStream
+
+    now = datetime.utcnow()
+    record = db.session.get(AttendanceStream, session.stream_id)
+    if record is None:
+        _expire_sessions(now)
+        record = AttendanceStream(
+            id=session.stream_id, timetable_id=session.timetable_id, faculty_id=session.faculty_id
+        )
+        db.session.add(record)
+    record.state = json.dumps(session.get_state())
+    record.last_seen = now
+
+def end_stream_session(stream_id, faculty_id):
+    """Drop the stored state of a stream of this faculty"""
+    from app import db
+    from models.models import AttendanceStream
+
+    if stream_id:
+        AttendanceStream.query.filter_by(id=stream_id, faculty_id=faculty_id).delete()
+        db.session.commit()
@@ -0,0 +1,175 @@
+import logging
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+
+# Configure logger
+logger = logging.getLogger(__name__)
+
+def l2_normalize(embeddings):
+    """
+    L2-normalize a vector or the rows of a matrix as float32
+    Zero rows are left as zeros
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=-1, keepdims=True)
+    return embeddings / np.maximum(norms, 1e-12)
+
+def assign_matches(scores, threshold):
+    """
+    Globally assign faces to gallery identities, at most one face per identity
+
+    Args:
+        scores: (faces x identities) cosine similarity matrix
+        threshold: Minimum similarity for a face to be matched
+
+    Returns:
+        List with, for every face, the matched column index and score, or None
+    """
+    scores = np.asarray(scores, dtype=np.float32)
+    assignments = [None] * scores.shape[0]
+
+    if scores.size == 0:
+        return assignments
+
+    # Pairs below the threshold contribute nothing, so the Hungarian solver only
+    # trades off between admissible matches
+    weights = np.where(scores > threshold, scores, 0.0)
+    rows, cols = linear_sum_assignment(weights, maximize=True)
+
+    for row, col in zip(rows, cols):
+        if scores[row, col] > threshold:
+            assignments[row] = (int(col), float(scores[row, col]))
+
+    return assignments
+
+class Gallery:
+    """
+    Face gallery held as one L2-normalized float32 matrix of templates
+
+    A student may have several templates (enrollment capture, earlier approved
+    updates, confident recognitions). Templates are stored grouped by student:
+    row i of ``embeddings`` belongs to ``ids[owners[i]]`` (the roll number used as
+    student ID by the recognition pipeline), so a whole frame is scored with one
+    matrix product followed by a segmented max per student.
+    ``student_ids`` optionally carries the database primary keys of ``ids``.
+    """
+
+    # Identifies a cached, never modified gallery to the inference pool processes
+    cache_key = None
+
+    def __init__(self, ids, embeddings, student_ids=None, owners=None):
+        self.ids = np.asarray(ids, dtype=object)
+        self.student_ids = np.asarray(student_ids, dtype=np.int64) if student_ids is not None else None
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if embeddings.size == 0:
+            embeddings = embeddings.reshape(0, 0)
+
+        if owners is None:
+            # One template per student
+            self.owners = np.arange(len(self.ids))
+            self.segment_starts = None
+        else:
+            owners = np.asarray(owners, dtype=np.int64)
+            order = np.argsort(owners, kind='stable')
+            owners = owners[order]
+            embeddings = embeddings[order]
+            if len(self.ids) and not np.array_equal(np.unique(owners), np.arange(len(self.ids))):
+                raise ValueError("Every gallery identity needs at least one template")
+            self.owners = owners
+            self.segment_starts = np.flatnonzero(np.r_[True, owners[1:] != owners[:-1]]) if len(owners) else None
+            if self.segment_starts is not None and len(self.segment_starts) == len(owners):
+                self.segment_starts = None
+
+        self.embeddings = l2_normalize(embeddings)
+
+    @classmethod
+    def from_templates(cls, template_ids, embeddings, student_ids=None, mode='max'):
+        """
+        Build a gallery from template rows whose ids may repeat
+
+        Args:
+            template_ids: Identity of every template row
+            embeddings: (templates x dim) template matrix
+            student_ids: Optional database key per identity, as a dictionary id -> key
+            mode: 'max' scores a face by its best template; 'centroid' keeps one
+                  averaged template per identity (less memory, slightly less robust)
+        """
+        ids = list(dict.fromkeys(template_ids))
+        position = {identity: i for i, identity in enumerate(ids)}
+        owners = np.fromiter((position[identity] for identity in template_ids), dtype=np.int64,
+                             count=len(template_ids))
+        keys = [student_ids[identity] for identity in ids] if student_ids is not None else None
+
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if mode == 'centroid' and len(ids):
+            sums = np.zeros((len(ids), embeddings.shape[1]), dtype=np.float32)
+            np.add.at(sums, owners, l2_normalize(embeddings))
+            return cls(ids, sums, student_ids=keys)
+        if mode not in ('max', 'centroid'):
+            raise ValueError(f"Unknown gallery mode {mode}; expected 'max' or 'centroid'")
+
+        return cls(ids, embeddings, student_ids=keys, owners=owners)
+
+    @classmethod
+    def from_database(cls, database):
+        """
+        Build a gallery from a student_id -> {"embeddings": ...} dictionary
+        as returned by load_student_embeddings
+        """
+        ids = []
+        vectors = []
+        for student_id, student_data in (database or {}).items():
+            if not isinstance(student_data, dict) or student_data.get("embeddings") is None:
+                continue
+            ids.append(student_id)
+            vectors.append(np.asarray(student_data["embeddings"], dtype=np.float32))
+        return cls(ids, np.stack(vectors) if vectors else np.zeros((0, 0), dtype=np.float32))
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def template_count(self):
+        return len(self.embeddings)
+
+    @property
+    def dim(self):
+        return self.embeddings.shape[1] if len(self) else 0
+
+    def centroids(self):
+        """Return (ids, one normalized mean template per identity)"""
+        if self.segment_starts is None:
+            return self.ids, self.embeddings
+        sums = np.add.reduceat(self.embeddings, self.segment_starts, axis=0)
+        return self.ids, l2_normalize(sums)
+
+    def scores(self, embeddings):
+        """Cosine similarity of each query embedding (rows) against every identity's best template"""
+        queries = l2_normalize(np.atleast_2d(embeddings))
+        scores = queries @ self.embeddings.T
+        if self.segment_starts is None:
+            return scores
+        return np.maximum.reduceat(scores, self.segment_starts, axis=1)
+
+    def match(self, embeddings, threshold=0.4):
+        """
+        Match all faces of a frame against the gallery in one pass
+
+        Args:
+            embeddings: (faces x dim) query embeddings
+            threshold: Minimum cosine similarity for a match
+
+        Returns:
+            List with, for every face, {"student_id", "confidence"} or None
+        """
+        if len(self) == 0 or embeddings is None or len(embeddings) == 0:
+            return [None] * (0 if embeddings is None else len(embeddings))
+
+        matches = []
+        for assignment in assign_matches(self.scores(embeddings), threshold):
+            if assignment is None:
+                matches.append(None)
+                continue
+            col, score = assignment
+            matches.append({"student_id": self.ids[col], "confidence": score})
+        return matches
@@ -0,0 +1,226 @@
+import os
+import sys
+import time
+import logging
+import cv2
+import numpy as np
+from utils.embedding_models import get_embedding_model_spec
+
+# Configure logger
+logger = logging.getLogger(__name__)
+
+# ONNX Runtime is optional; only the onnxruntime backend needs it
+try:
+    import onnxruntime as ort
+    ONNXRUNTIME_AVAILABLE = True
+except ImportError:
+    ort = None
+    ONNXRUNTIME_AVAILABLE = False
+
+# Backend running the embedding model: tensorflow (Keras through DeepFace) or onnxruntime
+FACE_INFERENCE_BACKEND = os.environ.get('FACE_INFERENCE_BACKEND', 'tensorflow').lower()
+
+# Exported ONNX model (defaults to onnx_models/<model name>.onnx), whether to run its
+# dynamically int8-quantized copy, and ONNX Runtime threads per process (0 = all cores)
+FACE_ONNX_MODEL_PATH = os.environ.get('FACE_ONNX_MODEL_PATH')
+FACE_ONNX_QUANTIZE = os.environ.get('FACE_ONNX_QUANTIZE', 'False').lower() == 'true'
+FACE_ONNX_THREADS = int(os.environ.get('FACE_ONNX_THREADS', 0))
+
+ONNX_MODEL_DIR = 'onnx_models'
+
+class EmbeddingBackend:
+    """Runs the embedding model on a batch of prepared (N x H x W x 3 float32) face crops"""
+
+    name = None
+
+    def __init__(self, spec):
+        self.spec = spec
+
+    def embed(self, batch):
+        """Return the (N x dim) float32 embeddings of a batch"""
+        raise NotImplementedError
+
+    def describe(self):
+        return f"{self.name} ({self.spec.tag})"
+
+class TensorFlowBackend(EmbeddingBackend):
+    """The Keras model built by DeepFace, called directly instead of through predict()"""
+
+    name = 'tensorflow'
+
+    def __init__(self, spec):
+        super().__init__(spec)
+        from deepface import DeepFace
+        model = DeepFace.build_model(spec.deepface_name)
+        # Newer DeepFace wraps the Keras model in a client object
+        self.model = getattr(model, 'model', model)
+
+    def embed(self, batch):
+        return np.asarray(self.model(batch, training=False), dtype=np.float32)
+
+class OnnxRuntimeBackend(EmbeddingBackend):
+    """An exported copy of the model on ONNX Runtime's CPU provider, optionally int8-quantized"""
+
+    name = 'onnxruntime'
+
+    def __init__(self, spec, model_path=None, quantize=None):
+        super().__init__(spec)
+        if not ONNXRUNTIME_AVAILABLE:
+            raise RuntimeError("onnxruntime is not installed")
+
+        model_path = model_path or onnx_model_path(spec)
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(
+                f"ONNX model {model_path} not found; export it with `python -m utils.inference_backends export`"
+            )
+        self.quantized = FACE_ONNX_QUANTIZE if quantize is None else quantize
+        if self.quantized:
+            model_path = quantize_onnx_model(model_path)
+        self.model_path = model_path
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if FACE_ONNX_THREADS:
+            options.intra_op_num_threads = FACE_ONNX_THREADS
+        self.session = ort.InferenceSession(model_path, sess_options=options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def embed(self, batch):
+        output = self.session.run(None, {self.input_name: np.asarray(batch, dtype=np.float32)})[0]
+        return np.asarray(output, dtype=np.float32)
+
+    def describe(self):
+        return f"{self.name}{' int8' if self.quantized else ''} ({self.spec.tag}, {self.model_path})"
+
+BACKENDS = {
+    TensorFlowBackend.name: TensorFlowBackend,
+    OnnxRuntimeBackend.name: OnnxRuntimeBackend,
+}
+
+def onnx_model_path(spec):
+    return FACE_ONNX_MODEL_PATH or os.path.join(ONNX_MODEL_DIR, f"{spec.name}.onnx")
+
+def quantize_onnx_model(model_path):
+    """
+    Return the path of the dynamically int8-quantized copy of an ONNX model, creating
+    it next to the model when missing or older than the model
+    """
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    root, ext = os.path.splitext(model_path)
+    quantized_path = f"{root}.int8{ext}"
+    if not os.path.exists(quantized_path) or os.path.getmtime(quantized_path) < os.path.getmtime(model_path):
+        # Write under a temporary name so concurrent workers never load a partial file
+        tmp_path = f"{root}.int8.{os.getpid()}.tmp{ext}"
+        # Unsigned weights: the CPU provider has no ConvInteger kernel for signed ones
+        quantize_dynamic(model_path, tmp_path, weight_type=QuantType.QUInt8)
+        os.replace(tmp_path, quantized_path)
+        logger.info(f"Quantized {model_path} to {quantized_path}")
+    return quantized_path
+
+def create_backend(name=None, spec=None, **kwargs):
+    """Build the embedding backend called name (FACE_INFERENCE_BACKEND by default)"""
+    name = (name or FACE_INFERENCE_BACKEND).lower()
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown inference backend {name}; expected one of {', '.join(BACKENDS)}")
+    return BACKENDS[name](spec or get_embedding_model_spec(), **kwargs)
+
+def export_onnx(spec=None, model_path=None, opset=13):
+    """Export the Keras embedding model to ONNX (needs tensorflow and tf2onnx)"""
+    import tensorflow as tf
+    import tf2onnx
+
+    spec = spec or get_embedding_model_spec()
+    model_path = model_path or onnx_model_path(spec)
+    os.makedirs(os.path.dirname(model_path) or '.', exist_ok=True)
+
+    keras_model = TensorFlowBackend(spec).model
+    signature = (tf.TensorSpec((None, *spec.input_size, 3), tf.float32, name='input'),)
+    tf2onnx.convert.from_keras(keras_model, input_signature=signature, opset=opset, output_path=model_path)
+    logger.info(f"Exported {spec.tag} to {model_path}")
+    return model_path
+
+def parity_inputs(spec, face_data_dir='face_data', limit=32):
+    """
+    Prepared model inputs for a parity check: the aligned faces of the stored face
+    images, or random crops when there are none
+    """
+    from utils.advanced_face_recognition import _prepare_embedding_input, align_faces, detect_faces_with_keypoints
+
+    inputs = []
+    if os.path.isdir(face_data_dir):
+        for filename in sorted(os.listdir(face_data_dir))[:limit]:
+            img = cv2.imread(os.path.join(face_data_dir, filename)) if filename.endswith('.jpg') else None
+            if img is None:
+                continue
+            faces, keypoints = detect_faces_with_keypoints(img, tiled=False)
+            for face_img in align_faces(img, faces[:1], keypoints=keypoints[:1]):
+                prepared = _prepare_embedding_input(face_img)
+                if prepared is not None:
+                    inputs.append(prepared)
+
+    if not inputs:
+        rng = np.random.default_rng(0)
+        inputs = list(rng.random((8, *spec.input_size, 3), dtype=np.float32))
+    return np.stack(inputs)
+
+def _timed_embed(backend, inputs, repeats):
+    backend.embed(inputs[:1])
+    start = time.perf_counter()
+    for _ in range(repeats):
+        output = backend.embed(inputs)
+    return output, (time.perf_counter() - start) * 1000 / (repeats * len(inputs))
+
+def check_parity(reference, candidate, inputs, repeats=3):
+    """
+    Compare the embeddings two backends produce for the same inputs
+
+    Returns:
+        Dictionary with the minimum and mean cosine similarity, the largest absolute
+        difference and the per-face latency of both backends
+    """
+    from utils.gallery import l2_normalize
+
+    expected, reference_ms = _timed_embed(reference, inputs, repeats)
+    actual, candidate_ms = _timed_embed(candidate, inputs, repeats)
+    cosine = np.sum(l2_normalize(expected) * l2_normalize(actual), axis=1)
+    return {
+        'reference': reference.describe(),
+        'candidate': candidate.describe(),
+        'faces': len(inputs),
+        'min_cosine': float(cosine.min()),
+        'mean_cosine': float(cosine.mean()),
+        'max_abs_diff': float(np.max(np.abs(expected - actual))),
+        'reference_ms_per_face': round(reference_ms, 2),
+        'candidate_ms_per_face': round(candidate_ms, 2)
+    }
+
+def main(argv):
+    """
+    python -m utils.inference_backends export
+    python -m utils.inference_backends parity [reference] [candidate] [--int8]
+    """
+    logging.basicConfig(level=logging.INFO)
+    command = argv[0] if argv else 'parity'
+
+    if command == 'export':
+        print(export_onnx())
+        return 0
+
+    if command == 'parity':
+        names = [arg for arg in argv[1:] if not arg.startswith('--')]
+        reference = create_backend(names[0] if names else TensorFlowBackend.name)
+        candidate_name = names[1] if len(names) > 1 else OnnxRuntimeBackend.name
+        kwargs = {'quantize': True} if '--int8' in argv and candidate_name == OnnxRuntimeBackend.name else {}
+        candidate = create_backend(candidate_name, **kwargs)
+
+        result = check_parity(reference, candidate, parity_inputs(reference.spec))
+        for key, value in result.items():
+            print(f"{key}: {value}")
+        return 0
+
+    print(main.__doc__)
+    return 1
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
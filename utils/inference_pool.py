@@ -0,0 +1,188 @@
+import os
+import atexit
+import logging
+import threading
+import numpy as np
+import multiprocessing
+from collections import OrderedDict
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+
+# Configure logger
+logger = logging.getLogger(__name__)
+
+# Number of dedicated face-inference processes per web worker (0 runs recognition in the request thread)
+INFERENCE_WORKERS = int(os.environ.get('INFERENCE_WORKERS', 0))
+
+# Seconds to wait for a frame to be processed by the pool
+INFERENCE_TIMEOUT = float(os.environ.get('INFERENCE_TIMEOUT', 120))
+
+# Galleries and campus indexes each inference process keeps between frames
+INFERENCE_GALLERY_CACHE_SIZE = int(os.environ.get('INFERENCE_GALLERY_CACHE_SIZE', 8))
+
+# Models used by recognize_students_in_image
+RECOGNITION_MODELS = ('face_detection', 'face_mesh', 'embedding_model')
+
+_pool = None
+_pool_lock = threading.Lock()
+
+# Returned by an inference process asked to use a gallery it does not hold
+_CACHE_MISS = 'gallery-cache-miss'
+
+# cache_key -> Gallery or IVFIndex, in the inference process (least recently used first)
+_worker_galleries = OrderedDict()
+
+def _init_worker():
+    """Runs once in every inference process: build (and optionally warm) its own models"""
+    from utils.model_warmup import WARM_UP_MODELS, load_models
+    load_models(warm_up=WARM_UP_MODELS, names=RECOGNITION_MODELS)
+
+def _ping_worker():
+    return os.getpid()
+
+def _worker_gallery(key, value):
+    """
+    Return the gallery (or index) sent with a task, keeping it under key, or this
+    process's copy of key when none was sent (None if it holds none)
+    """
+    if key is None:
+        return value
+    if value is None:
+        value = _worker_galleries.get(key)
+        if value is not None:
+            _worker_galleries.move_to_end(key)
+        return value
+
+    _worker_galleries[key] = value
+    while len(_worker_galleries) > INFERENCE_GALLERY_CACHE_SIZE:
+        _worker_galleries.popitem(last=False)
+    return value
+
+def _recognize_in_worker(shm_name, shape, dtype, gallery_key, gallery, index_key, fallback_index, draw_detections,
+                         annotation_max_side, source):
+    """
+    Recognize students in a frame living in shared memory
+
+    A gallery or index with a cache key may be sent as the key alone; if this
+    process does not hold it, _CACHE_MISS is returned and the task is sent again
+    with the arrays. The annotated image (never larger than the frame) is written
+    back into the start of the same buffer, so only the small result list and its
+    shape travel through the pipe.
+    """
+    from utils.advanced_face_recognition import recognize_students_in_image
+
+    gallery = _worker_gallery(gallery_key, gallery)
+    fallback_index = _worker_gallery(index_key, fallback_index)
+    if gallery is None or (index_key is not None and fallback_index is None):
+        return _CACHE_MISS
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        frame = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        report = {}
+        recognized_students, annotated_img = recognize_students_in_image(
+            frame, gallery, draw_detections=draw_detections, fallback_index=fallback_index,
+            annotation_max_side=annotation_max_side, source=source, report=report
+        )
+        del frame
+
+        annotated_shape = None
+        if annotated_img is not None:
+            annotated_shape = annotated_img.shape
+            np.ndarray(annotated_shape, dtype=dtype, buffer=shm.buf)[:] = annotated_img
+        return recognized_students, annotated_shape, report
+    finally:
+        shm.close()
+
+class InferencePool:
+    """
+    Pool of face-inference processes, each owning its own detector, mesh and embedding models
+
+    Decoded frames are handed over through ``multiprocessing.shared_memory`` so pixels are
+    never pickled. Cached galleries and campus indexes (those with a ``cache_key``) are
+    kept by every process, so they are only pickled the first time a process needs them.
+    Processes are spawned (not forked) so no TensorFlow or MediaPipe state is
+    inherited from the web worker.
+    """
+
+    def __init__(self, n_workers):
+        self.n_workers = n_workers
+        self._executor = ProcessPoolExecutor(
+            max_workers=n_workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker
+        )
+
+    def recognize(self, img, gallery, fallback_index=None, draw_detections=True, annotation_max_side=0,
+                  source=None, report=None, timeout=None):
+        """
+        Run recognize_students_in_image in a pool process
+        A FullResolutionSource for a reduced img is sent along (as its encoded bytes),
+        and the worker's report (rejected faces, stage timings) is merged into report if given
+
+        Returns:
+            (recognized_students, annotated_img) like recognize_students_in_image
+        """
+        img = np.ascontiguousarray(img)
+        shm = shared_memory.SharedMemory(create=True, size=img.nbytes)
+        try:
+            frame = np.ndarray(img.shape, dtype=img.dtype, buffer=shm.buf)
+            frame[:] = img
+
+            del frame
+
+            gallery_key = getattr(gallery, 'cache_key', None)
+            index_key = getattr(fallback_index, 'cache_key', None)
+
+            def run(send_cached):
+                future = self._executor.submit(
+                    _recognize_in_worker, shm.name, img.shape, img.dtype.str,
+                    gallery_key, gallery if send_cached or gallery_key is None else None,
+                    index_key, fallback_index if send_cached or index_key is None else None,
+                    draw_detections, annotation_max_side, source
+                )
+                return future.result(timeout=timeout or INFERENCE_TIMEOUT)
+
+            result = run(send_cached=False)
+            if result == _CACHE_MISS:
+                result = run(send_cached=True)
+            recognized_students, annotated_shape, worker_report = result
+            if report is not None:
+                # Merge the stage timings into the caller's (which may already hold some)
+                worker_timings = worker_report.pop('timings', {})
+                report.update(worker_report)
+                report.setdefault('timings', {}).update(worker_timings)
+
+            annotated_img = None
+            if annotated_shape is not None:
+                annotated_img = np.ndarray(annotated_shape, dtype=img.dtype, buffer=shm.buf).copy()
+            return recognized_students, annotated_img
+        finally:
+            shm.close()
+            shm.unlink()
+
+    def warm_up(self, timeout=None):
+        """
+        Start every pool process and wait for its models to be built
+        Returns the process ids that answered
+        """
+        futures = [self._executor.submit(_ping_worker) for _ in range(self.n_workers)]
+        return sorted({future.result(timeout=timeout or INFERENCE_TIMEOUT) for future in futures})
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+def get_inference_pool():
+    """
+    Return this process's inference pool, or None when INFERENCE_WORKERS is 0
+    """
+    global _pool
+    if INFERENCE_WORKERS <= 0:
+        return None
+
+    with _pool_lock:
+        if _pool is None:
+            _pool = InferencePool(INFERENCE_WORKERS)
+            atexit.register(_pool.shutdown)
+            logger.info(f"Started face inference pool with {INFERENCE_WORKERS} processes")
+        return _pool
@@ -0,0 +1,203 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+
+# Bearer token /metrics requires when set (otherwise it is open, like most scrape targets)
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+# Histogram buckets in seconds, from a fast match up to a slow full snapshot
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"'))
+        for name, value in labels
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+class _Metric:
+    """
+    A metric family kept in process memory
+
+    Values are keyed by the tuple of label values, in the order of labelnames.
+    """
+
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def _samples(self):
+        """(suffix, label pairs, value) for every exposed sample"""
+        with self._lock:
+            return [('', list(zip(self.labelnames, key)), value) for key, value in sorted(self._values.items())]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for suffix, labels, value in self._samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+        return lines
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(_Metric):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    def _samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total) in sorted(self._values.items()):
+                labels = list(zip(self.labelnames, key))
+                for bound, count in zip(self.buckets, counts):
+                    samples.append(('_bucket', labels + [('le', _format_value(bound))], count))
+                samples.append(('_sum', labels, total))
+                samples.append(('_count', labels, counts[-1]))
+        return samples
+
+REGISTRY = []
+
+# Functions run before every scrape to refresh gauges that describe current state
+_collectors = []
+
+def register_collector(fn):
+    """Run fn (which sets gauges) before every scrape"""
+    _collectors.append(fn)
+    return fn
+
+STAGE_SECONDS = Histogram(
+    'attendance_stage_seconds',
+    'Time spent in each stage of snapshot attendance',
+    ['stage']
+)
+REQUEST_SECONDS = Histogram(
+    'http_request_duration_seconds',
+    'HTTP request latency by endpoint',
+    ['endpoint']
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    'http_requests_in_flight',
+    'HTTP requests being handled by this worker'
+)
+ATTENDANCE_FACES = Counter(
+    'attendance_faces_total',
+    'Faces seen in attendance snapshots by outcome',
+    ['outcome']
+)
+GALLERY_CACHE_REQUESTS = Counter(
+    'gallery_cache_requests_total',
+    'Course gallery and campus index cache lookups',
+    ['kind', 'result']
+)
+EMBEDDING_CACHE_FILES = Counter(
+    'embedding_cache_files_total',
+    'Face images looked up in the on-disk embedding cache',
+    ['result']
+)
+GALLERY_STUDENTS = Gauge(
+    'gallery_students',
+    'Students in each cached gallery',
+    ['gallery']
+)
+GALLERY_TEMPLATES = Gauge(
+    'gallery_templates',
+    'Face templates in each cached gallery',
+    ['gallery']
+)
+
+@contextmanager
+def timed(stage, timings=None):
+    """Add the time spent in the block to timings[stage] (milliseconds), if timings is a dict"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timings is not None:
+            timings[stage] = round(timings.get(stage, 0) + (time.perf_counter() - start) * 1000, 1)
+
+def observe_stage_timings(timings):
+    """Record a request's per-stage timings (milliseconds) in the stage histogram"""
+    for stage, ms in timings.items():
+        STAGE_SECONDS.observe(ms / 1000, stage=stage)
+
+def render_metrics():
+    """All metrics of this process in the Prometheus text exposition format"""
+    for collector in _collectors:
+        collector()
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+def init_request_metrics(app):
+    """Count in-flight requests and time every request by endpoint"""
+    from flask import g, request
+
+    @app.before_request
+    def _start_request_timer():
+        g.metrics_start = time.perf_counter()
+        REQUESTS_IN_FLIGHT.inc()
+
+    @app.teardown_request
+    def _stop_request_timer(exc):
+        start = g.pop('metrics_start', None)
+        if start is None:
+            return
+        REQUESTS_IN_FLIGHT.dec()
+        REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=request.endpoint or 'unmatched')
@@ -0,0 +1,170 @@
+import os
+import time
+import logging
+import threading
+import numpy as np
+
+# Configure logger
+logger = logging.getLogger(__name__)
+
+# Build the models in the gunicorn master (with --preload) so workers share them copy-on-write
+PRELOAD_MODELS = os.environ.get('PRELOAD_MODELS', 'False').lower() == 'true'
+
+# Run a dummy inference on every model when a worker starts
+WARM_UP_MODELS = os.environ.get('WARM_UP_MODELS', 'False').lower() == 'true'
+
+# model name -> {"loaded", "warm", "load_ms", "warmup_ms", "error"}
+_status = {}
+# Models this process was asked to warm; readiness waits for all of them
+_expected = set()
+_status_lock = threading.Lock()
+
+def _load_face_detection():
+    from utils import advanced_face_recognition
+    return advanced_face_recognition.face_detection
+
+def _warm_face_detection(detector):
+    detector.process(np.zeros((240, 320, 3), dtype=np.uint8))
+
+def _load_face_mesh():
+    from utils import advanced_face_recognition
+    return advanced_face_recognition.face_mesh
+
+def _warm_face_mesh(mesh):
+    mesh.process(np.zeros((160, 160, 3), dtype=np.uint8))
+
+def _load_embedding_model():
+    from utils.advanced_face_recognition import get_embedding_backend
+    return get_embedding_backend()
+
+def _warm_embedding_model(model):
+    from utils.advanced_face_recognition import EMBEDDING_INPUT_SIZE, extract_embeddings_batch
+    extract_embeddings_batch([np.zeros((*EMBEDDING_INPUT_SIZE, 3), dtype=np.uint8)])
+
+# name -> (loader, warm-up); loaders construct the model, warm-ups run one dummy inference
+MODELS = {
+    'face_detection': (_load_face_detection, _warm_face_detection),
+    'face_mesh': (_load_face_mesh, _warm_face_mesh),
+    'embedding_model': (_load_embedding_model, _warm_embedding_model),
+}
+
+def _set_status(name, **fields):
+    with _status_lock:
+        _status.setdefault(name, {
+            'loaded': False,
+            'warm': False,
+            'load_ms': None,
+            'warmup_ms': None,
+            'error': None
+        }).update(fields)
+
+def load_models(warm_up=False, names=None):
+    """
+    Construct every recognition model (or only those in names), optionally running
+    a dummy inference on each
+
+    Safe to call in the gunicorn master before forking (warm_up=False) and again
+    in each worker (warm_up=True); models that are already built are reused.
+    Returns the per-model status
+    """
+    for name, (loader, warmer) in MODELS.items():
+        if names is not None and name not in names:
+            continue
+
+        if warm_up:
+            with _status_lock:
+                _expected.add(name)
+
+        try:
+            start = time.perf_counter()
+            model = loader()
+            load_ms = (time.perf_counter() - start) * 1000
+            with _status_lock:
+                already_loaded = _status.get(name, {}).get('loaded')
+            if not already_loaded:
+                _set_status(name, loaded=True, load_ms=round(load_ms, 1), error=None)
+
+            if warm_up:
+                start = time.perf_counter()
+                warmer(model)
+                warmup_ms = (time.perf_counter() - start) * 1000
+                _set_status(name, warm=True, warmup_ms=round(warmup_ms, 1))
+                logger.info(f"Model {name} warm (load {load_ms:.0f} ms, warm-up {warmup_ms:.0f} ms)")
+        except Exception as e:
+            _set_status(name, error=str(e))
+            logger.error(f"Error loading model {name}: {str(e)}")
+
+    return get_model_status()
+
+def _warm_inference_pool(pool):
+    """Spawn the inference processes and wait until each has built its models"""
+    with _status_lock:
+        _expected.add('inference_pool')
+    try:
+        start = time.perf_counter()
+        pool.warm_up()
+        warmup_ms = (time.perf_counter() - start) * 1000
+        _set_status('inference_pool', loaded=True, warm=True, warmup_ms=round(warmup_ms, 1), error=None)
+        logger.info(f"Inference pool warm ({pool.n_workers} processes, {warmup_ms:.0f} ms)")
+    except Exception as e:
+        _set_status('inference_pool', error=str(e))
+        logger.error(f"Error warming inference pool: {str(e)}")
+
+def warm_up_models():
+    """
+    Build and warm every model in the current (worker) process
+    When the inference pool is enabled, recognition models live in the pool
+    processes instead, so only the pool is started here
+    """
+    from utils.inference_pool import RECOGNITION_MODELS, get_inference_pool
+
+    pool = get_inference_pool()
+    if pool is None:
+        return load_models(warm_up=True)
+
+    load_models(warm_up=True, names=[name for name in MODELS if name not in RECOGNITION_MODELS])
+    _warm_inference_pool(pool)
+    return get_model_status()
+
+def get_model_status():
+    """Return a copy of the per-model load/warm status for this process"""
+    with _status_lock:
+        return {name: dict(status) for name, status in _status.items()}
+
+def get_model_errors():
+    """Return model name -> error message for the expected models that failed to load or warm"""
+    status = get_model_status()
+    with _status_lock:
+        expected = set(_expected)
+    return {
+        name: status[name]['error']
+        for name in sorted(expected)
+        if name in status and status[name]['error'] is not None
+    }
+
+def is_ready():
+    """
+    A worker is ready when warm-up is disabled (models load lazily) or every model
+    it was asked to warm has been warmed; a model that failed keeps it unready
+    """
+    if not WARM_UP_MODELS:
+        return True
+
+    status = get_model_status()
+    with _status_lock:
+        expected = set(_expected)
+    if not expected:
+        return False
+    return all(
+        name in status and status[name]['warm'] and status[name]['error'] is None
+        for name in expected
+    )
+
+def start_warm_up():
+    """
+    Warm the models in a background thread, so that the worker starts serving
+    /healthz/ready (503 until warm) instead of blocking until warm-up is done
+    """
+    thread = threading.Thread(target=warm_up_models, name='model-warmup', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,158 @@
+import os
+import logging
+import threading
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+# Configure logger
+logger = logging.getLogger(__name__)
+
+# Threads that embed face images in parallel, and students handled per committed batch
+REEMBED_WORKERS = int(os.environ.get('REEMBED_WORKERS', 4))
+REEMBED_BATCH_SIZE = int(os.environ.get('REEMBED_BATCH_SIZE', 64))
+
+# Re-embed automatically at startup when stored embeddings are of another model
+REEMBED_ON_START = os.environ.get('REEMBED_ON_START', 'True').lower() == 'true'
+
+# A running job without a heartbeat for this many seconds is assumed lost
+REEMBED_STALE_AFTER = int(os.environ.get('REEMBED_STALE_AFTER', 600))
+
+FACE_DATA_DIR = 'face_data'
+
+_thread = None
+_thread_lock = threading.Lock()
+
+def _pending_query(model_tag):
+    """Students whose stored embedding is missing or produced by another model"""
+    from models.models import Student
+
+    return Student.query.filter(
+        (Student.face_embedding_model != model_tag) | (Student.face_embedding_model == None)
+    )
+
+def _embed(roll_number):
+    from utils.advanced_face_recognition import embed_face_image
+
+    path = os.path.join(FACE_DATA_DIR, f"student_{roll_number}.jpg")
+    if not os.path.exists(path):
+        return None
+    return embed_face_image(path)
+
+def _is_stale(job):
+    heartbeat = job.updated_at or job.started_at
+    return heartbeat is None or datetime.utcnow() - heartbeat > timedelta(seconds=REEMBED_STALE_AFTER)
+
+def _run(app, job_id):
+    """Thread entry point: re-embed every pending student, one committed batch at a time"""
+    from app import db
+    from models.models import EmbeddingJob, Student
+    from utils.course_gallery import invalidate_course_galleries
+
+    with app.app_context():
+        job = EmbeddingJob.query.get(job_id)
+        try:
+            # Walk the pending students by id so that students whose image cannot be
+            # embedded are passed over instead of being picked up again
+            cursor = 0
+            with ThreadPoolExecutor(max_workers=max(1, REEMBED_WORKERS),
+                                    thread_name_prefix='reembed') as executor:
+                while True:
+                    students = _pending_query(job.model_tag).filter(
+                        Student.id > cursor
+                    ).order_by(Student.id).limit(REEMBED_BATCH_SIZE).all()
+                    if not students:
+                        break
+                    cursor = students[-1].id
+
+                    embeddings = executor.map(_embed, [student.roll_number for student in students])
+                    for student, embedding in zip(students, embeddings):
+                        if embedding is None:
+                            job.failed += 1
+                        else:
+                            student.set_face_encoding(embedding, job.model_tag)
+                        job.processed += 1
+
+                    job.updated_at = datetime.utcnow()
+                    db.session.commit()
+
+            job.status = 'done'
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error in re-embedding job {job_id}: {str(e)}")
+            job = EmbeddingJob.query.get(job_id)
+            job.status = 'failed'
+            job.error = str(e)
+
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+        logger.info(f"Re-embedding job {job_id} {job.status}: {job.processed} students, {job.failed} without an embedding")
+
+        # Galleries cached from the old vectors are rebuilt from the new ones
+        invalidate_course_galleries()
+
+def get_reembed_status():
+    """Return the latest re-embedding job and how many students still need the canonical model"""
+    from models.models import EmbeddingJob, Student
+    from utils.advanced_face_recognition import EMBEDDING_MODEL_TAG
+
+    job = EmbeddingJob.query.order_by(EmbeddingJob.id.desc()).first()
+    return {
+        'model_tag': EMBEDDING_MODEL_TAG,
+        'students': Student.query.count(),
+        'pending': _pending_query(EMBEDDING_MODEL_TAG).count(),
+        'job': job.to_dict() if job else None
+    }
+
+def start_reembedding(app):
+    """
+    Start re-embedding pending students with the canonical model in a background thread
+
+    A job already running (in this or another worker) is returned instead of starting
+    a second one; a running job whose heartbeat stopped is marked failed and replaced.
+
+    Returns:
+        (EmbeddingJob, whether a new job was started)
+    """
+    from app import db
+    from models.models import EmbeddingJob
+    from utils.advanced_face_recognition import EMBEDDING_MODEL_TAG
+
+    global _thread
+    with _thread_lock:
+        running = EmbeddingJob.query.filter_by(status='running').order_by(EmbeddingJob.id.desc()).first()
+        if running and not _is_stale(running):
+            return running, False
+        if running:
+            running.status = 'failed'
+            running.error = 'Re-embedding was interrupted'
+            running.finished_at = datetime.utcnow()
+
+        job = EmbeddingJob(
+            model_tag=EMBEDDING_MODEL_TAG,
+            status='running',
+            total=_pending_query(EMBEDDING_MODEL_TAG).count()
+        )
+        db.session.add(job)
+        db.session.commit()
+
+        _thread = threading.Thread(target=_run, args=(app, job.id), name='reembed', daemon=True)
+        _thread.start()
+        return job, True
+
+def resume_or_start_reembedding(app):
+    """
+    Re-embed at startup if any stored embedding is of another model; an interrupted
+    job simply starts over on the students that are still pending
+    """
+    from models.models import Student
+    from utils.advanced_face_recognition import EMBEDDING_MODEL_TAG
+
+    with app.app_context():
+        try:
+            outdated = _pending_query(EMBEDDING_MODEL_TAG).filter(Student.face_embedding != None).count()
+            if outdated:
+                job, started = start_reembedding(app)
+                if started:
+                    logger.info(f"Re-embedding {job.total} students with {EMBEDDING_MODEL_TAG}")
+        except Exception as e:
+            logger.error(f"Could not start re-embedding: {str(e)}")
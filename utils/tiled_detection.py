@@ -0,0 +1,193 @@
+import os
+import time
+import logging
+import threading
+import cv2
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+# Configure logger
+logger = logging.getLogger(__name__)
+
+# Search overlapping tiles of snapshots (in addition to the whole image) to find the
+# small faces at the back of large rooms
+FACE_DETECTION_TILING = os.environ.get('FACE_DETECTION_TILING', 'False').lower() == 'true'
+
+# Tile side in pixels, overlap between neighbouring tiles (fraction of the tile side) and
+# scale the image is resized by before tiling (below 1 trades recall for latency)
+FACE_DETECTION_TILE_SIZE = int(os.environ.get('FACE_DETECTION_TILE_SIZE', 640))
+FACE_DETECTION_TILE_OVERLAP = float(os.environ.get('FACE_DETECTION_TILE_OVERLAP', 0.25))
+FACE_DETECTION_TILE_SCALE = float(os.environ.get('FACE_DETECTION_TILE_SCALE', 1.0))
+
+# Threads detecting tiles in parallel, and the IoU above which overlapping boxes are merged
+FACE_DETECTION_TILE_WORKERS = int(os.environ.get('FACE_DETECTION_TILE_WORKERS', 4))
+FACE_DETECTION_NMS_IOU = float(os.environ.get('FACE_DETECTION_NMS_IOU', 0.3))
+
+# Boxes this close (pixels) to a tile edge inside the image are cut off; the overlap
+# guarantees the face is seen whole in a neighbouring tile
+_EDGE_MARGIN = 2
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=max(1, FACE_DETECTION_TILE_WORKERS),
+                thread_name_prefix='detect-tile'
+            )
+        return _executor
+
+def tile_grid(width, height, tile_size, overlap):
+    """
+    Cover a width x height image with overlapping square tiles
+
+    Returns:
+        List of (x, y, w, h) tiles; the last row and column are aligned with the image edge
+    """
+    tile_size = max(1, int(tile_size))
+    step = max(1, int(round(tile_size * (1 - min(max(overlap, 0.0), 0.9)))))
+
+    def starts(length):
+        if length <= tile_size:
+            return [0]
+        positions = list(range(0, length - tile_size, step))
+        positions.append(length - tile_size)
+        return positions
+
+    return [
+        (x, y, min(tile_size, width), min(tile_size, height))
+        for y in starts(height)
+        for x in starts(width)
+    ]
+
+def non_max_suppression(boxes, scores, iou_threshold=0.3):
+    """
+    Greedy non-maximum suppression over (x, y, w, h) boxes
+
+    The pairwise IoU matrix is computed once with NumPy; the greedy pass then only
+    ORs rows of it together.
+
+    Returns:
+        Indices of the kept boxes, highest score first
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    if len(boxes) == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    x1, y1 = boxes[:, 0], boxes[:, 1]
+    x2, y2 = x1 + boxes[:, 2], y1 + boxes[:, 3]
+    areas = boxes[:, 2] * boxes[:, 3]
+
+    inter_w = np.clip(np.minimum(x2[:, None], x2[None]) - np.maximum(x1[:, None], x1[None]), 0, None)
+    inter_h = np.clip(np.minimum(y2[:, None], y2[None]) - np.maximum(y1[:, None], y1[None]), 0, None)
+    inter = inter_w * inter_h
+    iou = inter / np.maximum(areas[:, None] + areas[None] - inter, 1e-9)
+
+    keep = []
+    suppressed = np.zeros(len(boxes), dtype=bool)
+    for i in np.argsort(-np.asarray(scores, dtype=np.float64), kind='stable'):
+        if suppressed[i]:
+            continue
+        keep.append(i)
+        suppressed |= iou[i] > iou_threshold
+    return np.asarray(keep, dtype=np.int64)
+
+def _touches_inner_edge(box, tile, width, height):
+    x, y, w, h = box
+    tx, ty, tw, th = tile
+    return (
+        (tx > 0 and x <= tx + _EDGE_MARGIN) or
+        (ty > 0 and y <= ty + _EDGE_MARGIN) or
+        (tx + tw < width and x + w >= tx + tw - _EDGE_MARGIN) or
+        (ty + th < height and y + h >= ty + th - _EDGE_MARGIN)
+    )
+
+def detect_tiled(img, detect_fn, full_image_fn=None, tile_size=None, overlap=None, scale=None,
+                 iou_threshold=None):
+    """
+    Detect faces on overlapping tiles of an image in parallel and merge the results
+
+    Args:
+        img: BGR image
+        detect_fn: Callable taking a BGR tile and returning (boxes, scores, keypoints) in
+                   tile coordinates; it is called from several threads at once
+        full_image_fn: Optional callable returning (boxes, scores, keypoints) for the whole
+                       image, run alongside the tiles to catch faces larger than the overlap
+        tile_size, overlap, scale, iou_threshold: Override the FACE_DETECTION_* settings
+
+    Returns:
+        (boxes, keypoints, report) with boxes and keypoints in img coordinates; report
+        holds the timing and face count of every tile
+    """
+    tile_size = tile_size or FACE_DETECTION_TILE_SIZE
+    overlap = FACE_DETECTION_TILE_OVERLAP if overlap is None else overlap
+    scale = scale or FACE_DETECTION_TILE_SCALE
+    iou_threshold = FACE_DETECTION_NMS_IOU if iou_threshold is None else iou_threshold
+
+    start = time.perf_counter()
+    work_img = img
+    if scale != 1.0:
+        ih, iw = img.shape[:2]
+        work_img = cv2.resize(img, (max(1, round(iw * scale)), max(1, round(ih * scale))),
+                              interpolation=cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR)
+    height, width = work_img.shape[:2]
+    tiles = tile_grid(width, height, tile_size, overlap)
+
+    def run_tile(tile):
+        tile_start = time.perf_counter()
+        tx, ty, tw, th = tile
+        boxes, scores, keypoints = detect_fn(work_img[ty:ty + th, tx:tx + tw])
+        found = []
+        for box, score, points in zip(boxes, scores, keypoints):
+            box = (box[0] + tx, box[1] + ty, box[2], box[3])
+            # Faces cut by the tile edge are found whole in the neighbouring tile
+            if len(tiles) > 1 and _touches_inner_edge(box, tile, width, height):
+                continue
+            if points is not None:
+                points = points + np.array([tx, ty], dtype=np.float32)
+            found.append((box, score, points))
+        return found, (time.perf_counter() - tile_start) * 1000
+
+    def run_full():
+        full_start = time.perf_counter()
+        boxes, scores, keypoints = full_image_fn()
+        # Bring the whole-image boxes into work_img coordinates
+        found = [
+            (tuple(v * scale for v in box), score, points * scale if points is not None else None)
+            for box, score, points in zip(boxes, scores, keypoints)
+        ]
+        return found, (time.perf_counter() - full_start) * 1000
+
+    executor = _get_executor()
+    full_future = executor.submit(run_full) if full_image_fn is not None else None
+    futures = [executor.submit(run_tile, tile) for tile in tiles]
+
+    candidates = []
+    report = {'image': [width, height], 'scale': scale, 'tiles': []}
+    for tile, future in zip(tiles, futures):
+        found, ms = future.result()
+        candidates.extend(found)
+        report['tiles'].append({'tile': list(tile), 'faces': len(found), 'ms': round(ms, 1)})
+    if full_future is not None:
+        found, ms = full_future.result()
+        candidates.extend(found)
+        report['full_image'] = {'faces': len(found), 'ms': round(ms, 1)}
+
+    keep = non_max_suppression([c[0] for c in candidates], [c[1] for c in candidates], iou_threshold)
+
+    ih, iw = img.shape[:2]
+    boxes = []
+    keypoints = []
+    for i in keep:
+        (x, y, w, h), _, points = candidates[i]
+        x = min(iw - 1, max(0, int(round(x / scale))))
+        y = min(ih - 1, max(0, int(round(y / scale))))
+        boxes.append((x, y, min(int(round(w / scale)), iw - x), min(int(round(h / scale)), ih - y)))
+        keypoints.append(points / scale if points is not None else None)
+
+    report['faces'] = len(boxes)
+    report['ms'] = round((time.perf_counter() - start) * 1000, 1)
+    return boxes, keypoints, report